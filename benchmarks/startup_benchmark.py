@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+DESCRIPTION = """Measures the import time of the CLI and GUI entry points, and fails if they exceed
+their start up budget or import any of the slow reader back-ends eagerly."""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Maximum cumulative import time for each entry point module [s]
+STARTUP_BUDGETS = {
+    "motec_log_generator": 0.3,
+    "motec_log_gui": 0.3,
+}
+
+# Modules which must only be imported once a log type that needs them is used
+LAZY_MODULES = ["cantools", "mcap", "mcap_protobuf", "google.protobuf", "requests"]
+
+# Modules which additionally must not be loaded before the GUI window is shown
+GUI_LAZY_MODULES = LAZY_MODULES + ["numpy", "ldparser"]
+
+def measure_import(module, repeats):
+    """ Imports a module in a fresh interpreter and returns the best cumulative import time [s]
+    along with the set of all modules that were imported.
+    """
+    best = None
+    imported = set()
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], \
+            cwd=REPO_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to import {module}:\n{result.stderr}")
+
+        # Lines have the format "import time: self [us] | cumulative | imported package"
+        cumulative = None
+        imported = set()
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+            if not match:
+                continue
+            name = match.group(4)
+            imported.add(name)
+            if name == module:
+                cumulative = int(match.group(2)) / 1e6
+
+        if cumulative is not None and (best is None or cumulative < best):
+            best = cumulative
+
+    return best, imported
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--repeats", type=int, default=5, \
+        help="Number of times to import each module, the fastest is used")
+    parser.add_argument("--budget_scale", type=float, default=1.0, \
+        help="Multiplier applied to all the budgets, for slow machines")
+
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in STARTUP_BUDGETS.items():
+        budget *= args.budget_scale
+        try:
+            import_time, imported = measure_import(module, args.repeats)
+        except RuntimeError as e:
+            print(f"ERROR: {e}")
+            failed = True
+            continue
+
+        lazy_modules = GUI_LAZY_MODULES if module == "motec_log_gui" else LAZY_MODULES
+        eager = [name for name in lazy_modules if name in imported]
+
+        status = "OK"
+        if import_time is None or import_time > budget or eager:
+            status = "FAIL"
+            failed = True
+
+        print("%-20s %8.3f s (budget %.3f s) %s" % (module, import_time or 0.0, budget, status))
+        for name in eager:
+            print(f"\t{name} is imported eagerly")
+
+    sys.exit(1 if failed else 0)
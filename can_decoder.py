@@ -0,0 +1,206 @@
+from collections import OrderedDict
+import numpy as np
+
+# Mask of the 29 bit id, dropping the extended frame flag SocketCAN and DBC files set on the ids
+CAN_EFF_MASK = 0x1FFFFFFF
+
+# Flag set on the ids of extended (29 bit) frames, as by SocketCAN
+CAN_EFF_FLAG = 0x80000000
+
+# Mask of the 11 bit id of standard frames
+CAN_SFF_MASK = 0x7FF
+
+# PDU formats below this are PDU1 (destination specific), where the PDU specific byte of the PGN
+# is the destination address rather than part of the PGN
+J1939_PDU2_FORMAT = 240
+
+def j1939_pgn(frame_id):
+    """ Returns the parameter group number of a 29 bit J1939 frame id. """
+    pgn = (frame_id >> 8) & 0x3FFFF
+    if (pgn >> 8) & 0xFF < J1939_PDU2_FORMAT:
+        pgn &= 0x3FF00
+
+    return pgn
+
+def j1939_source_address(frame_id):
+    return frame_id & 0xFF
+
+def is_extended(frame_id):
+    """ Returns True if a frame id is that of an extended frame, either because it has the
+    CAN_EFF_FLAG set or because it doesn't fit in 11 bits.
+    """
+    return bool(frame_id & CAN_EFF_FLAG) or frame_id & CAN_EFF_MASK > CAN_SFF_MASK
+
+class CanDecoder(object):
+    """ Decodes CAN frames with a DBC, skipping the decode of repeated payloads.
+
+    Frame ids are resolved to their message definitions with a lookup table, which is built once
+    per id seen in the log. Ids are matched exactly, except for J1939 messages which are matched by
+    their PGN, so the same message is matched regardless of the priority, source and destination
+    addresses in the frame id. Only extended frames are matched by PGN, standard frames only match
+    messages with their exact id. When several messages share a PGN, e.g. the same PGN from different
+    ECUs, frames are matched by their PGN and source address, and frames from other source
+    addresses go to the first of those messages.
+
+    Many frames (status, config, slow sensors) repeat the same payload for long stretches, so the
+    decoded signal values are memoized per CAN id. The last payload of each id is checked first,
+    followed by a small LRU cache of recent payloads, before falling back to a full decode.
+    """
+    def __init__(self, can_db, memo_size=32, j1939=None, source_address_suffix=False):
+        """
+        can_db: cantools.database
+        memo_size: Number of payloads to memoize per CAN id, zero disables the LRU cache
+        j1939: Match extended messages by PGN. By default only messages the DBC marks as J1939
+            (VFrameFormat J1939PG) are, True treats all extended messages as J1939
+        source_address_suffix: Append the source address of J1939 frames to the channel names,
+            e.g. EngSpeed_SA00, so the same signal from different ECUs ends up in separate channels
+        """
+        self.can_db = can_db
+        self.memo_size = memo_size
+        self.source_address_suffix = source_address_suffix
+
+        self.messages = {msg.frame_id & CAN_EFF_MASK: msg for msg in can_db.messages}
+        self.signals = {id: {sig.name: sig for sig in msg.signals} \
+            for id, msg in self.messages.items()}
+
+        # Database id of each J1939 PGN and source address, and the first database id of each PGN
+        # for frames from source addresses the database doesn't have
+        self.pgn_sources = {}
+        self.pgns = {}
+        for id, msg in self.messages.items():
+            if msg.is_extended_frame and (j1939 or (j1939 is None and msg.protocol == "j1939")):
+                pgn = j1939_pgn(id)
+                key = (pgn, j1939_source_address(id))
+                if key in self.pgn_sources:
+                    print("WARNING: Messages %s and %s have the same PGN %05X and source address " \
+                        "%02X, using %s" % (self.messages[self.pgn_sources[key]].name, msg.name, \
+                        pgn, key[1], self.messages[self.pgn_sources[key]].name))
+                    continue
+                self.pgn_sources[key] = id
+
+                if pgn in self.pgns:
+                    print("WARNING: Messages %s and %s have the same PGN %05X, frames are matched " \
+                        "by source address, and frames from other addresses are decoded as %s" % \
+                        (self.messages[self.pgns[pgn]].name, msg.name, pgn, \
+                        self.messages[self.pgns[pgn]].name))
+                else:
+                    self.pgns[pgn] = id
+        self.j1939_ids = set(self.pgn_sources.values())
+
+        # Database id (or None if unknown) and channel name suffix for each frame id in the log
+        self._lookup = {}
+
+        # Decoded signals for the last payload of each id, and an LRU of recent payloads per id
+        self._last = {}
+        self._memo = {}
+
+        self.last_hits = 0
+        self.memo_hits = 0
+        self.decodes = 0
+
+    def lookup(self, id):
+        """ Returns the database id and channel name suffix of a frame id, or None if the frame
+        does not match any message in the database.
+
+        id: Frame id, with CAN_EFF_FLAG set for extended frames, see is_extended
+        """
+        entry = self._lookup.get(id, False)
+        if entry is False:
+            entry = self._resolve(id)
+            self._lookup[id] = entry
+
+        return entry
+
+    def _resolve(self, id):
+        masked_id = id & CAN_EFF_MASK
+        if masked_id in self.messages and masked_id not in self.j1939_ids:
+            return masked_id, ""
+        if not is_extended(id):
+            return None
+
+        pgn = j1939_pgn(masked_id)
+        db_id = self.pgn_sources.get((pgn, j1939_source_address(masked_id)), self.pgns.get(pgn))
+        if db_id is None:
+            return None
+
+        suffix = ""
+        if self.source_address_suffix:
+            suffix = "_SA%02X" % j1939_source_address(masked_id)
+
+        return db_id, suffix
+
+    def known(self, id):
+        """ Returns True if the frame id matches a message in the database. """
+        return self.lookup(id) is not None
+
+    def known_mask(self, ids):
+        """ Returns a boolean array of which frame ids in an array match a message in the database.
+        Each unique id only has to be looked up once.
+        """
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        known = np.fromiter((self.known(int(id)) for id in unique_ids), dtype=bool, \
+            count=len(unique_ids))
+
+        return known[inverse]
+
+    def decode(self, id, data):
+        """ Decodes a frame, returning a list of (channel name, cantools signal, value) for each
+        signal present.
+
+        id: Arbitration id of the frame, must be known()
+        data: Frame payload
+        """
+        data = bytes(data)
+        last = self._last.get(id)
+        if last is not None and last[0] == data:
+            self.last_hits += 1
+            return last[1]
+
+        memo = self._memo.get(id)
+        if memo is None:
+            memo = OrderedDict()
+            self._memo[id] = memo
+
+        signals = memo.get(data)
+        if signals is not None:
+            memo.move_to_end(data)
+            self.memo_hits += 1
+        else:
+            signals = self._decode(id, data)
+            self.decodes += 1
+            if self.memo_size > 0:
+                memo[data] = signals
+                if len(memo) > self.memo_size:
+                    memo.popitem(last=False)
+
+        self._last[id] = (data, signals)
+        return signals
+
+    def _decode(self, id, data):
+        db_id, suffix = self.lookup(id)
+        decoded = self.messages[db_id].decode(data, decode_choices=False)
+
+        # Look the signals up by name, since multiplexed messages only contain some of them
+        signals = self.signals[db_id]
+        return [(name + suffix, signals[name], value) for name, value in decoded.items()]
+
+    def frames(self):
+        return self.last_hits + self.memo_hits + self.decodes
+
+    def hit_rate(self):
+        """ Returns the fraction of frames which didn't need to be decoded. """
+        frames = self.frames()
+        return (self.last_hits + self.memo_hits) / frames if frames else 0.0
+
+    def stats(self):
+        return {
+            "frames": self.frames(),
+            "decodes": self.decodes,
+            "last_payload_hits": self.last_hits,
+            "memo_hits": self.memo_hits,
+            "hit_rate": self.hit_rate(),
+        }
+
+    def __str__(self):
+        return "Decode cache: %d frames, %d decoded, %.1f%% hits (%d last payload, %d memo)" % \
+            (self.frames(), self.decodes, 100 * self.hit_rate(), self.last_hits, self.memo_hits)
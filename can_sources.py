@@ -0,0 +1,233 @@
+import itertools
+import re
+import numpy as np
+from can_decoder import CAN_EFF_FLAG, CAN_SFF_MASK
+
+# Number of log lines parsed at a time
+CHUNK_LINES = 200000
+
+# Number of lines inspected when auto detecting the format of a CAN log
+DETECT_LINES = 20
+
+# Flags byte of CAN FD frames in candump logs, ID##<flags><data>
+FD_FLAGS = re.compile(r"##[0-9A-Fa-f]")
+
+class CanFrames(object):
+    """ A chunk of CAN frames parsed from a log.
+
+    stamps: Array of timestamps [s]
+    ids: Array of arbitration ids, with CAN_EFF_FLAG set for extended frames
+    data: List of the frame payloads as hex strings
+    """
+    def __init__(self, stamps, ids, data):
+        self.stamps = stamps
+        self.ids = ids
+        self.data = data
+
+    def __len__(self):
+        return len(self.stamps)
+
+class CanFrameSource(object):
+    """ Base class for parsers of a particular CAN log format.
+
+    Sources parse the log in chunks of lines, converting the timestamps and ids of a whole chunk
+    at once into arrays. Formats with a fixed layout split the whole chunk into its fields at once
+    with split_chunk(), other formats and chunks which don't fit the layout, e.g. with comments or
+    corrupted lines, are parsed line by line with parse_line(). The payloads are left as hex
+    strings, so they only need to be converted for frames which actually get decoded.
+
+    To support a new format, subclass this, implement PATTERN and parse_line(), optionally
+    split_chunk(), and add it to CAN_SOURCES.
+    """
+    NAME = ""
+
+    # Regex which matches a line of this format, used for auto detection
+    PATTERN = None
+
+    # Multiplier to convert the timestamps in the log to seconds
+    TIME_SCALE = 1.0
+
+    @classmethod
+    def matches(cls, line):
+        return cls.PATTERN.match(line) is not None
+
+    @staticmethod
+    def parse_line(line):
+        """ Returns the timestamp, id, and data hex strings from a line, or None if the line does
+        not contain a frame.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def split_chunk(lines):
+        """ Returns lists of the timestamp, id, and data hex strings of every line in a chunk, or
+        None if the chunk has to be parsed line by line.
+        """
+        return None
+
+    def parse_chunk(self, lines):
+        """ Parses a chunk of lines into a CanFrames object. """
+        fields = self.split_chunk(lines)
+        try:
+            frames = self._to_frames(*fields) if fields is not None else None
+        except ValueError:
+            # A field which isn't a number, so the chunk doesn't fit the layout after all
+            frames = None
+        if frames is None:
+            frames = self._to_frames(*self._parse_lines(lines))
+
+        return frames
+
+    def _parse_lines(self, lines):
+        stamps = []
+        ids = []
+        data = []
+        for line in lines:
+            frame = self.parse_line(line)
+            if frame is None:
+                continue
+            stamps.append(frame[0])
+            ids.append(frame[1])
+            data.append(frame[2])
+
+        return stamps, ids, data
+
+    def _to_frames(self, stamps, ids, data):
+        # Each id appears many times, so only convert the unique ones from hex
+        id_lookup = {id: _frame_id(id) for id in set(ids)}
+        stamps = np.fromiter(map(float, stamps), dtype=np.float64, count=len(stamps))
+        if self.TIME_SCALE != 1.0:
+            stamps *= self.TIME_SCALE
+
+        return CanFrames(stamps, np.fromiter(map(id_lookup.__getitem__, ids), dtype=np.uint32, \
+            count=len(ids)), data)
+
+    def iter_chunks(self, log_lines, chunk_lines=CHUNK_LINES):
+        """ Yields CanFrames for an iterable of log lines, reading chunk_lines at a time. """
+        log_lines = iter(log_lines)
+        while True:
+            lines = list(itertools.islice(log_lines, chunk_lines))
+            if not lines:
+                break
+            yield self.parse_chunk(lines)
+
+class CandumpLogSource(CanFrameSource):
+    """ Logs recorded with 'candump -l', e.g.:
+        (1630268615.800257) can0 0D4#0000000000000000
+    """
+    NAME = "candump -l"
+    PATTERN = re.compile(r"^\(\d+(\.\d+)?\)\s+\S+\s+[0-9A-Fa-f]+##?[0-9A-Fa-f]*\s*$")
+
+    @staticmethod
+    def parse_line(line):
+        fields = line.split()
+        if len(fields) != 3:
+            return None
+
+        id, _, data = fields[2].partition("#")
+        if data.startswith("#"):
+            # CAN FD frames have the format ID##<flags><data>
+            data = data[2:]
+
+        return fields[0][1:-1], id, data
+
+    @staticmethod
+    def split_chunk(lines):
+        # Every line has 3 fields, the timestamp in brackets and the id and data joined by a "#"
+        text = " ".join(lines)
+        if "##" in text:
+            text = FD_FLAGS.sub("#", text)
+        fields = text.split()
+        num_frames = len(fields) // 3
+        stamps = " ".join(fields[0::3])
+        if len(fields) % 3 or stamps.count("(") != num_frames or stamps.count(")") != num_frames:
+            return None
+
+        ids_data = "#".join(fields[2::3]).split("#")
+        if len(ids_data) != 2 * num_frames:
+            return None
+
+        return stamps.replace("(", "").replace(")", "").split(), ids_data[0::2], ids_data[1::2]
+
+class CandumpAsciiSource(CanFrameSource):
+    """ Logs recorded with 'candump -ta' (absolute timestamps, human readable), e.g.:
+        (1630268615.800257)  can0  0D4   [8]  00 00 00 00 00 00 00 00  '........'
+    """
+    NAME = "candump -ta"
+    PATTERN = re.compile(r"^\(\d+(\.\d+)?\)\s+\S+\s+[0-9A-Fa-f]+\s+\[\d+\]")
+
+    @staticmethod
+    def parse_line(line):
+        fields = line.split()
+        if len(fields) < 4 or not fields[3].startswith("["):
+            return None
+
+        # Only keep the data bytes, dropping the ASCII rendering candump adds with -a
+        n_bytes = int(fields[3][1:-1])
+        return fields[0][1:-1], fields[2], "".join(fields[4:4 + n_bytes])
+
+class KsuCsvSource(CanFrameSource):
+    """ CSV logs from the KSU data logger, with timestamps in milliseconds, e.g.:
+        1698184253123,0D4,8,0000000000000000
+    """
+    NAME = "KSU CSV"
+    PATTERN = re.compile(r"^\d+(\.\d+)?,[0-9A-Fa-f]+,\d+,[0-9A-Fa-f]*\s*$")
+    TIME_SCALE = 1e-3
+
+    @staticmethod
+    def parse_line(line):
+        fields = line.strip().split(",")
+        if len(fields) < 4 or not fields[0][:1].isdigit():
+            # Most likely the header
+            return None
+
+        return fields[0], fields[1], fields[3]
+
+    @staticmethod
+    def split_chunk(lines):
+        # Skip the header, then every line has 4 fields
+        begin = 0
+        while begin < len(lines) and not lines[begin][:1].isdigit():
+            begin += 1
+        lines = lines[begin:]
+        commas = np.fromiter(map(str.count, lines, itertools.repeat(",")), dtype=np.int64, \
+            count=len(lines))
+        if np.any(commas != 3):
+            return None
+
+        fields = ",".join(lines).replace("\r", "").replace("\n", "").split(",")
+        return fields[0::4], fields[1::4], fields[3::4]
+
+def _frame_id(id):
+    """ Returns the frame id of a hex id string, flagging extended frames. Like candump, logs write
+    the ids of standard frames with 3 digits and those of extended frames with 8.
+    """
+    frame_id = int(id, 16)
+    if len(id) > 3 or frame_id > CAN_SFF_MASK:
+        frame_id |= CAN_EFF_FLAG
+
+    return frame_id
+
+# All supported formats, in the order they are tried during auto detection
+CAN_SOURCES = [CandumpLogSource, CandumpAsciiSource, KsuCsvSource]
+
+def detect_can_source(lines):
+    """ Returns an instance of the CanFrameSource matching the format of some log lines.
+
+    lines: The first few lines of the log
+    """
+    lines = [line for line in lines if line.strip()][:DETECT_LINES]
+    for source in CAN_SOURCES:
+        if any(source.matches(line) for line in lines):
+            return source()
+
+    raise ValueError("Unrecognized CAN log format, supported formats are: " + \
+        ", ".join(source.NAME for source in CAN_SOURCES))
+
+def get_can_source(name):
+    """ Returns an instance of the CanFrameSource with the specified name. """
+    for source in CAN_SOURCES:
+        if source.NAME == name:
+            return source()
+
+    raise ValueError(f"Unknown CAN log format '{name}'")
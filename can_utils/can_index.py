@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import numpy as np
+
+# Bump this whenever the layout of the index file changes, so old indexes get rebuilt
+INDEX_VERSION = 1
+
+class CanIdIndex():
+    """ Location and time range of all the frames for a single CAN id within a log file. """
+    def __init__(self, id: str, offsets, start_time: float, end_time: float):
+        self.id = id
+        self.offsets = offsets
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def msgs(self):
+        return len(self.offsets)
+
+    def avg_frequency(self):
+        if self.msgs > 1 and self.end_time > self.start_time:
+            return self.msgs / (self.end_time - self.start_time)
+        else:
+            return 0.0
+
+    def __str__(self):
+        return "{:10} | {:9} |  {:6.2f}".format(self.id, self.msgs, self.avg_frequency())
+
+
+class CanLogIndex():
+    """ Sidecar index of a candump log file, storing the byte offset of every frame per CAN id.
+
+    The index is built in a single pass over the log and saved next to it (<log>.idx). It is
+    rebuilt automatically whenever the size or modification time of the log changes. Once built,
+    the frames of any id can be read by seeking directly to them instead of rescanning the log.
+
+    Only uncompressed candump '-l' logs can be indexed. The index is used by the CAN utilities, the
+    log generator doesn't use it, since it decodes every frame before the outputs are selected.
+    """
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self.index_path = log_path + ".idx"
+        self.ids: dict[str, CanIdIndex] = {}
+
+    @classmethod
+    def open(cls, log_path: str, rebuild: bool = False):
+        """ Loads the index for a log file, building (and saving) it if needed. """
+        index = cls(log_path)
+        if rebuild or not index._load():
+            index.build()
+            try:
+                index.save()
+            except OSError as e:
+                print(f"WARNING: Failed to save index file {index.index_path}: {e}")
+
+        return index
+
+    @classmethod
+    def load(cls, log_path: str):
+        """ Loads an existing up to date index for a log file, returns None if there isn't one. """
+        index = cls(log_path)
+        return index if index._load() else None
+
+    def build(self):
+        """ Scans the log file once, recording the offset and timestamp of every frame. """
+        offsets = {}
+        stamps = {}
+        offset = 0
+        with open(self.log_path, "rb") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) == 3:
+                    id = fields[2].split(b"#", 1)[0]
+                    if id not in offsets:
+                        offsets[id] = []
+                        stamps[id] = [np.inf, -np.inf]
+                    offsets[id].append(offset)
+
+                    stamp = float(fields[0][1:-1])
+                    id_stamps = stamps[id]
+                    if stamp < id_stamps[0]:
+                        id_stamps[0] = stamp
+                    if stamp > id_stamps[1]:
+                        id_stamps[1] = stamp
+
+                offset += len(line)
+
+        self.ids = {}
+        for id, id_offsets in offsets.items():
+            name = id.decode()
+            self.ids[name] = CanIdIndex(name, np.array(id_offsets, dtype=np.int64), \
+                stamps[id][0], stamps[id][1])
+
+    def save(self):
+        meta = {
+            "version": INDEX_VERSION,
+            "log_stat": self._log_stat(),
+            "ids": {id: [entry.start_time, entry.end_time] for id, entry in self.ids.items()},
+        }
+        arrays = {f"offsets_{id}": entry.offsets for id, entry in self.ids.items()}
+
+        # Write to a temporary file first so an interrupted save never leaves a corrupt index
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(tmp_path, self.index_path)
+
+    def frame_lines(self, ids):
+        """ Yields the log lines for the requested CAN ids, in the order they appear in the log.
+
+        ids: CAN id, or iterable of CAN ids (hex strings as they appear in the log)
+        """
+        if isinstance(ids, str):
+            ids = [ids]
+
+        selected = [self.ids[id].offsets for id in ids if id in self.ids]
+        if not selected:
+            return
+        offsets = np.sort(np.concatenate(selected)) if len(selected) > 1 else selected[0]
+
+        with open(self.log_path, "rb") as file:
+            for offset in offsets:
+                file.seek(offset)
+                yield file.readline().decode()
+
+    def _log_stat(self):
+        stat = os.stat(self.log_path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load(self):
+        """ Loads the index from disc, returns False if it is missing or out of date. """
+        if not os.path.isfile(self.index_path):
+            return False
+
+        try:
+            with np.load(self.index_path) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("version") != INDEX_VERSION or meta.get("log_stat") != self._log_stat():
+                    return False
+
+                self.ids = {}
+                for id, (start_time, end_time) in meta["ids"].items():
+                    self.ids[id] = CanIdIndex(id, data[f"offsets_{id}"], start_time, end_time)
+        except (OSError, ValueError, KeyError):
+            return False
+
+        return True
@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
 
+import itertools
+import numpy as np
+
+# Number of log lines parsed at a time when streaming a log file
+CHUNK_LINES = 500000
+
 class CanByteStats():
     def __init__(self, initial_val: int = 0):
         self.min: int = initial_val
@@ -13,47 +19,82 @@ class CanByteStats():
 
 
 class CanFrameStats():
-    def __init__(self, id: str, start_time: float, data: str):
-        n_bytes = int(len(data) / 2)
+    """ Statistics for all the frames of a single CAN id.
 
+    Frames are added in bulk as a matrix of payloads (one row per frame), so the per byte
+    statistics are computed with NumPy rather than per byte in Python.
+    """
+    def __init__(self, id: str):
         self.id = id
         self.msgs: int = 0
-        self.bytes_min: int = n_bytes
-        self.bytes_max: int = n_bytes
-        self.start_time: float = start_time
-        self.end_time: float = start_time
-        self.byte_stats: list[CanByteStats] = []
-
-        self._update_byte_stats(data)
+        self.bytes_min: int = 0
+        self.bytes_max: int = 0
+        self.start_time: float = np.inf
+        self.end_time: float = -np.inf
+        self.byte_min = np.zeros(0, dtype=np.uint8)
+        self.byte_max = np.zeros(0, dtype=np.uint8)
 
     def update(self, stamp: float, data: str):
-        n_bytes = int(len(data) / 2)
-
-        self.msgs += 1
-        self.end_time = stamp
-        self.bytes_min = min(n_bytes, self.bytes_min)
-        self.bytes_max = max(n_bytes, self.bytes_max)
-
-        self._update_byte_stats(data)
+        """ Adds a single frame, with data as a hex string. """
+        payload = np.frombuffer(bytes.fromhex(data), dtype=np.uint8).reshape(1, -1)
+        self.update_chunk(np.array([stamp]), payload)
+
+    def update_chunk(self, stamps, payloads):
+        """ Adds a group of frames which all have the same number of bytes.
+
+        stamps: Array of timestamps, one per frame [s]
+        payloads: 2D uint8 array of payloads, one row per frame
+        """
+        n_frames, n_bytes = payloads.shape
+        if n_frames == 0:
+            return
+
+        if self.msgs == 0:
+            self.bytes_min = n_bytes
+            self.bytes_max = n_bytes
+        else:
+            self.bytes_min = min(n_bytes, self.bytes_min)
+            self.bytes_max = max(n_bytes, self.bytes_max)
+
+        self.msgs += n_frames
+        self.start_time = min(self.start_time, float(stamps.min()))
+        self.end_time = max(self.end_time, float(stamps.max()))
+
+        if n_bytes == 0:
+            return
+
+        mins = payloads.min(axis=0)
+        maxs = payloads.max(axis=0)
+
+        # Bytes beyond what has been seen before start off with the stats from this chunk
+        n_known = len(self.byte_min)
+        n_common = min(n_known, n_bytes)
+        np.minimum(self.byte_min[:n_common], mins[:n_common], out=self.byte_min[:n_common])
+        np.maximum(self.byte_max[:n_common], maxs[:n_common], out=self.byte_max[:n_common])
+        if n_bytes > n_known:
+            self.byte_min = np.concatenate([self.byte_min, mins[n_known:]])
+            self.byte_max = np.concatenate([self.byte_max, maxs[n_known:]])
+
+    @property
+    def byte_range(self):
+        return self.byte_max.astype(np.int16) - self.byte_min.astype(np.int16)
+
+    @property
+    def byte_stats(self):
+        stats = []
+        for min_val, max_val in zip(self.byte_min, self.byte_max):
+            byte_stats = CanByteStats(int(min_val))
+            byte_stats.update(int(max_val))
+            stats.append(byte_stats)
+
+        return stats
 
     def avg_frequency(self):
-        if self.msgs > 1:
+        if self.msgs > 1 and self.end_time > self.start_time:
             return self.msgs / (self.end_time - self.start_time)
         else:
             return 0.0
 
-    def _update_byte_stats(self, data: str):
-        n_bytes = int(len(data) / 2)
-
-        for i in range(n_bytes):
-            name = f"byte_{str(i)}"
-            val = int(f"0x{data[2*i:2*i + 2]}", 16)
-
-            if i + 1 > len(self.byte_stats):
-                self.byte_stats.append(CanByteStats(val))
-            else:
-                self.byte_stats[i].update(val)
-
     def __str__(self):
         return "{:10} | {:9} |  {:6.2f}".format(self.id, self.msgs, self.avg_frequency())
 
@@ -66,15 +107,115 @@ def parse_can_line(line):
     return stamp, id, data
 
 
-def get_id_stats_from_lines(lines):
-    id_stats = {}
-    for line in lines:
-        stamp, id, data = parse_can_line(line)
-        bytes = int(len(data) / 2)
+def group_can_lines(lines):
+    """ Groups candump log lines by CAN id and payload length.
 
+    Returns a dictionary keyed by (id, number of bytes) containing a tuple of a timestamp array
+    and a 2D uint8 payload array with one row per frame. Lines which can't be parsed (e.g. remote
+    frames or blank lines) are skipped.
+    """
+    raw_groups = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+
+        id, _, data = fields[2].partition("#")
+        if data.startswith("#"):
+            # CAN FD frames have the format ID##<flags><data>
+            data = data[2:]
+
+        key = (id, len(data))
+        group = raw_groups.get(key)
+        if group is None:
+            group = ([], [])
+            raw_groups[key] = group
+        group[0].append(fields[0][1:-1])
+        group[1].append(data)
+
+    groups = {}
+    for (id, n_chars), (stamps, datas) in raw_groups.items():
+        if n_chars % 2:
+            continue
+
+        # Convert the hex data of all frames in a single call
+        try:
+            payloads = np.frombuffer(bytes.fromhex("".join(datas)), dtype=np.uint8)
+        except ValueError:
+            continue
+
+        n_bytes = n_chars // 2
+        payloads = payloads.reshape(len(datas), n_bytes)
+        groups[(id, n_bytes)] = (np.array(stamps, dtype=np.float64), payloads)
+
+    return groups
+
+
+def update_id_stats(id_stats, lines):
+    """ Updates a dictionary of CanFrameStats keyed by CAN id with a chunk of log lines. """
+    for (id, n_bytes), (stamps, payloads) in group_can_lines(lines).items():
         if id not in id_stats:
-            id_stats[id] = CanFrameStats(id, float(stamp), data)
-        else:
-            id_stats[id].update(float(stamp), data)
+            id_stats[id] = CanFrameStats(id)
+        id_stats[id].update_chunk(stamps, payloads)
+
+
+def get_id_stats_from_lines(lines, chunk_lines=CHUNK_LINES):
+    """ Computes the CanFrameStats for every id in an iterable of candump log lines.
+
+    The lines are consumed in chunks, so this can be given an open file object to process logs
+    that don't fit in memory.
+    """
+    id_stats = {}
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, chunk_lines))
+        if not chunk:
+            break
+        update_id_stats(id_stats, chunk)
 
     return id_stats
+
+
+def get_id_payloads_from_file(filename, id_stats=None, chunk_lines=CHUNK_LINES):
+    """ Collects the payloads of every frame in a candump log file, grouped by CAN id.
+
+    Returns a dictionary keyed by CAN id containing a tuple of a timestamp array and a 2D uint8
+    payload matrix, with one row per frame in time order. Frames shorter than the longest frame
+    for an id are zero padded.
+
+    id_stats: Optional dictionary of CanFrameStats to update in the same pass over the file
+    """
+    chunks = {}
+    with open(filename, "r") as file:
+        while True:
+            lines = list(itertools.islice(file, chunk_lines))
+            if not lines:
+                break
+            for (id, n_bytes), group in group_can_lines(lines).items():
+                chunks.setdefault(id, []).append(group)
+                if id_stats is not None:
+                    if id not in id_stats:
+                        id_stats[id] = CanFrameStats(id)
+                    id_stats[id].update_chunk(*group)
+
+    id_payloads = {}
+    for id, groups in chunks.items():
+        n_bytes = max(payloads.shape[1] for stamps, payloads in groups)
+        stamps = np.concatenate([group_stamps for group_stamps, payloads in groups])
+        padded = np.zeros((len(stamps), n_bytes), dtype=np.uint8)
+        row = 0
+        for group_stamps, payloads in groups:
+            padded[row:row + len(payloads), :payloads.shape[1]] = payloads
+            row += len(payloads)
+
+        # Frames of different lengths get split into separate groups, so restore the time order
+        order = np.argsort(stamps, kind="stable")
+        id_payloads[id] = (stamps[order], padded[order])
+
+    return id_payloads
+
+
+def get_id_stats_from_file(filename, chunk_lines=CHUNK_LINES):
+    """ Computes the CanFrameStats for every id in a candump log file, streaming the file. """
+    with open(filename, "r") as file:
+        return get_id_stats_from_lines(file, chunk_lines)
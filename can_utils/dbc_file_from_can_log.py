@@ -3,9 +3,11 @@
 import argparse
 import os
 import can_utils
+import signal_discovery
 
 DESCRIPTION = """Generates a DBC file with individual signals for every byte from every CAN id
-present in a log file."""
+present in a log file. Alternatively, the signals can be discovered from a bit level analysis of the
+frames."""
 
 DBC_HEADER = """VERSION "TODO"
 
@@ -44,6 +46,17 @@ BS_:
 BU_: TODO
 """
 
+def get_dbc_id_field(id):
+    """ Returns the DBC message id for a CAN id in hex. """
+    id_field = int(id, 16)
+    if id_field > 2047:
+        # This is an extended frame. The DBC file spec does not provide a flag
+        # to indicate this, instead a single bit in the id field is used instead
+        # so we have to set that manually.
+        id_field += 0x80000000
+
+    return id_field
+
 def get_dbc_message_def(id, bytes):
     """ Generates a DBC file message definition for a particular CAN id with one signal for each
     byte present.
@@ -58,12 +71,7 @@ def get_dbc_message_def(id, bytes):
     :bytes: Number of bytes of data from this id
     """
     id_hex = id.lstrip("0")
-    id_field = int(id_hex, 16)
-    if id_field > 2047:
-        # This is an extended frame. The DBC file spec does not provide a flag
-        # to indicate this, instead a single bit in the id field is used instead
-        # so we have to set that manually.
-        id_field += 0x80000000
+    id_field = get_dbc_id_field(id_hex)
 
     msg_def = "BO_ " + str(id_field) + " ID_" + id_hex + ": " + str(max(bytes) + 1) + " TODO\n"
     for i in bytes:
@@ -71,6 +79,47 @@ def get_dbc_message_def(id, bytes):
 
     return msg_def
 
+def get_discovered_message_def(id, n_bytes, signals):
+    """ Generates a DBC file message definition for a particular CAN id from a set of signals
+    found by signal_discovery.
+
+    Example, for the CAN id 0x0D0 with a 16 bit signed signal and a rolling counter:
+        BO_ 208 ID_D0: 8 TODO
+            SG_ ID_D0_S1: 0|16@1- (1, 0) [-4573|423] "" TODO
+            SG_ ID_D0_COUNTER: 16|4@1+ (1, 0) [0|15] "" TODO
+
+    :id: CAN id in hex
+    :n_bytes: Number of bytes of data from this id
+    :signals: List of signal_discovery.DiscoveredSignal
+
+    Returns the message definition, and a list of signal comments
+    """
+    id_hex = id.lstrip("0") or "0"
+    id_field = get_dbc_id_field(id_hex)
+
+    msg_def = "BO_ " + str(id_field) + " ID_" + id_hex + ": " + str(n_bytes) + " TODO\n"
+    comments = []
+    signal_num = 0
+    for signal in signals:
+        if signal.kind == "signal":
+            signal_num += 1
+            name = "ID_" + id_hex + "_S" + str(signal_num)
+        else:
+            name = "ID_" + id_hex + "_" + signal.kind.upper()
+            if any(other is not signal and other.kind == signal.kind for other in signals):
+                name += "_" + str(signal.lsb)
+
+        byte_order = "1" if signal.byte_order == signal_discovery.LITTLE_ENDIAN else "0"
+        sign = "-" if signal.signed else "+"
+        msg_def += "    SG_ %s: %d|%d@%s%s (1, 0) [%d|%d] \"\" TODO\n" % (name, \
+            signal.dbc_start_bit(n_bytes), signal.length, byte_order, sign, signal.minimum, \
+            signal.maximum)
+
+        if signal.comment:
+            comments.append("CM_ SG_ %d %s \"%s\";\n" % (id_field, name, signal.comment))
+
+    return msg_def, comments
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=DESCRIPTION)
     parser.add_argument("log", type=str, help="Path to CAN log")
@@ -83,6 +132,8 @@ if __name__ == '__main__':
         help="Minimum frequency, below which an ID is ignore")
     parser.add_argument("--max_frequency", type=float, default=None, \
         help="Maximum frequency, below which an ID is ignore")
+    parser.add_argument("--discover_signals", action="store_true", \
+        help="Detect signals, counters and checksums from the bit patterns instead of one signal per byte")
 
     args = parser.parse_args()
 
@@ -97,15 +148,18 @@ if __name__ == '__main__':
     if not args.output:
         args.output = os.path.splitext(args.log)[0] + ".dbc"
 
-    with open(args.log, "r") as file:
-        lines = file.readlines()
-
-    id_stats = can_utils.get_id_stats_from_lines(lines)
+    id_payloads = {}
+    if args.discover_signals:
+        id_stats = {}
+        id_payloads = can_utils.get_id_payloads_from_file(args.log, id_stats)
+    else:
+        id_stats = can_utils.get_id_stats_from_file(args.log)
 
     if not id_stats:
         print("ERROR: No CAN data found in log!")
         exit(1)
 
+    comments = []
     with open(args.output, "w") as file:
         file.write(DBC_HEADER)
 
@@ -117,13 +171,25 @@ if __name__ == '__main__':
             if args.max_frequency and avg_hz > args.max_frequency:
                 continue
 
+            if args.discover_signals:
+                n_bytes = stats.bytes_min if args.use_min_bytes else stats.bytes_max
+                stamps, payloads = id_payloads[id]
+                signals = signal_discovery.discover_signals(payloads[:, :n_bytes])
+                if not signals:
+                    continue
+
+                msg_def, msg_comments = get_discovered_message_def(id, n_bytes, signals)
+                comments += msg_comments
+                file.write("\n")
+                file.write(msg_def)
+                continue
+
             # Filter which bytes to select
             max_byte_num = stats.bytes_min if args.use_min_bytes else stats.bytes_max
             if args.ignore_constant:
-                bytes = []
-                for i in range(max_byte_num):
-                    if stats.byte_stats[i].range > 0:
-                        bytes.append(i)
+                # byte_range is computed each time it's accessed, so it's only computed once per id
+                byte_range = stats.byte_range
+                bytes = [i for i in range(max_byte_num) if byte_range[i] > 0]
             else:
                 bytes = list(range(max_byte_num))
 
@@ -134,4 +200,8 @@ if __name__ == '__main__':
             file.write("\n")
             file.write(msg_def)
 
+        if comments:
+            file.write("\n")
+            file.writelines(comments)
+
     print("Done!")
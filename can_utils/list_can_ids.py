@@ -3,6 +3,7 @@
 import argparse
 import os
 import can_utils
+from can_index import CanLogIndex
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -18,10 +19,12 @@ if __name__ == '__main__':
         print("ERROR: log file %s does not exist" % args.log)
         exit(1)
 
-    with open(args.log, "r") as file:
-        lines = file.readlines()
-
-    id_stats = can_utils.get_id_stats_from_lines(lines)
+    # Use the sidecar index when there is an up to date one, since it already has the counts
+    index = CanLogIndex.load(args.log)
+    if index:
+        id_stats = index.ids
+    else:
+        id_stats = can_utils.get_id_stats_from_file(args.log)
 
     print("    ID     | Msg Count | Avg. Frequency")
     print("---------------------------------------")
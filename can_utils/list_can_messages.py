@@ -4,11 +4,14 @@ import argparse
 import os
 import textwrap
 import can_utils
+from can_index import CanLogIndex
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("log", type=str, help="Path to logfile")
     parser.add_argument("id", type=str, help="CAN id")
+    parser.add_argument("--rebuild_index", action="store_true", \
+        help="Force the sidecar index (<log>.idx) to be rebuilt")
 
     args = parser.parse_args()
 
@@ -20,13 +23,12 @@ if __name__ == '__main__':
         print("ERROR: log file %s does not exist" % args.log)
         exit(1)
 
-    with open(args.log, "r") as file:
-        lines = file.readlines()
+    # The index lets us seek straight to the frames for this id rather than rescanning the log
+    index = CanLogIndex.open(args.log, rebuild=args.rebuild_index)
 
-    for line in lines:
+    for line in index.frame_lines(args.id):
         stamp, id, data = can_utils.parse_can_line(line)
 
-        if id == args.id:
-            data_bytes = textwrap.wrap(data, 2)
-            data_bytes = ' '.join(data_bytes)
-            print("%f - %s" % (stamp, data_bytes))
+        data_bytes = textwrap.wrap(data, 2)
+        data_bytes = ' '.join(data_bytes)
+        print("%f - %s" % (stamp, data_bytes))
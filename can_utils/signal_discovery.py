@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# Number of frames processed at a time when computing bit statistics, bounds the memory used by
+# the unpacked bit matrices
+CHUNK_FRAMES = 1000000
+
+# Widest signal that will be proposed, wider runs of bits get split
+MAX_SIGNAL_BITS = 32
+
+# A new signal is started when the flip rate of a bit rises by more than this factor relative to
+# the previous (less significant) bit. Within a single integer signal the flip rate falls as the
+# bit significance increases.
+FLIP_RATE_RISE = 1.5
+
+# Fraction of frames which must match for a counter or checksum to be detected
+DETECTION_THRESHOLD = 0.95
+
+# Candidate counter widths, largest first
+COUNTER_WIDTHS = [8, 4, 3, 2]
+
+LITTLE_ENDIAN = "little"
+BIG_ENDIAN = "big"
+
+class DiscoveredSignal():
+    """ A signal proposed from the bit level analysis of a CAN id.
+
+    lsb: Position of the least significant bit, in the significance ordering of the byte order
+    length: Number of bits
+    byte_order: LITTLE_ENDIAN (Intel) or BIG_ENDIAN (Motorola)
+    kind: "signal", "counter" or "checksum"
+    """
+    def __init__(self, lsb, length, byte_order, kind="signal", signed=False, minimum=0, \
+            maximum=0, comment=""):
+        self.lsb = lsb
+        self.length = length
+        self.byte_order = byte_order
+        self.kind = kind
+        self.signed = signed
+        self.minimum = minimum
+        self.maximum = maximum
+        self.comment = comment
+
+    def dbc_start_bit(self, n_bytes):
+        """ Returns the start bit as defined in DBC files, which is the LSB for little endian
+        signals and the MSB for big endian signals.
+        """
+        if self.byte_order == LITTLE_ENDIAN:
+            return self.lsb
+
+        msb = self.lsb + self.length - 1
+        byte = n_bytes - 1 - msb // 8
+        return byte * 8 + msb % 8
+
+    def __str__(self):
+        return "%s: lsb=%d, length=%d, %s, %s, [%d|%d]" % (self.kind, self.lsb, self.length, \
+            self.byte_order, "signed" if self.signed else "unsigned", self.minimum, self.maximum)
+
+
+class BitStats():
+    """ Per bit statistics of a payload matrix.
+
+    flip_rate: Fraction of consecutive frames in which each bit changes, shape (n_bytes, 8)
+    one_rate: Fraction of frames in which each bit is set, shape (n_bytes, 8)
+    """
+    def __init__(self, payloads):
+        n_frames, n_bytes = payloads.shape
+        flips = np.zeros(n_bytes * 8, dtype=np.int64)
+        ones = np.zeros(n_bytes * 8, dtype=np.int64)
+
+        for start in range(0, n_frames, CHUNK_FRAMES):
+            # Overlap the chunks by one frame so the flips across the boundary are counted
+            chunk = payloads[max(start - 1, 0):start + CHUNK_FRAMES]
+            changed = chunk[1:] ^ chunk[:-1]
+            flips += np.unpackbits(changed, axis=1, bitorder="little").sum(axis=0, dtype=np.int64)
+            own = chunk if start == 0 else chunk[1:]
+            ones += np.unpackbits(own, axis=1, bitorder="little").sum(axis=0, dtype=np.int64)
+
+        self.n_frames = n_frames
+        self.n_bytes = n_bytes
+        self.flip_rate = (flips / max(n_frames - 1, 1)).reshape(n_bytes, 8)
+        self.one_rate = (ones / max(n_frames, 1)).reshape(n_bytes, 8)
+
+    def constant(self):
+        """ Boolean mask of the bits which never change, shape (n_bytes, 8). """
+        return (self.one_rate == 0) | (self.one_rate == 1)
+
+
+def significance_order(n_bytes, byte_order):
+    """ Returns the (byte, bit) of every bit position, ordered from least to most significant as
+    they would be for signals with the specified byte order.
+    """
+    bytes_order = range(n_bytes) if byte_order == LITTLE_ENDIAN else range(n_bytes - 1, -1, -1)
+    return [(byte, bit) for byte in bytes_order for bit in range(8)]
+
+
+def extract_values(payloads, lsb, length, byte_order):
+    """ Extracts the unsigned value of a field from every frame.
+
+    lsb: Position of the least significant bit, in the significance ordering of the byte order
+    length: Number of bits
+    """
+    n_bytes = payloads.shape[1]
+    first_byte = lsb // 8
+    last_byte = (lsb + length - 1) // 8
+
+    values = np.zeros(len(payloads), dtype=np.uint64)
+    for i in range(first_byte, last_byte + 1):
+        byte = i if byte_order == LITTLE_ENDIAN else n_bytes - 1 - i
+        values |= payloads[:, byte].astype(np.uint64) << np.uint64(8 * (i - first_byte))
+
+    values >>= np.uint64(lsb - 8 * first_byte)
+    values &= np.uint64((1 << length) - 1)
+    return values
+
+
+def is_signed(values, length):
+    """ Determines if a field is more likely to be a two's complement signed value, based on
+    whether that interpretation results in a smoother signal.
+    """
+    if length < 2 or len(values) < 2:
+        return False
+
+    unsigned = values.astype(np.int64)
+    signed = np.where(unsigned >= (1 << (length - 1)), unsigned - (1 << length), unsigned)
+
+    unsigned_step = np.abs(np.diff(unsigned)).mean()
+    signed_step = np.abs(np.diff(signed)).mean()
+    return signed_step < 0.5 * unsigned_step
+
+
+def find_counters(payloads, bit_stats, excluded):
+    """ Finds fields which increment by one (with roll over) in nearly every frame.
+
+    Returns a list of DiscoveredSignal, and marks the bits used by them in the excluded mask.
+    """
+    counters = []
+    n_bytes = payloads.shape[1]
+    if len(payloads) < 3:
+        return counters
+
+    for byte in range(n_bytes):
+        for length in COUNTER_WIDTHS:
+            for lsb in range(byte * 8, byte * 8 + 8 - length + 1, length):
+                bits = [(p // 8, p % 8) for p in range(lsb, lsb + length)]
+                if any(excluded[b] for b in bits):
+                    continue
+
+                values = extract_values(payloads, lsb, length, LITTLE_ENDIAN).astype(np.int64)
+                steps = np.diff(values) % (1 << length)
+                if np.mean(steps == 1) >= DETECTION_THRESHOLD:
+                    for b in bits:
+                        excluded[b] = True
+                    counters.append(DiscoveredSignal(lsb, length, LITTLE_ENDIAN, "counter", \
+                        minimum=int(values.min()), maximum=int(values.max()), \
+                        comment="Rolling counter"))
+
+    return counters
+
+
+def find_checksums(payloads, excluded):
+    """ Finds bytes which are the XOR or sum of all the other bytes in the frame.
+
+    Returns a list of DiscoveredSignal, and marks the bits used by them in the excluded mask.
+    """
+    checksums = []
+    n_bytes = payloads.shape[1]
+    if n_bytes < 2 or len(payloads) < 2:
+        return checksums
+
+    xor_all = np.bitwise_xor.reduce(payloads, axis=1)
+    sum_all = payloads.sum(axis=1, dtype=np.uint64)
+    for byte in range(n_bytes):
+        if excluded[byte].all():
+            continue
+
+        column = payloads[:, byte]
+        if len(np.unique(column[:1000])) < 2:
+            continue
+
+        xor_others = xor_all ^ column
+        sum_others = (sum_all - column) & np.uint64(0xFF)
+
+        comment = None
+        if np.mean(xor_others == column) >= DETECTION_THRESHOLD:
+            comment = "XOR of all other bytes"
+        elif np.mean(sum_others == column) >= DETECTION_THRESHOLD:
+            comment = "Sum of all other bytes"
+
+        if comment:
+            excluded[byte] = True
+            checksums.append(DiscoveredSignal(byte * 8, 8, LITTLE_ENDIAN, "checksum", \
+                minimum=int(column.min()), maximum=int(column.max()), comment=comment))
+
+    return checksums
+
+
+def segment_bits(bit_stats, excluded, byte_order):
+    """ Splits the variable bits into signals, for a particular byte order.
+
+    Walking from the least to most significant bit, a new signal is started whenever an excluded
+    (constant, counter or checksum) bit is encountered, the flip rate increases sharply, or the
+    signal reaches the maximum width.
+
+    Returns a list of (lsb, length) tuples.
+    """
+    segments = []
+    start = None
+    prev_rate = 0.0
+    order = significance_order(bit_stats.n_bytes, byte_order)
+    for pos, (byte, bit) in enumerate(order):
+        rate = bit_stats.flip_rate[byte, bit]
+        if excluded[byte, bit]:
+            if start is not None:
+                segments.append((start, pos - start))
+                start = None
+            continue
+
+        if start is not None and (rate > prev_rate * FLIP_RATE_RISE or \
+                pos - start >= MAX_SIGNAL_BITS):
+            segments.append((start, pos - start))
+            start = None
+
+        if start is None:
+            start = pos
+        prev_rate = rate
+
+    if start is not None:
+        segments.append((start, len(order) - start))
+
+    return segments
+
+
+def discover_signals(payloads):
+    """ Proposes the signals contained in the frames of a single CAN id.
+
+    Counters and checksums are detected first, then the remaining variable bits are split into
+    signals based on the flip rate of each bit. Both byte orders are tried, and the one which
+    explains the data with the fewest signals is used.
+
+    payloads: 2D uint8 array with one row per frame, in time order
+
+    Returns a list of DiscoveredSignal ordered by position
+    """
+    if payloads.size == 0:
+        return []
+
+    bit_stats = BitStats(payloads)
+    excluded = bit_stats.constant()
+
+    special = find_checksums(payloads, excluded)
+    special += find_counters(payloads, bit_stats, excluded)
+
+    # Fewest signals wins, ties go to little endian since it is the more common byte order
+    best = None
+    for byte_order in [LITTLE_ENDIAN, BIG_ENDIAN]:
+        segments = segment_bits(bit_stats, excluded, byte_order)
+        if best is None or len(segments) < len(best[1]):
+            best = (byte_order, segments)
+
+    byte_order, segments = best
+    signals = []
+    for lsb, length in segments:
+        values = extract_values(payloads, lsb, length, byte_order)
+        signed = is_signed(values, length)
+        if signed:
+            values = values.astype(np.int64)
+            values = np.where(values >= (1 << (length - 1)), values - (1 << length), values)
+        signals.append(DiscoveredSignal(lsb, length, byte_order, signed=signed, \
+            minimum=int(values.min()), maximum=int(values.max())))
+
+    n_bytes = payloads.shape[1]
+    signals = sorted(signals + special, key=lambda s: s.dbc_start_bit(n_bytes))
+    return signals
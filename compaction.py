@@ -0,0 +1,166 @@
+import hashlib
+import numpy as np
+
+# Ways of writing constant channels: at the full rate, not at all, or at LOW_RATE
+CONSTANT_POLICIES = ["keep", "drop", "low_rate"]
+
+# Ways of writing duplicate channels: with their own copy of the data, not at all, or sharing the
+# data of the channel they duplicate
+DUPLICATE_POLICIES = ["keep", "drop", "alias"]
+
+# Lowest frequency of a MoTeC channel [Hz]
+LOW_RATE = 1
+
+# Size of a sample in a .ld file, every channel is written as 32 bit floats or integers [bytes]
+SAMPLE_SIZE = 4
+
+class RedundantChannels(object):
+    """ Constant and duplicate channels of a DataLog, see find_redundant_channels.
+
+    constants: Dict of the name of each constant channel to its value
+    duplicates: Dict of the name of each duplicate channel to the name of the earlier channel it's
+        identical to
+    """
+    def __init__(self, constants, duplicates):
+        self.constants = constants
+        self.duplicates = duplicates
+
+    def __len__(self):
+        return len(self.constants) + len(self.duplicates)
+
+def find_redundant_channels(data_log, group=None, start=None):
+    """ Finds the channels of a log which never change, and those which are identical to an earlier
+    channel, e.g. the same signal decoded under different names.
+
+    Channels are compared bit for bit, including their timestamps, so identical channels also
+    resample identically. Duplicates are found by hashing the channel arrays, and only channels with
+    the same hash are compared in full. Constant channels aren't reported as duplicates, since
+    they're handled by the constant policy.
+
+    Resampling fills in zeros before the first message of a channel, so a channel which starts
+    after the start of the resampled log is only constant if its value is zero.
+
+    data_log: data_log.DataLog
+    group: Optional function of a channel name, only channels in the same group are reported as
+        duplicates of each other, e.g. those resampled the same way
+    start: Time the log is resampled from [s], defaults to the start of the log
+    """
+    start = data_log.start() if start is None else start
+    constants = {}
+    duplicates = {}
+    candidates = {}
+    for name, channel in data_log.channels.items():
+        if not len(channel):
+            continue
+
+        values = _bits(channel.values)
+        value = float(channel.values[0])
+        lead_in = channel.times[0] > start
+        if np.all(values == values[0]) and (not lead_in or value == 0):
+            constants[name] = value
+            continue
+
+        key = (len(channel), channel.data_type, group(name) if group else None, \
+            _digest(channel.times), _digest(channel.values))
+        for original in candidates.setdefault(key, []):
+            other = data_log.channels[original]
+            if np.array_equal(_bits(other.times), _bits(channel.times)) and \
+                    np.array_equal(_bits(other.values), values):
+                duplicates[name] = original
+                break
+        else:
+            candidates[key].append(name)
+
+    return RedundantChannels(constants, duplicates)
+
+class CompactionReport(object):
+    """ Channels of a log which are compacted when it's written, see plan_compaction.
+
+    dropped: List of the names of the channels which aren't written
+    low_rate: List of the names of the constant channels written at LOW_RATE
+    aliases: Dict of the name of each duplicate channel which shares the data of another channel in
+        the file, to the name of that channel
+    bytes_saved: Size of the channel data saved by compacting the channels [bytes]
+    """
+    def __init__(self, dropped, low_rate, aliases, bytes_saved):
+        self.dropped = dropped
+        self.low_rate = low_rate
+        self.aliases = aliases
+        self.bytes_saved = bytes_saved
+
+    def action(self, name):
+        """ Returns how a channel is written: "drop", "low_rate", "alias" or None for the full
+        rate.
+        """
+        if name in self.aliases:
+            return "alias"
+        elif name in self.low_rate:
+            return "low_rate"
+        elif name in self.dropped:
+            return "drop"
+        return None
+
+    def __len__(self):
+        return len(self.dropped) + len(self.low_rate) + len(self.aliases)
+
+    def __str__(self):
+        output = "Compacted %d channels, saving %s bytes: %d dropped, %d at %d Hz, %d aliased" % \
+            (len(self), format(self.bytes_saved, ","), len(self.dropped), len(self.low_rate), \
+            LOW_RATE, len(self.aliases))
+        for name in self.dropped:
+            output += "\n\t%s: dropped" % name
+        for name in self.low_rate:
+            output += "\n\t%s: constant, written at %d Hz" % (name, LOW_RATE)
+        for name, original in self.aliases.items():
+            output += "\n\t%s: alias of %s" % (name, original)
+        return output
+
+def validate_policies(constant_policy, duplicate_policy):
+    """ Raises a ValueError if either policy is unknown. """
+    if constant_policy not in CONSTANT_POLICIES:
+        raise ValueError(f"Unknown constant channel policy '{constant_policy}', must be one of " \
+            f"{CONSTANT_POLICIES}")
+    if duplicate_policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Unknown duplicate channel policy '{duplicate_policy}', must be one of " \
+            f"{DUPLICATE_POLICIES}")
+
+def plan_compaction(data_log, constant_policy, duplicate_policy, num_msgs, low_rate_msgs, \
+        group=None, start=None):
+    """ Decides how the constant and duplicate channels of a log are written.
+
+    data_log: data_log.DataLog
+    constant_policy: One of CONSTANT_POLICIES
+    duplicate_policy: One of DUPLICATE_POLICIES
+    num_msgs: Number of samples of each channel written at the full rate
+    low_rate_msgs: Number of samples of each channel written at LOW_RATE
+    group: Optional function of a channel name, see find_redundant_channels
+    start: Time the log is resampled from [s], defaults to the start of the log
+    """
+    validate_policies(constant_policy, duplicate_policy)
+
+    dropped = []
+    low_rate = []
+    aliases = {}
+    if constant_policy != "keep" or duplicate_policy != "keep":
+        redundant = find_redundant_channels(data_log, group, start)
+        if constant_policy == "drop":
+            dropped.extend(redundant.constants)
+        elif constant_policy == "low_rate":
+            low_rate.extend(redundant.constants)
+        if duplicate_policy == "drop":
+            dropped.extend(redundant.duplicates)
+        elif duplicate_policy == "alias":
+            aliases.update(redundant.duplicates)
+
+    bytes_saved = SAMPLE_SIZE * ((len(dropped) + len(aliases)) * num_msgs + \
+        len(low_rate) * max(num_msgs - low_rate_msgs, 0))
+    return CompactionReport(dropped, low_rate, aliases, bytes_saved)
+
+def _bits(array):
+    """ Returns a view of a float array as unsigned integers, so NaNs compare equal. """
+    array = np.asarray(array)
+    return array.view(np.dtype("u%d" % array.dtype.itemsize))
+
+def _digest(array):
+    return hashlib.blake2b(memoryview(np.ascontiguousarray(array)).cast("B"), \
+        digest_size=16).digest()
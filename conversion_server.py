@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from motec_log_generator import LOG_TYPES
+
+# Metadata fields which can be given as query parameters of a conversion, and their types
+METADATA_FIELDS = {
+    "driver": str,
+    "vehicle_id": str,
+    "vehicle_weight": int,
+    "vehicle_type": str,
+    "vehicle_comment": str,
+    "venue_name": str,
+    "event_name": str,
+    "event_session": str,
+    "long_comment": str,
+    "short_comment": str,
+}
+
+# Size of the writes of the .ld file back to the client
+RESPONSE_BLOCK = 1 << 20
+
+# Number of recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+DBC_ID = re.compile(r"^[0-9a-f]{64}$")
+
+DESCRIPTION = """Runs a local HTTP service which converts uploaded logs to MoTeC .ld files"""
+
+EPILOG = """Upload a DBC with 'POST /dbc', which returns its id. Convert a log with
+'POST /convert?log_type=CAN&dbc=<id>&frequency=20&driver=...', with the log as the request body,
+the .ld file is returned in the response. Logs may be compressed. 'GET /metrics' returns the
+request latency and throughput, and 'GET /health' returns 200 while the service is running.
+"""
+
+def _init_worker():
+    # Forked workers inherit memory tracing from a profiled parent, which would slow them down
+    tracemalloc.stop()
+
+    # Import the slow to import readers up front, so the first conversion of each worker isn't slow
+    try:
+        import cantools
+    except ImportError:
+        pass
+
+def _warm_up():
+    return os.getpid()
+
+def _convert(log, log_type, dbc, frequency, metadata):
+    """ Converts a log in a worker process, returning the .ld file as bytes. The DBC cache of each
+    worker keeps the parsed DBCs in memory between requests.
+    """
+    from motec_log_generator import generate_motec_log
+
+    # The progress messages of concurrent conversions would just be noise in the server output
+    with contextlib.redirect_stdout(io.StringIO()):
+        return generate_motec_log(io.BytesIO(log), log_type, dbc=dbc, frequency=frequency, \
+            return_bytes=True, **metadata)
+
+class ServerMetrics(object):
+    """ Request counts, latencies and throughput of the conversion service. """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.failed = 0
+        self.bad_requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish_request(self, latency, bytes_in, bytes_out, ok, bad_request=False):
+        """ Records a finished request. Failed requests are either bad requests, rejected with a
+        400 because of their parameters or upload, or failures of the service itself.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            if ok:
+                self._latencies.append(latency)
+                self.bytes_in += bytes_in
+                self.bytes_out += bytes_out
+            elif bad_request:
+                self.bad_requests += 1
+            else:
+                self.failed += 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def to_dict(self):
+        with self._lock:
+            uptime = time.monotonic() - self.started
+            latencies = sorted(self._latencies)
+            return {
+                "uptime": uptime,
+                "requests": self.requests,
+                "failed": self.failed,
+                "bad_requests": self.bad_requests,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "requests_per_second": self.requests / uptime if uptime > 0 else 0.0,
+                "bytes_in_per_second": self.bytes_in / uptime if uptime > 0 else 0.0,
+                "bytes_out_per_second": self.bytes_out / uptime if uptime > 0 else 0.0,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "latency_p99": percentile(latencies, 99),
+                "latency_max": latencies[-1] if latencies else 0.0,
+            }
+
+def percentile(sorted_values, p):
+    """ Returns the p'th percentile of a sorted list, or 0 if it is empty. """
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class ConversionServer(object):
+    """ HTTP service which converts uploaded logs to MoTeC .ld files.
+
+    Conversions run in a pool of worker processes, which are started up front and kept running, so
+    requests don't pay for starting Python and importing the readers. Each worker keeps the DBCs it
+    has parsed in memory, see dbc_cache. DBCs are uploaded once and referred to by the hash of their
+    contents, so they don't need to be sent with every log.
+
+    If a worker dies, e.g. killed for running out of memory, the pool of workers is broken, so it's
+    replaced with a new one. The requests it was converting fail with 500.
+
+    The number of requests being converted or waiting for a worker is bounded. Once the workers and
+    the queue are full, new requests are turned away with 503 straight away, before their uploads
+    are read, rather than piling up in memory.
+    """
+    def __init__(self, host="127.0.0.1", port=8000, workers=None, queue_size=None, \
+            max_upload=512000000, dbc_dir=None):
+        """
+        host: Address to listen on, only the local machine by default
+        port: Port to listen on, 0 picks a free port
+        workers: Number of worker processes, defaults to the number of CPUs
+        queue_size: Number of requests which can wait for a worker, defaults to twice the workers
+        max_upload: Maximum size of an uploaded log or DBC [bytes]
+        dbc_dir: Directory to store uploaded DBCs in, defaults to a temporary directory
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size if queue_size is not None else 2 * self.workers
+        self.max_upload = max_upload
+        self.dbc_dir = dbc_dir or tempfile.mkdtemp(prefix="motec_dbc_")
+        os.makedirs(self.dbc_dir, exist_ok=True)
+
+        self.metrics = ServerMetrics()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start_workers(self):
+        """ Starts the worker processes, and waits for them all to be ready. """
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, \
+            initializer=_init_worker)
+        futures = [executor.submit(_warm_up) for i in range(self.workers)]
+        for future in futures:
+            future.result()
+        self._executor = executor
+
+    def restart_workers(self, broken):
+        """ Replaces a broken pool of workers with a new one. Requests which failed on the same pool
+        at once only replace it once.
+
+        broken: The broken concurrent.futures.ProcessPoolExecutor
+        """
+        with self._executor_lock:
+            if self._executor is not broken:
+                return
+
+            print("A worker process died, restarting the workers")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.start_workers()
+
+    def serve_forever(self):
+        if self._executor is None:
+            self.start_workers()
+
+        print("Serving MoTeC log conversions on %s with %d workers" % (self.address, self.workers))
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """ Stops the server, call from another thread than serve_forever(). """
+        self.httpd.shutdown()
+
+    def close(self):
+        self.httpd.server_close()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def try_acquire(self):
+        """ Reserves a place for a request, returns False if the service is full. """
+        if self._slots.acquire(blocking=False):
+            return True
+
+        self.metrics.reject()
+        return False
+
+    def release(self):
+        self._slots.release()
+
+    def save_dbc(self, data):
+        """ Stores an uploaded DBC, returning its id. """
+        dbc_id = hashlib.sha256(data).hexdigest()
+        path = self.dbc_path(dbc_id)
+        if not os.path.isfile(path):
+            # Written to a temporary file first, so a conversion never sees a partial DBC
+            fd, tmp_path = tempfile.mkstemp(dir=self.dbc_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+
+        return dbc_id
+
+    def dbc_path(self, dbc_id):
+        if not DBC_ID.match(dbc_id):
+            raise ValueError(f"Invalid DBC id '{dbc_id}'")
+
+        return os.path.join(self.dbc_dir, dbc_id + ".dbc")
+
+    def convert(self, log, params):
+        """ Converts an uploaded log with the given query parameters, returning the .ld file. """
+        log_type = params.get("log_type", "").upper()
+        if log_type not in LOG_TYPES:
+            raise ValueError(f"log_type must be one of {LOG_TYPES}")
+
+        dbc = None
+        if "dbc" in params:
+            dbc = self.dbc_path(params["dbc"])
+            if not os.path.isfile(dbc):
+                raise ValueError(f"Unknown DBC '{params['dbc']}', upload it to /dbc first")
+
+        frequency = float(params.get("frequency", 20.0))
+        if not math.isfinite(frequency) or frequency <= 0:
+            raise ValueError("frequency must be a positive number")
+        metadata = {}
+        for field, value in params.items():
+            if field in METADATA_FIELDS:
+                metadata[field] = METADATA_FIELDS[field](value)
+            elif field not in ["log_type", "dbc", "frequency"]:
+                raise ValueError(f"Unknown parameter '{field}'")
+
+        executor = self._executor
+        try:
+            return executor.submit(_convert, log, log_type, dbc, frequency, metadata).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            self.restart_workers(executor)
+            raise
+
+def _make_handler(server):
+    class ConversionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif path == "/metrics":
+                self._send_json(200, server.metrics.to_dict())
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path not in ["/convert", "/dbc"]:
+                self._send_json(404, {"error": "Not found"})
+                return
+
+            # Turn requests away before reading their uploads once the service is full
+            if not server.try_acquire():
+                self.close_connection = True
+                self._send_json(503, {"error": "Server busy, retry later"}, {"Retry-After": "1"})
+                return
+
+            start = time.perf_counter()
+            server.metrics.start_request()
+            body = b""
+            ld_data = b""
+            ok = False
+            bad_request = False
+            try:
+                body = self._read_body()
+                if body is None:
+                    return
+
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if url.path == "/dbc":
+                    self._send_json(200, {"dbc": server.save_dbc(body)})
+                else:
+                    ld_data = server.convert(body, params)
+                    self._send_ld(ld_data, params)
+                ok = True
+            except ValueError as e:
+                # Bad parameters, or an upload which isn't a valid log or DBC
+                bad_request = True
+                self._send_json(400, {"error": str(e)})
+            except Exception as e:
+                self._send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+            finally:
+                server.release()
+                server.metrics.finish_request(time.perf_counter() - start, len(body), \
+                    len(ld_data), ok, bad_request)
+
+        def _read_body(self):
+            length = self.headers.get("Content-Length")
+            if length is None:
+                self.close_connection = True
+                self._send_json(411, {"error": "Content-Length is required"})
+                return None
+
+            length = int(length)
+            if length > server.max_upload:
+                self.close_connection = True
+                self._send_json(413, {"error": "Upload larger than %d bytes" % server.max_upload})
+                return None
+
+            return self.rfile.read(length)
+
+        def _send_ld(self, ld_data, params):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(ld_data)))
+            self.send_header("Content-Disposition", "attachment; filename=\"log.ld\"")
+            self.end_headers()
+
+            view = memoryview(ld_data)
+            for begin in range(0, len(view), RESPONSE_BLOCK):
+                self.wfile.write(view[begin:begin + RESPONSE_BLOCK])
+
+        def _send_json(self, status, content, headers=None):
+            data = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            print("%s - %s" % (self.address_string(), format % args))
+
+    return ConversionHandler
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION, epilog=EPILOG)
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--workers", type=int, help="Number of worker processes, defaults to the " \
+        "number of CPUs")
+    parser.add_argument("--queue_size", type=int, help="Number of requests which can wait for a " \
+        "worker before new requests are rejected, defaults to twice the workers")
+    parser.add_argument("--max_upload", type=float, default=512, \
+        help="Maximum size of an uploaded log [MB]")
+    parser.add_argument("--dbc_dir", type=str, \
+        help="Directory to store uploaded DBCs in, defaults to a temporary directory")
+    args = parser.parse_args()
+
+    server = ConversionServer(args.host, args.port, args.workers, args.queue_size, \
+        int(args.max_upload * 1e6), args.dbc_dir)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
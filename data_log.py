@@ -1,21 +1,94 @@
-import cantools
-import mcap
+import array
+import collections
+import concurrent.futures
+import fnmatch
+import itertools
 import math
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+import numpy as np
 from typing import Dict
-from mcap.reader import make_reader
-from mcap_protobuf.decoder import DecoderFactory
+from can_decoder import CanDecoder
+from can_sources import DETECT_LINES, detect_can_source, get_can_source
+from log_io import is_stream, iter_prefetched, open_log, read_position
+
+# Number of new time points computed at a time when resampling a channel
+RESAMPLE_BLOCK = 1 << 20
+
+# Fraction of a period a duration can be short of a whole number of periods through rounding
+# errors, and still count as that many periods, on top of the rounding error of the timestamps
+# themselves, see resample_count
+RESAMPLE_TOLERANCE = 1e-6
+
+# Number of messages of a channel placed at a time when merging channels, see _merge_sorted
+MERGE_BLOCK = 1 << 20
+
+# Ways of resampling a channel, see Channel.resample
+RESAMPLE_MODES = ["hold", "linear", "average", "fir"]
+
+# Maximum number of samples gathered at once for the FIR filter, as time points times taps
+FIR_BLOCK = 1 << 22
+
+# Number of threads resampling channels ahead of the writer, see DataLog.iter_resampled
+RESAMPLE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Held while making room for a resampled channel, so channels resampled on several threads at once
+# don't each spill the others
+_resample_lock = threading.Lock()
+
+# Number of CSV rows or MCAP messages read between checks of the memory budget
+MEMORY_CHECK_ROWS = 10000
+
+# Largest difference between the spacing of the rows of an Arrow table and their average spacing,
+# as a fraction of it, for the rows to count as evenly spaced, see DataLog.from_arrow
+ARROW_JITTER = 0.01
+
+# Magic bytes at the start of Arrow IPC (Feather) files, which are memory mapped rather than read
+ARROW_MAGIC = b"ARROW1"
+
+# The reader back-ends (cantools, mcap, protobuf, pyarrow) are slow to import, so they are imported
+# by the readers that need them rather than here, keeping start up fast for the other log types.
+
 class DataLog(object):
-    """ Container for storing log data which contains a set of channels with time series data."""
-    def __init__(self, name=""):
+    """ Container for storing log data which contains a set of channels with time series data.
+
+    By default all the channel data is kept in memory. When a memory budget is given, channels are
+    spilled to memory mapped files in a scratch directory once they use more memory than the
+    budget allows, see ChannelStore. The scratch files are removed by close().
+    """
+    def __init__(self, name="", memory_budget=None, scratch_dir=None):
+        """
+        name: Name of the log
+        memory_budget: Maximum number of bytes of channel data to keep in memory, None for no limit
+        scratch_dir: Directory to create the scratch directory for spilled channels in
+        """
         self.name = name
         self.channels: Dict[str, Channel] = {}
+        self.store = ChannelStore(memory_budget, scratch_dir)
+
+        # Time the log ends when it's known to be after its last message [s], e.g. one period after
+        # the last sample of a .ld file, see end()
+        self.end_time = None
 
     def clear(self):
         self.channels = {}
+        self.end_time = None
+
+    def close(self):
+        """ Removes any channel data spilled to disc, the log must not be used afterwards. """
+        self.channels = {}
+        self.store.close()
+
+    def check_memory(self):
+        """ Spills channels to disc if they use more memory than the memory budget allows. """
+        self.store.enforce(self.channels.values())
 
     def add_channel(self, name, units, data_type, decimals, initial_message=None):
         msg = [] if not initial_message else [initial_message]
-        self.channels[name] = Channel(name, units, data_type, decimals, msg)
+        self.channels[name] = Channel(name, units, data_type, decimals, msg, self.store)
 
     def add_message(self, channel_name, timestamp, value):
         """ Adds a message to the specified channel.
@@ -27,7 +100,7 @@ class DataLog(object):
         if channel_name not in self.channels:
             raise KeyError(f"Channel '{channel_name}' does not exist in log")
 
-        self.channels[channel_name].messages.append(Message(timestamp, value))
+        self.channels[channel_name].add_message(timestamp, value)
 
     def start(self):
         """ Returns the earliest timestamp from all existing channels [s]. """
@@ -41,66 +114,510 @@ class DataLog(object):
             return 0.0
 
     def end(self):
-        """ Returns the latest timestamp from all existing channels [s]. """
+        """ Returns the latest timestamp from all existing channels, or the end_time of the log if
+        that's later [s].
+        """
         end = 0
         for name, channel in self.channels.items():
             end = max(end, channel.end())
 
+        if self.end_time is not None:
+            end = max(end, self.end_time)
         return end
 
     def duration(self):
         """ Returns the duration of the log [s]. """
         return self.end() - self.start()
 
-    def resample(self, frequency):
+    def num_messages(self):
+        """ Returns the total number of messages across all channels. """
+        return sum(len(channel) for channel in self.channels.values())
+
+    def resample(self, frequency, start=None, end=None, progress=None, modes="hold"):
         """ Resamples all channels such that all messages occur at a fixed frequency.
 
         See the resample method of the Channel class for more details.
+
+        frequency: Frequency to resample at [Hz]
+        start: Time of the first resampled message, defaults to the start of the log [s]
+        end: Time to resample up to, defaults to the end of the log [s]
+        progress: Optional progress.Progress, updated with the number of channels resampled
+        modes: How to resample the channels, see channel_resample_mode
         """
-        start = self.start()
-        end = self.end()
-        for channel_name in self.channels:
-            self.channels[channel_name].resample(start, end, frequency)
+        start = self.start() if start is None else start
+        end = self.end() if end is None else end
+        for i, channel_name in enumerate(self.channels):
+            self.resample_channel(channel_name, frequency, start, end, \
+                channel_resample_mode(modes, channel_name))
+            if progress:
+                progress.update(i + 1, len(self.channels))
 
-    def from_can_log(self, log_lines, can_db):
-        """ Creates channels populated with messages from a candump file and can database.
+    def resample_channel(self, channel_name, frequency, start, end, mode="hold"):
+        """ Resamples a single channel, see the resample method, returning the channel.
 
-        This will create a channel for each entry in the database that has messages present in the
-        log.
+        Other channels are spilled to disc first if there isn't room for the resampled data within
+        the memory budget. Different channels can be resampled on several threads at once.
 
-        log_lines: List, containing candump log lines (recorded with 'candump' with '-l')
-        can_db: cantools.database
+        channel_name: Name of the channel to resample
+        frequency: Frequency to resample at [Hz]
+        start: Time of the first resampled message [s]
+        end: Time to resample up to [s]
+        mode: How to resample the channel, one of RESAMPLE_MODES
         """
+        num_msgs = resample_count(start, end, frequency)
+        channel = self.channels[channel_name]
+        with _resample_lock:
+            # Make room for the resampled data, or write it straight to disc if it doesn't fit
+            others = [c for name, c in self.channels.items() if name != channel_name]
+            fits = self.store.enforce(others, 16 * num_msgs)
+        channel.resample(start, end, frequency, on_disk=not fits, mode=mode)
+        return channel
+
+    def iter_resampled(self, frequency, start=None, end=None, workers=RESAMPLE_WORKERS, \
+            modes="hold"):
+        """ Resamples the channels on a pool of threads, yielding each channel in order once it has
+        been resampled, see the resample method.
+
+        This lets the resampled channels be packed and written while the following channels are
+        still being resampled. NumPy releases the GIL while resampling, so the threads run in
+        parallel with each other and with the writer. Only a couple of channels per thread are
+        resampled ahead of the one being consumed, so the resampled data doesn't pile up in memory.
+
+        frequency: Frequency to resample at [Hz]
+        start: Time of the first resampled message, defaults to the start of the log [s]
+        end: Time to resample up to, defaults to the end of the log [s]
+        workers: Number of threads to resample with
+        modes: How to resample the channels, see channel_resample_mode
+        """
+        start = self.start() if start is None else start
+        end = self.end() if end is None else end
+
+        def submit(name):
+            return executor.submit(self.resample_channel, name, frequency, start, end, \
+                channel_resample_mode(modes, name))
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            queued = iter(list(self.channels))
+            pending = collections.deque(submit(name) for name in itertools.islice(queued, \
+                2 * workers))
+            while pending:
+                channel = pending.popleft().result()
+                for name in itertools.islice(queued, 1):
+                    pending.append(submit(name))
+                yield channel
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def preview(self, bins=None):
+        """ Returns a preview.LogPreview of the channels, a min/max/mean summary of each channel at
+        several resolutions, for drawing previews of any time range quickly.
+
+        bins: Number of bins of the finest level, defaults to preview.BASE_BINS
+        """
+        # Imported here, since it's only needed for previews
+        from preview import BASE_BINS, LogPreview
+
+        return LogPreview.build(self, bins or BASE_BINS)
+
+    def select(self, names=None, start=None, end=None):
+        """ Returns a new DataLog containing a subset of the channels and time range of this log.
+
+        The channels of the new log are views of the data in this log, so nothing is copied, and
+        this log must not be modified while the new log is in use. Resampling the new log doesn't
+        modify this log. The last message before the start of the time range is included, so its
+        value is held into the start of the range when resampling.
+
+        names: Names of the channels to include, defaults to all channels
+        start: Start of the time range [s]
+        end: End of the time range [s]
+        """
+        log = DataLog(self.name)
+        log.store = self.store
+        for name, channel in self.channels.items():
+            if names is None or name in names:
+                log.channels[name] = channel.window(start, end)
+
+        if self.end_time is not None:
+            log.end_time = self.end_time if end is None else min(self.end_time, end)
+
+        return log
+
+    def merge(self, logs, prefixes, offsets=None, collisions="prefix"):
+        """ Replaces the channels of this log with the channels from several other logs.
+
+        Channels with the same name in more than one log are either renamed with the prefix of
+        their log ("prefix"), or combined into a single channel ("merge"). Since the messages of
+        each channel are already in time order, combined channels are merged rather than sorted,
+        and messages with the same timestamp keep the order of their logs, see _merge_sorted.
+
+        logs: List of DataLog to merge, their channels will be modified
+        prefixes: List of channel name prefixes, one per log
+        offsets: Optional list of time offsets to add to the timestamps of each log [s]
+        collisions: How to handle channels with the same name, "prefix" or "merge"
+        """
+        if collisions not in ["prefix", "merge"]:
+            raise ValueError(f"Unknown collision policy '{collisions}'")
+        if offsets is None:
+            offsets = [0.0] * len(logs)
+
         self.clear()
 
-        # Cache all the frame ids in the database for quick lookups
-        known_ids = set()
-        for msg in can_db.messages:
-            known_ids.add(msg.frame_id)
+        name_counts = {}
+        for log in logs:
+            for name in log.channels:
+                name_counts[name] = name_counts.get(name, 0) + 1
+
+        same_name = {}
+        for log, prefix, offset in zip(logs, prefixes, offsets):
+            self.store.adopt(log.store)
+            for name, channel in log.channels.items():
+                channel.data.store = self.store
+                if offset:
+                    channel.shift(offset)
+
+                if name_counts[name] == 1:
+                    self.channels[name] = channel
+                elif collisions == "prefix":
+                    channel.name = f"{prefix}_{name}"
+                    self.channels[channel.name] = channel
+                else:
+                    same_name.setdefault(name, []).append(channel)
+
+        for name, channels in same_name.items():
+            # Make room for the merged data, or write it straight to disc if it doesn't fit
+            num_msgs = sum(len(c) for c in channels)
+            others = list(self.channels.values()) + \
+                [c for group in same_name.values() for c in group]
+            fits = self.store.enforce(others, 16 * num_msgs)
+            times, values, path = self.store.allocate(num_msgs, on_disk=not fits)
+            _merge_sorted(channels, times, values)
 
-        for line in log_lines:
-            stamp, bus, id, data = self.__parse_can_log_line(line)
+            merged = channels[0]
+            merged.data.assign(times, values, path)
+            merged.decimals = max(c.decimals for c in channels)
+            for channel in channels[1:]:
+                channel.data.assign(np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64))
+            self.channels[name] = merged
+
+        end_times = [log.end_time + offset for log, offset in zip(logs, offsets) \
+            if log.end_time is not None]
+        self.end_time = max(end_times) if end_times else None
+        self.check_memory()
+
+    def concatenate(self, logs, relative=None, gap_threshold=1.0):
+        """ Replaces the channels of this log with consecutive segments of a log, e.g. the files of
+        a logger which rotates its log every few minutes.
+
+        Segments are joined in the order given. Channels with the same name are joined into one
+        channel, where any messages of a segment at or before the last message of the channel in
+        the previous segments are dropped, so overlapping segments don't go back in time. Gaps
+        between the segments are left as they are, the last value before a gap is held through it
+        when resampling, and gaps longer than gap_threshold are reported.
+
+        logs: List of DataLog segments, their channels will be modified
+        relative: Optional list of flags, one per segment, for segments whose timestamps are
+            relative to their own start (e.g. read from a .ld file). These are moved to start one
+            sample after the end of the previous segment
+        gap_threshold: Minimum gap between segments to report [s]
+        """
+        if relative is None:
+            relative = [False] * len(logs)
+
+        self.clear()
 
-            if id not in known_ids:
+        parts = {}
+        previous_end = None
+        previous_last = None
+        for i, (log, is_relative) in enumerate(zip(logs, relative)):
+            if not log.channels:
                 continue
 
-            db_msg = can_db.get_message_by_frame_id(id)
-            msg_decoded = can_db.decode_message(id, data,decode_choices=False)
+            if is_relative and previous_end is not None:
+                # Segments read from .ld files already end one period after their last sample
+                frequency = max(channel.avg_frequency() for channel in log.channels.values())
+                step = 1.0 / frequency if frequency > 0 else 0.0
+                offset = max(previous_end, previous_last + step) - log.start()
+                for channel in log.channels.values():
+                    channel.shift(offset)
+                if log.end_time is not None:
+                    log.end_time += offset
 
-            for msg, signal in zip(msg_decoded.items(), db_msg.signals):
-                name = msg[0]
-                value = msg[1]
+            if previous_end is not None:
+                gap = log.start() - previous_end
+                if gap > gap_threshold:
+                    print("Gap of %.3f s before segment %d" % (gap, i + 1))
+                elif gap < 0:
+                    print("Segment %d overlaps the previous segment by %.3f s" % (i + 1, -gap))
+            previous_end = log.end() if previous_end is None else max(previous_end, log.end())
+            last = max(channel.end() for channel in log.channels.values())
+            previous_last = last if previous_last is None else max(previous_last, last)
 
-                if name in self.channels:
-                    self.channels[name].messages.append(Message(stamp, value))
+            self.store.adopt(log.store)
+            for name, channel in log.channels.items():
+                channel.data.store = self.store
+                parts.setdefault(name, []).append(channel)
+
+        for name, channels in parts.items():
+            joined = channels[0]
+            if len(channels) > 1:
+                times = [joined.times]
+                values = [joined.values]
+                last = joined.end() if len(joined) else -math.inf
+                for channel in channels[1:]:
+                    begin = int(np.searchsorted(channel.times, last, side="right"))
+                    times.append(channel.times[begin:])
+                    values.append(channel.values[begin:])
+                    if begin < len(channel):
+                        last = float(channel.times[-1])
+
+                joined.data.assign(np.concatenate(times), np.concatenate(values))
+                joined.decimals = max(c.decimals for c in channels)
+
+            self.channels[name] = joined
+
+        self.end_time = previous_end
+        self.check_memory()
+
+    def from_ld_file(self, ld_path, progress=None):
+        """ Creates channels from the channels of an existing MoTeC .ld file.
+
+        The channel data is read as it was stored, without any decoding. The .ld file only stores
+        the sample rate of each channel, so the timestamps are relative to the start of the file.
+
+        ld_path: Path to the .ld file, or a readable binary file-like object
+        progress: Optional progress.Progress, updated with the number of channels read
+        """
+        # Imported here, since motec_log itself imports this module
+        from motec_log import LdFile
+
+        self.clear()
+        with LdFile(ld_path) as ld_file:
+            for name, ld_channel in ld_file.channels.items():
+                channel = Channel(name, ld_channel.units, \
+                    float if ld_channel.raw.dtype.kind == "f" else int, ld_channel.dec, \
+                    store=self.store)
+
+                # Copy the data, so it isn't a view of the file once that's closed
+                channel.data.assign(ld_channel.times(), np.array(ld_channel.data, \
+                    dtype=np.float64))
+                self.channels[name] = channel
+
+                # Each sample covers one period, so the log ends a period after the last sample,
+                # and is resampled back to the same number of samples
+                if ld_channel.freq > 0:
+                    self.end_time = max(self.end_time or 0.0, len(ld_channel) / ld_channel.freq)
+                self.check_memory()
+                if progress:
+                    progress.update(len(self.channels), len(ld_file.channels))
+
+    def from_parquet(self, path, progress=None):
+        """ Creates channels from the columns of a Parquet file, or an Arrow IPC (Feather) file, see
+        from_arrow.
+
+        Arrow IPC files are memory mapped, so their columns are used in place without reading them
+        into memory. Parquet files are decoded into memory, and a column is only copied if the file
+        has several row groups.
+
+        path: Path to the file, or a readable binary file-like object
+        progress: Optional progress.Progress, updated with the number of columns read
+        """
+        pa, pq = _import_pyarrow()
+
+        if not is_stream(path):
+            with open(path, "rb") as file:
+                arrow_ipc = file.read(len(ARROW_MAGIC)) == ARROW_MAGIC
+            if arrow_ipc:
+                table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+                self.from_arrow(table, progress)
+                return
+
+        self.from_arrow(pq.read_table(path, memory_map=not is_stream(path)), progress)
+
+    def from_arrow(self, table, progress=None):
+        """ Creates channels from the columns of a pyarrow.Table, e.g. one made from a pandas
+        DataFrame with pyarrow.Table.from_pandas.
+
+        The first column must be the time, either in seconds or as a timestamp. A channel is created
+        for every other numeric column, and other columns are ignored. Rows where a column is null
+        are left out of its channel. The units, decimals and data type of the channels are taken
+        from the metadata of their fields, as written by to_arrow.
+
+        Float64 columns without nulls are used without copying them, so the channel data is a read
+        only view of the table, and the time column is shared by the channels.
+
+        table: pyarrow.Table
+        progress: Optional progress.Progress, updated with the number of columns read
+        """
+        pa, pq = _import_pyarrow()
+
+        self.clear()
+
+        # Ignore the index columns written by pandas
+        names = [name for name in table.column_names if not name.startswith("__index_level_")]
+        if not names:
+            return
+
+        times = _arrow_seconds(pa, table.column(names[0]))
+        order = None
+        if len(times) > 1 and np.any(times[1:] < times[:-1]):
+            print("WARNING: Rows are not sorted by time, sorting them")
+            order = np.argsort(times, kind="stable")
+            times = times[order]
+
+        # Evenly spaced rows, e.g. written by to_parquet, each cover one period like the samples of
+        # a .ld file, so the log ends a period after the last row and is resampled back to the
+        # same number of rows
+        if len(times) > 1:
+            period = (times[-1] - times[0]) / (len(times) - 1)
+            if period > 0 and np.all(np.abs(np.diff(times) - period) <= ARROW_JITTER * period):
+                self.end_time = float(times[-1] + period)
+
+        for i, name in enumerate(names[1:]):
+            field = table.schema.field(name)
+            column = table.column(name)
+            if not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or \
+                    pa.types.is_boolean(field.type) or pa.types.is_decimal(field.type)):
+                print("WARNING: Found non numeric values for channel %s, removing channel" % name)
+                continue
+
+            metadata = field.metadata or {}
+            units = metadata.get(b"units", b"").decode()
+            decimals = int(metadata.get(b"decimals", b"0"))
+            if b"data_type" in metadata:
+                data_type = int if metadata[b"data_type"] == b"int" else float
+            else:
+                data_type = float if pa.types.is_floating(field.type) or \
+                    pa.types.is_decimal(field.type) else int
+
+            if column.null_count:
+                valid = column.is_valid().to_numpy(zero_copy_only=False)
+                values = _arrow_to_numpy(pa, column.drop_null())
+                if order is None:
+                    channel_times = times[valid]
                 else:
-                    try:
-                        self.add_channel(name, signal.unit, float, 3, Message(stamp, value))
-                    except TypeError as e:
-                        print(name)
-                        print(f'Error: {e}')
+                    # Index of each row among the valid rows, in the order of the table
+                    index = np.cumsum(valid) - 1
+                    keep = valid[order]
+                    channel_times = times[keep]
+                    values = values[index[order][keep]]
+            else:
+                values = _arrow_to_numpy(pa, column)
+                channel_times = times
+                if order is not None:
+                    values = values[order]
+
+            channel = Channel(name, units, data_type, decimals, store=self.store)
+            channel.data.assign(channel_times, values)
+            self.channels[name] = channel
+            self.check_memory()
+            if progress:
+                progress.update(i + 1, len(names) - 1)
+
+    def to_arrow(self):
+        """ Returns the channels as a pyarrow.Table, e.g. to analyse them with pandas using
+        table.to_pandas().
+
+        The table has a "time" column [s] followed by a column for each channel, so the channels
+        must share their timestamps, e.g. once the log has been resampled. The columns are views of
+        the channel data, nothing is copied. The units, decimals and data type of each channel are
+        stored in the metadata of its field, so from_arrow restores them.
+        """
+        pa, pq = _import_pyarrow()
+
+        channels = list(self.channels.values())
+        times = channels[0].times if channels else np.zeros(0, dtype=np.float64)
+        for channel in channels[1:]:
+            if channel.times is not times and not np.array_equal(channel.times, times):
+                raise ValueError(f"Channel {channel.name} doesn't share the timestamps of the " \
+                    "other channels, resample the log first")
+
+        fields = [pa.field("time", pa.float64(), nullable=False, metadata={"units": "s"})]
+        columns = [pa.array(times)]
+        for channel in channels:
+            fields.append(pa.field(channel.name, pa.float64(), nullable=False, metadata={
+                "units": channel.units,
+                "decimals": str(channel.decimals),
+                "data_type": "int" if channel.data_type is int else "float",
+            }))
+            columns.append(pa.array(channel.values))
+
+        return pa.Table.from_arrays(columns, schema=pa.schema(fields, metadata={"name": self.name}))
+
+    def to_parquet(self, path, compression="zstd"):
+        """ Writes the channels to a Parquet file, see to_arrow.
+
+        path: Path of the file, or a writable binary file-like object
+        compression: Compression codec of the file, e.g. "zstd", "snappy" or "none"
+        """
+        pa, pq = _import_pyarrow()
+        pq.write_table(self.to_arrow(), path, compression=compression)
+
+    def from_can_log(self, log_lines, can_db, log_format=None, memo_size=32, j1939=None, \
+            source_address_suffix=False, progress=None, prefetch=False):
+        """ Creates channels populated with messages from a CAN log file and can database.
+
+        This will create a channel for each entry in the database that has messages present in the
+        log. The format of the log is auto detected from the first lines, see can_sources for the
+        supported formats.
+
+        log_lines: Iterable of log lines, e.g. a list or an open file which will be streamed
+        can_db: cantools.database
+        log_format: Optional name of the CanFrameSource to use instead of auto detecting it
+        memo_size: Number of decoded payloads to memoize per CAN id, see CanDecoder
+        j1939: Match extended messages by PGN, None only does so for messages the DBC marks as J1939
+        source_address_suffix: Append the source address of J1939 frames to the channel names
+        progress: Optional progress.Progress, updated with the number of frames read
+        prefetch: Parse the next chunks of the log on a background thread while the current chunk
+            is decoded, see log_io.iter_prefetched
+
+        Returns the CanDecoder used, which holds the decode cache statistics
+        """
+        self.clear()
+
+        decoder = CanDecoder(can_db, memo_size, j1939, source_address_suffix)
+
+        log_lines = iter(log_lines)
+        head = list(itertools.islice(log_lines, DETECT_LINES))
+        if not head:
+            return decoder
+        source = get_can_source(log_format) if log_format else detect_can_source(head)
+
+        chunks = source.iter_chunks(itertools.chain(head, log_lines))
+        if prefetch:
+            chunks = iter_prefetched(chunks)
+
+        num_frames = 0
+        for frames in chunks:
+            # Drop all the frames which aren't in the database before doing any per frame work
+            for i in np.flatnonzero(decoder.known_mask(frames.ids)):
+                try:
+                    data = bytes.fromhex(frames.data[i])
+                except ValueError:
+                    # Remote frames and corrupted lines have no usable data
+                    continue
+                self.__add_can_frame(float(frames.stamps[i]), int(frames.ids[i]), data, decoder)
+            self.check_memory()
 
-    def from_csv_log(self, log_lines):
+            num_frames += len(frames.ids)
+            if progress:
+                progress.update(num_frames)
+
+        return decoder
+
+    def __add_can_frame(self, stamp, id, data, decoder):
+        """ Decodes a single CAN frame and adds its signal values to the channels. """
+        for name, signal, value in decoder.decode(id, data):
+            if name in self.channels:
+                self.channels[name].add_message(stamp, value)
+            else:
+                try:
+                    self.add_channel(name, signal.unit, float, 3, Message(stamp, value))
+                except TypeError as e:
+                    print(name)
+                    print(f'Error: {e}')
+
+    def from_csv_log(self, log_lines, progress=None):
         """ Creates channels populated with messages from a CSV log file.
 
         This will create a channel for each column in the CSV file, with the name of that channel
@@ -108,6 +625,7 @@ class DataLog(object):
         will be ignored, and that channel will be removed. The first column of data must be time
 
         log_lines: List, containing CSV log lines
+        progress: Optional progress.Progress, updated with the number of rows read
         """
         self.clear()
 
@@ -128,7 +646,12 @@ class DataLog(object):
             i += 1
 
         # Go through each line grabbing all the channel values
-        for line in log_lines[1:]:
+        for row, line in enumerate(log_lines[1:]):
+            if row % MEMORY_CHECK_ROWS == 0:
+                self.check_memory()
+                if progress:
+                    progress.update(row, len(log_lines) - 1)
+
             line = line.strip("\n")
             values = line.split(",")
 
@@ -143,8 +666,7 @@ class DataLog(object):
                 # We'll only parse numeric data
                 try:
                     val = float(values[i + 1])
-                    message = Message(t, val)
-                    self.channels[name].messages.append(message)
+                    self.channels[name].add_message(t, val)
 
                     val_text_split = values[i + 1].split(".")
                     decimals_present = 0 if len(val_text_split) == 1 else len(val_text_split[1])
@@ -158,7 +680,7 @@ class DataLog(object):
                 del channel_dict[name]
                 del self.channels[name]
 
-    def from_mcap_log(self, mcap_path):
+    def from_mcap_log(self, mcap_path, progress=None):
         """ Creates channels populated with messages from an MCAP log file.
 
         This will create a channel for each topic in the MCAP file, with the name and units of that
@@ -166,12 +688,24 @@ class DataLog(object):
         will be removed.
 
         mcap_file: Path to the MCAP log file
+        progress: Optional progress.Progress, updated with the number of messages read
         """
+        from mcap.reader import make_reader
+        from mcap_protobuf.decoder import DecoderFactory
 
         self.clear()
-        with open(mcap_path, "rb") as mcap_file:
+        with open_log(mcap_path, "rb") as mcap_file:
+            if progress and not is_stream(mcap_path):
+                progress.track(read_position(mcap_file), os.path.getsize(mcap_path))
+
             reader = make_reader(mcap_file, decoder_factories=[DecoderFactory()])
-            for schema, channel, message, proto_msg in reader.iter_decoded_messages():
+            for i, (schema, channel, message, proto_msg) in \
+                    enumerate(reader.iter_decoded_messages()):
+                if i % MEMORY_CHECK_ROWS == 0:
+                    self.check_memory()
+                    if progress:
+                        progress.update(i)
+
                 # Divide timestamp by whatever is needed to convert it to seconds
                 timestamp = message.log_time / 1e9  # Convert nanoseconds to seconds
                 if hasattr(proto_msg, 'ListFields'):
@@ -208,7 +742,7 @@ class DataLog(object):
                     else:
                         print(f"msg: {proto_msg}")
 
-    def from_accessport_log(self, log_lines):
+    def from_accessport_log(self, log_lines, progress=None):
         """ Creates channels populated with messages from a COBB Accessport CSV log file.
 
         This will create a channel for each column in the CSV file, with the name and units of that
@@ -216,9 +750,10 @@ class DataLog(object):
         will be removed.
 
         log_lines: List, containing CSV log lines
+        progress: Optional progress.Progress, updated with the number of rows read
         """
 
-        self.from_csv_log(log_lines)
+        self.from_csv_log(log_lines, progress)
 
         # Accessport logs have a column for AP info which is not of any value so we'll delete it
         for key in self.channels.keys():
@@ -236,19 +771,6 @@ class DataLog(object):
             channel.name = name
             channel.units = units
 
-    @staticmethod
-    def __parse_can_log_line(line):
-        """ Extracts the timestamp, bus, arbitration id, and data from a single line in a can log file
-        recorded with candump -l.
-        """
-        stamp, bus, msg = line.split()
-        stamp = float(stamp[1:-1])
-        id, data = msg.split("#")
-        id = int(id, 16)
-        data = bytearray.fromhex(data)
-
-        return stamp, bus, id, data
-
     def __str__(self):
         output = "Log: %s, Duration: %f s" % (self.name, (self.end() - self.start()))
         for channel_name, channel_data in self.channels.items():
@@ -257,88 +779,605 @@ class DataLog(object):
 
 class Channel(object):
     """ Represents a singe channel of data containing a time series of values."""
-    def __init__(self, name, units, data_type, decimals, messages=None):
+    def __init__(self, name, units, data_type, decimals, messages=None, store=None):
         self.name = str(name)
         self.units = str(units)
         self.data_type = data_type
         self.decimals = decimals
-        self.messages = []
+        self.data = ChannelData(store if store is not None else ChannelStore())
         if messages:
             self.messages = messages
-            
+
+    @property
+    def times(self):
+        """ Array of the message timestamps [s]. """
+        return self.data.arrays()[0]
+
+    @property
+    def values(self):
+        """ Array of the message values. """
+        return self.data.arrays()[1]
+
+    @property
+    def messages(self):
+        """ List of the messages in the channel. This is a copy of the channel data, so changes to
+        the list have no effect on the channel, use add_message() to add messages instead.
+        """
+        times, values = self.data.arrays()
+        return [Message(t, v) for t, v in zip(times.tolist(), values.tolist())]
+
+    @messages.setter
+    def messages(self, messages):
+        self.data.assign(np.array([msg.timestamp for msg in messages], dtype=np.float64), \
+            np.array([msg.value for msg in messages], dtype=np.float64))
+
+    def __len__(self):
+        return len(self.data)
+
     def add_message(self, timestamp, value):
         """ Adds a message to the channel.
 
         timestamp: Timestamp of the message [s]
         value: Value of the message
         """
-        self.messages.append(Message(timestamp, value))
+        self.data.append(timestamp, value)
 
     def start(self):
-        if self.messages:
-            return self.messages[0].timestamp
+        if len(self.data):
+            return float(self.times[0])
         else:
             return 0
 
     def end(self):
-        if self.messages:
-            return self.messages[-1].timestamp
+        if len(self.data):
+            return float(self.times[-1])
         else:
             return 0
 
+    def window(self, start=None, end=None):
+        """ Returns a copy of the channel containing only the messages within a time range, along
+        with the last message before it. The data of the new channel is a view of this channel's.
+
+        start: Start of the time range [s]
+        end: End of the time range [s]
+        """
+        times, values = self.data.arrays()
+        begin = 0
+        stop = len(times)
+        if start is not None:
+            begin = max(int(np.searchsorted(times, start, side="left")) - 1, 0)
+        if end is not None:
+            stop = int(np.searchsorted(times, end, side="right"))
+
+        channel = Channel(self.name, self.units, self.data_type, self.decimals, \
+            store=self.data.store)
+        channel.data.assign(times[begin:stop], values[begin:stop])
+        return channel
+
+    def shift(self, offset):
+        """ Adds a time offset to all the messages in the channel [s]. """
+        times = self.times
+        if self.data._path is not None:
+            # Spilled to files of its own, so shift them in place rather than reading them in
+            times[:] += offset
+        else:
+            # The array may be shared with other channels, e.g. the time column of an Arrow table,
+            # or be a view of another channel, so it's replaced rather than modified
+            self.data.assign(times + offset, self.values)
+
     def avg_frequency(self):
         """ Computes the average frequency from the samples based on the duration of the channel
         and the number of messages"""
-        if len(self.messages) >= 2:
+        if len(self.data) >= 2:
             dt = self.end() - self.start()
-            return len(self.messages) / dt
+            return len(self.data) / dt
         else:
             return 0
 
-    def resample(self, start_time, end_time, frequency):
+    def resample(self, start_time, end_time, frequency, on_disk=False, mode="hold"):
         """ Resamples the data such that all messages occur at a fixed frequency.
 
-        If multiple messages fall within the time interval between messages for the new frequency,
-        the latest message will be used. When no existing messages fall within the time interval
-        the most recent value will be retained. If no existing message is present within the first
-        new time interval, then the first message will be initialized at 0.
+        Each new message covers the time interval around it, half a period either side. The mode
+        decides how its value is computed from the existing messages:
+
+        hold: If multiple messages fall within the interval, the latest message will be used. When
+            no existing messages fall within the interval the most recent value will be retained.
+        linear: The value is interpolated linearly between the existing messages either side of it.
+        average: The mean of the messages within the interval, which smooths out noise when
+            downsampling. Intervals without any messages retain the most recent value.
+        fir: The existing messages are low pass filtered with a windowed sinc FIR filter before
+            they're sampled, which stops signals above half the new frequency aliasing when
+            downsampling, e.g. vibration in accelerometer channels. This assumes the messages are
+            evenly spaced, as for most CAN signals. Falls back to hold when upsampling.
+
+        In every mode, if no existing message is present within the first new time interval, then
+        the first message will be initialized at 0. Integer channels, e.g. gears or states, are
+        always held, since values in between them have no meaning.
+
+        The resampled data is computed in blocks, straight from the existing messages, so channels
+        spilled to disc are streamed rather than loaded into memory, and downsampled channels never
+        take more space than their resampled data.
+
+        on_disk: Store the resampled data in the scratch directory rather than in memory
+        mode: How to compute the resampled values, one of RESAMPLE_MODES
         """
-        if not self.messages:
+        if mode not in RESAMPLE_MODES:
+            raise ValueError(f"Unknown resample mode '{mode}', must be one of {RESAMPLE_MODES}")
+        if not len(self.data):
             return
+        if self.data_type is int:
+            mode = "hold"
 
         # Determine how many messages this channel should have,
-        num_msgs = math.floor(frequency * (end_time - start_time))
+        num_msgs = resample_count(start_time, end_time, frequency)
         dt_step = 1.0 / frequency
 
-        # Create a new message at each time new time point based on the frequency. As we step
-        # through the new sample points we'll find the latest pre existing message to insert there,
-        # and will hold that value until we find another message.
-        value = 0
-        t = start_time
-        current_msgs_index = 0
-        new_msgs = []
-        for i in range(num_msgs):
-            # Grab the latest message that falls in this time window, if there is one, and update
-            # the current channel value
-            while current_msgs_index < len(self.messages):
-                msg_stamp = self.messages[current_msgs_index].timestamp
-
-                if msg_stamp < t + 0.5 * dt_step:
-                    # This message falls in the time window
-                    value = self.messages[current_msgs_index].value
-                    current_msgs_index += 1
-                else:
-                    # This messages belongs in a future window
-                    break
+        times, values = self.data.arrays()
+        new_times, new_values, path = self.data.store.allocate(num_msgs, on_disk)
+        resample_times(start_time, end_time, frequency, out=new_times)
 
-            new_msgs.append(Message(t, value))
-            t += dt_step
+        taps = None
+        if mode == "fir":
+            taps = fir_taps(self.avg_frequency() / frequency)
+            if taps is None:
+                mode = "hold"
 
-        self.messages = new_msgs
+        for begin in range(0, num_msgs, RESAMPLE_BLOCK):
+            end = min(begin + RESAMPLE_BLOCK, num_msgs)
+            block_times = new_times[begin:end]
+
+            # For each time point find the latest pre existing message that falls before the end
+            # of its time window, and hold that value until the next message.
+            indices = np.searchsorted(times, block_times + 0.5 * dt_step, side="left")
+            held = np.maximum(indices - 1, 0)
+            if mode == "linear":
+                block_values = np.interp(block_times, times, values)
+            elif mode == "average":
+                block_values = _window_means(times, values, block_times - 0.5 * dt_step, \
+                    indices)
+            elif mode == "fir":
+                # Centred on the message nearest each time point, so the output doesn't lead or lag
+                block_values = _filtered(values, _nearest(times, block_times), taps)
+            else:
+                block_values = values[held]
+            block_values[indices == 0] = 0
+            new_values[begin:end] = block_values
+
+        self.data.assign(new_times, new_values, path)
 
     def __str__(self):
         return "Channel: %s, Units: %s, Decimals: %d, Messages: %d, Frequency: %.2f Hz" % \
-        (self.name, self.units, self.decimals, len(self.messages), self.avg_frequency())
+        (self.name, self.units, self.decimals, len(self.data), self.avg_frequency())
+
+def _import_pyarrow():
+    """ Returns the pyarrow and pyarrow.parquet modules, which are only needed for Parquet and Arrow
+    logs, so they're an optional dependency.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow logs require the 'pyarrow' package") from None
+
+    return pyarrow, pyarrow.parquet
+
+def _arrow_seconds(pa, column):
+    """ Returns an Arrow time column as a NumPy array of seconds, timestamps are converted to
+    seconds since the epoch.
+    """
+    if pa.types.is_timestamp(column.type) or pa.types.is_duration(column.type):
+        scale = {"s": 1.0, "ms": 1e-3, "us": 1e-6, "ns": 1e-9}[column.type.unit]
+        return _arrow_to_numpy(pa, column.cast(pa.int64())) * scale
+
+    return _arrow_to_numpy(pa, column)
+
+def _arrow_to_numpy(pa, column):
+    """ Returns an Arrow column as a float64 NumPy array, without copying it if it's already a
+    single chunk of float64 values without nulls.
+    """
+    array = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+    if array.type == pa.float64() and array.null_count == 0:
+        return array.to_numpy(zero_copy_only=True)
+
+    return array.cast(pa.float64()).to_numpy(zero_copy_only=False)
+
+def channel_resample_mode(modes, channel_name):
+    """ Returns the resample mode of a channel.
+
+    modes: Either one of RESAMPLE_MODES for every channel, or a dict of channel name patterns,
+        which may contain wildcards, to modes. The first pattern which matches the channel name
+        is used, and channels which don't match any pattern are held
+    """
+    if isinstance(modes, str):
+        return modes
+
+    for pattern, mode in modes.items():
+        if fnmatch.fnmatchcase(channel_name, pattern):
+            return mode
+    return "hold"
+
+def fir_taps(decimation):
+    """ Returns the taps of a low pass FIR filter for downsampling by a factor, or None if it
+    isn't downsampling.
+
+    The filter is a Hamming windowed sinc with its cutoff at half the new sample rate, with about
+    four taps per factor, normalised to unity gain.
+
+    decimation: Ratio of the existing sample rate to the new one
+    """
+    if not decimation > 1:
+        return None
+
+    half = math.ceil(2 * decimation)
+    n = np.arange(-half, half + 1)
+    taps = np.sinc(n / decimation) * np.hamming(len(n))
+    return taps / taps.sum()
+
+def _window_means(times, values, window_starts, window_ends):
+    """ Returns the mean of the values within each time window, or the latest value before the
+    end of windows without any values.
+
+    window_starts: Array of the start time of each window [s], which mustn't be empty
+    window_ends: Array of the index of the first value after each window
+    """
+    starts = np.searchsorted(times, window_starts, side="left")
+    counts = window_ends - starts
+
+    # The windows only cover part of the channel, which is summed with reduceat on a copy of
+    # that part. reduceat needs in range indices, so the copy has an extra zero at its end.
+    offset = int(starts[0])
+    segment = np.append(values[offset:int(window_ends[-1])], 0.0)
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2] = starts - offset
+    bounds[1::2] = window_ends - offset
+    sums = np.add.reduceat(segment, bounds)[0::2]
+
+    means = values[np.maximum(window_ends - 1, 0)]
+    filled = counts > 0
+    means[filled] = sums[filled] / counts[filled]
+    return means
+
+def _nearest(times, new_times):
+    """ Returns the index of the time nearest each of the new times. """
+    if len(times) < 2:
+        return np.zeros(len(new_times), dtype=np.intp)
+
+    after = np.clip(np.searchsorted(times, new_times, side="left"), 1, len(times) - 1)
+    before_nearer = new_times - times[after - 1] <= times[after] - new_times
+    return after - before_nearer
+
+def _filtered(values, indices, taps):
+    """ Returns the values filtered by a symmetric FIR filter, only at the given indices, so a
+    downsampled channel is only filtered where it's sampled. The values are extended at either end
+    with the first and last values.
+    """
+    half = len(taps) // 2
+    output = np.empty(len(indices), dtype=np.float64)
+    step = max(1, FIR_BLOCK // len(taps))
+    for begin in range(0, len(indices), step):
+        block = indices[begin:begin + step]
+        first = int(block[0]) - half
+        last = int(block[-1]) + half + 1
+
+        # Gather the part of the channel covering the block, padded beyond the ends of the channel
+        segment = values[max(first, 0):min(last, len(values))]
+        segment = np.pad(segment, (max(-first, 0), max(last - len(values), 0)), mode="edge")
+        windows = np.lib.stride_tricks.sliding_window_view(segment, len(taps))
+        output[begin:begin + step] = windows[block - block[0]] @ taps
+
+    return output
+
+def _merge_sorted(channels, out_times, out_values):
+    """ Merges the messages of channels which are each in time order into the output arrays.
+    Messages with the same timestamp keep the order of their channels.
+
+    Each message of the later channels goes at its index in its own channel plus the number of
+    messages of the other channels before it, which are found with a binary search, and the
+    messages of the first channel fill the remaining places in order. So the messages are placed
+    in one pass rather than sorted, and merging two logs takes a single search. They're placed in
+    blocks, so spilled channels are streamed rather than loaded into memory, and the output arrays
+    can be memory mapped.
+    """
+    channel_times = [channel.times for channel in channels]
+    taken = np.zeros(len(out_times), dtype=bool)
+    for i, channel in enumerate(channels[1:], 1):
+        times, values = channel.data.arrays()
+        for begin in range(0, len(times), MERGE_BLOCK):
+            block_times = times[begin:begin + MERGE_BLOCK]
+            positions = np.arange(begin, begin + len(block_times))
+            for j, other_times in enumerate(channel_times):
+                if j != i:
+                    # Ties go to the channel of the earlier log
+                    positions += np.searchsorted(other_times, block_times, \
+                        side="right" if j < i else "left")
+            out_times[positions] = block_times
+            out_values[positions] = values[begin:begin + MERGE_BLOCK]
+            taken[positions] = True
+
+    times, values = channels[0].data.arrays()
+    filled = 0
+    for begin in range(0, len(out_times), MERGE_BLOCK):
+        positions = begin + np.flatnonzero(~taken[begin:begin + MERGE_BLOCK])
+        out_times[positions] = times[filled:filled + len(positions)]
+        out_values[positions] = values[filled:filled + len(positions)]
+        filled += len(positions)
+
+def resample_count(start_time, end_time, frequency):
+    """ Returns the number of time points channels are resampled onto, see resample_times.
+
+    A duration within a rounding error of a whole number of periods counts as that many periods,
+    so e.g. a log read from a .ld file, which ends n periods after its start, is resampled back
+    to n samples. The rounding error grows with the size of the timestamps, e.g. those since the
+    epoch are only accurate to a few hundred nanoseconds.
+    """
+    rounding = 4 * np.spacing(max(abs(start_time), abs(end_time)))
+    return math.floor(frequency * (end_time - start_time + rounding) + RESAMPLE_TOLERANCE)
+
+def resample_times(start_time, end_time, frequency, out=None):
+    """ Returns the time points which channels are resampled onto, see Channel.resample. These are
+    the same for every channel, so e.g. the length and frequency of the resampled channels can be
+    known before they're resampled.
+
+    The offsets of the time points from the start are accumulated one step at a time, so they're
+    identical to stepping through them in a loop, and the start is added afterwards. Stepping
+    from the start itself would round every step to the precision of large timestamps, e.g. those
+    since the epoch, and the errors would add up over long logs. The time points are computed in
+    blocks, so out can be a memory mapped array.
+
+    out: Optional array to store the time points in, which must have the right length
+    """
+    num_msgs = resample_count(start_time, end_time, frequency)
+    dt_step = 1.0 / frequency
+    if out is None:
+        out = np.empty(num_msgs, dtype=np.float64)
+
+    offset = 0.0
+    for begin in range(0, num_msgs, RESAMPLE_BLOCK):
+        end = min(begin + RESAMPLE_BLOCK, num_msgs)
+        steps = np.full(end - begin, dt_step)
+        steps[0] = offset
+        block_times = np.cumsum(steps, out=out[begin:end])
+        offset = block_times[-1] + dt_step
+        block_times += start_time
+
+    return out
+
+class ChannelStore(object):
+    """ Manages the memory used by the channels of a log, spilling them to disc when needed.
+
+    Without a memory budget all channel data is kept in memory. With a budget, once the channels
+    use more memory than it allows, the largest channels are moved to files in a scratch directory
+    and memory mapped, so the conversion slows down to disc speed rather than running out of
+    memory. The scratch directory is removed once the store is closed or garbage collected.
+    """
+    def __init__(self, memory_budget=None, scratch_dir=None):
+        """
+        memory_budget: Maximum number of bytes of channel data to keep in memory, None for no limit
+        scratch_dir: Directory to create the scratch directory in, defaults to the system temp dir
+        """
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.spilled_channels = 0
+
+        self._directory = None
+        self._finalizer = None
+        self._num_files = 0
+        self._lock = threading.Lock()
+
+        # Scratch directories of other stores whose channels were merged into this store
+        self._adopted = []
+
+    def directory(self):
+        """ Returns the scratch directory, creating it if needed. """
+        with self._lock:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix="motec_log_", dir=self.scratch_dir)
+                self._finalizer = weakref.finalize(self, shutil.rmtree, self._directory, True)
+
+        return self._directory
+
+    def new_path(self):
+        """ Returns a new unique path in the scratch directory for the files of a channel. """
+        directory = self.directory()
+        with self._lock:
+            self._num_files += 1
+            return os.path.join(directory, "%d" % self._num_files)
+
+    def allocate(self, size, on_disk=False):
+        """ Returns uninitialized timestamp and value arrays, and the path of their files if they
+        were created on disc, otherwise None.
+        """
+        if not on_disk or size == 0:
+            return np.empty(size, dtype=np.float64), np.empty(size, dtype=np.float64), None
+
+        path = self.new_path()
+        return np.memmap(path + ".t", dtype=np.float64, mode="w+", shape=(size,)), \
+            np.memmap(path + ".v", dtype=np.float64, mode="w+", shape=(size,)), path
+
+    def enforce(self, channels, reserve=0):
+        """ Spills the largest channels to disc until the channels fit within the memory budget.
+
+        channels: Iterable of the Channels using this store
+        reserve: Number of bytes to leave free for an upcoming allocation
+
+        Returns False if the reserved bytes can't fit in memory even after spilling all channels
+        """
+        if self.memory_budget is None:
+            return True
+
+        datas = [channel.data for channel in channels]
+        in_memory = sum(data.nbytes_in_memory() for data in datas)
+        if in_memory + reserve <= self.memory_budget:
+            return True
+
+        for data in sorted(datas, key=lambda data: data.nbytes_in_memory(), reverse=True):
+            if in_memory + reserve <= self.memory_budget:
+                break
+
+            nbytes = data.nbytes_in_memory()
+            data.spill()
+            in_memory -= nbytes
+            if not self.spilled_channels:
+                print("Memory budget of %.1f MB exceeded, spilling channels to %s" % \
+                    (self.memory_budget / 1e6, self.directory()))
+            self.spilled_channels += 1
+
+        return in_memory + reserve <= self.memory_budget
+
+    def adopt(self, other):
+        """ Takes over responsibility for removing the scratch directory of another store. """
+        if other is self:
+            return
+        if other._finalizer is not None and other._finalizer.detach():
+            self._adopted.append(weakref.finalize(self, shutil.rmtree, other._directory, True))
+        self._adopted.extend(other._adopted)
+        other._adopted = []
+        self.spilled_channels += other.spilled_channels
+
+    def close(self):
+        """ Removes the scratch directory along with any spilled channel data. """
+        if self._finalizer is not None:
+            self._finalizer()
+        for finalizer in self._adopted:
+            finalizer()
+        self._adopted = []
+
+    def __getstate__(self):
+        # Pickling hands the scratch files over to the unpickled copy, e.g. when a log is returned
+        # from a worker process, so they aren't removed when the original is garbage collected
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_finalizer"] = None
+        state["_adopted"] = []
+        if self._directory is not None:
+            state["_adopted"].append(self._directory)
+            if self._finalizer is not None:
+                self._finalizer.detach()
+        for finalizer in self._adopted:
+            info = finalizer.detach()
+            if info:
+                state["_adopted"].append(info[2][0])
+
+        return state
+
+    def __setstate__(self, state):
+        directories = state.pop("_adopted")
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._directory = None
+        self._adopted = [weakref.finalize(self, shutil.rmtree, directory, True) \
+            for directory in directories]
+
+class ChannelData(object):
+    """ Storage for the timestamps and values of a single channel.
+
+    New messages are appended to compact buffers, which are moved into NumPy arrays when the data
+    is accessed. Once spilled to disc, the arrays are memory mapped files in the scratch directory
+    of the store, and newly appended messages are added to the end of the files.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._times = np.zeros(0, dtype=np.float64)
+        self._values = np.zeros(0, dtype=np.float64)
+        self._new_times = array.array("d")
+        self._new_values = array.array("d")
+
+        # Base path of the data files, if the channel has been spilled to disc
+        self._path = None
+
+    def __len__(self):
+        return len(self._times) + len(self._new_times)
+
+    def append(self, timestamp, value):
+        self._new_times.append(timestamp)
+        self._new_values.append(value)
+
+    def nbytes_in_memory(self):
+        nbytes = (len(self._new_times) + len(self._new_values)) * 8
+        if self._path is None and not isinstance(self._times, np.memmap):
+            nbytes += self._times.nbytes + self._values.nbytes
+
+        return nbytes
+
+    def arrays(self):
+        """ Returns the timestamp and value arrays. """
+        if self._new_times:
+            if self._path is None:
+                self._times = np.concatenate((self._times, np.frombuffer(self._new_times)))
+                self._values = np.concatenate((self._values, np.frombuffer(self._new_values)))
+            else:
+                with open(self._path + ".t", "ab") as file:
+                    self._new_times.tofile(file)
+                with open(self._path + ".v", "ab") as file:
+                    self._new_values.tofile(file)
+                self._map(len(self._times) + len(self._new_times))
+
+            self._new_times = array.array("d")
+            self._new_values = array.array("d")
+
+        return self._times, self._values
+
+    def assign(self, times, values, path=None):
+        """ Replaces the data with new arrays.
+
+        path: Base path of the files of the arrays if they are memory mapped, see
+            ChannelStore.allocate()
+        """
+        old_path = self._path
+        self._times = times
+        self._values = values
+        self._new_times = array.array("d")
+        self._new_values = array.array("d")
+        self._path = path
+        if old_path is not None and old_path != path:
+            self._remove_files(old_path)
+
+    def spill(self):
+        """ Moves the data to files in the scratch directory of the store. """
+        if self._path is not None:
+            return
+
+        times, values = self.arrays()
+        path = self.store.new_path()
+        times.tofile(path + ".t")
+        values.tofile(path + ".v")
+        self._path = path
+        self._map(len(times))
+
+    def _map(self, size):
+        if size:
+            self._times = np.memmap(self._path + ".t", dtype=np.float64, mode="r+", shape=(size,))
+            self._values = np.memmap(self._path + ".v", dtype=np.float64, mode="r+", shape=(size,))
+        else:
+            self._times = np.zeros(0, dtype=np.float64)
+            self._values = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def _remove_files(path):
+        for suffix in [".t", ".v"]:
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                # Windows can't remove files which are still mapped, they are removed along with
+                # the scratch directory instead
+                pass
+
+    def __getstate__(self):
+        # Spilled data is passed along as the paths of its files rather than being copied
+        self.arrays()
+        state = self.__dict__.copy()
+        if self._path is not None:
+            state["_times"] = None
+            state["_values"] = None
+            state["_size"] = len(self._times)
+
+        return state
+
+    def __setstate__(self, state):
+        size = state.pop("_size", 0)
+        self.__dict__.update(state)
+        if self._path is not None:
+            self._map(size)
 
 class Message(object):
     """ A single message in a time series of data. """
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+# Bump this if the format of the cache files changes
+CACHE_VERSION = 1
+
+# Environment variable to override the cache directory, set it to an empty string to disable the
+# cache on disc
+CACHE_DIR_ENV = "MOTEC_DBC_CACHE_DIR"
+
+def user_cache_dir(name):
+    """ Returns a directory in the user's cache directory for one kind of cached data, e.g. "dbc".
+    """
+    if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+        base = os.environ["LOCALAPPDATA"]
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base, "motec_log_generator", name)
+
+def default_cache_dir():
+    """ Returns the directory the parsed DBC files are cached in, shared by all processes of the
+    user, or None if the disc cache is disabled.
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is not None:
+        return os.path.expanduser(cache_dir) if cache_dir else None
+
+    return user_cache_dir("dbc")
+
+class DbcCache(object):
+    """ Loads DBC files, caching the parsed databases on disc and in memory.
+
+    Parsing a large DBC with cantools can take longer than converting a short log, so the parsed
+    database is pickled to the cache directory the first time a DBC is loaded. The cache files are
+    keyed by a hash of the DBC contents along with the cantools and Python versions, so an edited
+    DBC or an upgraded cantools is parsed again rather than using a stale database. Databases are
+    also kept in memory, so repeated conversions in the same process (e.g. the GUI) skip the disc.
+    """
+    def __init__(self, cache_dir=None):
+        """
+        cache_dir: Directory to store the cache files in, defaults to default_cache_dir()
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+        self._databases = {}
+
+        # Where the last database came from, one of "memory", "disc" or "parsed"
+        self.last_source = None
+
+    def cache_key(self, dbc_path):
+        """ Returns the key of a DBC file's cached database. """
+        import cantools
+
+        digest = hashlib.sha256()
+        with open(dbc_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+
+        digest.update(("%d/%s/%d.%d" % (CACHE_VERSION, cantools.__version__, \
+            sys.version_info.major, sys.version_info.minor)).encode())
+        return digest.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def load(self, dbc_path):
+        """ Returns the cantools.database of a DBC file, parsing it only if it isn't cached. """
+        key = self.cache_key(dbc_path)
+        can_db = self._databases.get(key)
+        if can_db is not None:
+            self.last_source = "memory"
+            return can_db
+
+        can_db = self._load_cached(key)
+        if can_db is not None:
+            self.last_source = "disc"
+        else:
+            import cantools
+            can_db = cantools.database.load_file(dbc_path)
+            self.last_source = "parsed"
+            self._save(key, can_db)
+
+        self._databases[key] = can_db
+        return can_db
+
+    def _load_cached(self, key):
+        if not self.cache_dir:
+            return None
+
+        try:
+            with open(self.cache_path(key), "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # A corrupted or incompatible cache file just means the DBC gets parsed again
+            print(f"Warning: Ignoring invalid DBC cache file {self.cache_path(key)}: {e}")
+            return None
+
+    def _save(self, key, can_db):
+        if not self.cache_dir:
+            return
+
+        # Write to a temporary file first, so other processes never see a partially written file
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    pickle.dump(can_db, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.cache_path(key))
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except (OSError, pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+            # The cache is only a speed up, so a database which can't be written or pickled is
+            # just parsed again next time
+            print(f"Warning: Failed to cache DBC in {self.cache_dir}: {e}")
+
+_default_cache = None
+
+def get_dbc_cache():
+    """ Returns the DbcCache shared by everything in this process. """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DbcCache()
+
+    return _default_cache
+
+def load_dbc(dbc_path):
+    """ Loads a DBC file using the shared DbcCache. """
+    return get_dbc_cache().load(dbc_path)
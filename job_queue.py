@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import queue
+import time
+from collections import OrderedDict
+
+# Time a running job is given to stop by itself after being cancelled, before it is terminated [s]
+CANCEL_TIMEOUT = 5.0
+
+class ConversionJob(object):
+    """ A single conversion in a JobQueue.
+
+    id: Number of the job, in the order they were submitted
+    kwargs: Arguments of generate_motec_log
+    state: One of "queued", "running", "done", "failed" or "cancelled"
+    stage: Name of the current stage of the conversion
+    fraction: Fraction of the current stage completed, or None if it isn't known
+    rate: Rows or bytes processed per second in the current stage
+    result: Return value of generate_motec_log once done
+    summary: Summary of the stage timings once done
+    error: Error message if the job failed
+    """
+    FINISHED = ["done", "failed", "cancelled"]
+
+    def __init__(self, id, kwargs):
+        self.id = id
+        self.kwargs = kwargs
+        self.state = "queued"
+        self.stage = ""
+        self.fraction = None
+        self.rate = 0.0
+        self.result = None
+        self.summary = ""
+        self.error = None
+
+        self._process = None
+        self._cancel_event = None
+        self._cancelled_at = None
+
+    def finished(self):
+        return self.state in self.FINISHED
+
+    def __str__(self):
+        return "Job %d: %s, %s" % (self.id, os.path.basename(str(self.kwargs.get("log", ""))), \
+            self.state)
+
+def _run_job(job_id, kwargs, events, cancel_event):
+    """ Runs a conversion in a worker process, sending its progress back through the events queue.
+    """
+    from motec_log_generator import generate_motec_log
+    from profiling import PipelineProfiler
+    from progress import ConversionCancelled, Progress
+
+    def report(event):
+        events.put((job_id, "progress", event.to_dict()))
+
+    profiler = PipelineProfiler(track_memory=False)
+    progress = Progress(report, cancel_event.is_set, interval=0.2)
+    try:
+        result = generate_motec_log(profiler=profiler, progress=progress, **kwargs)
+        events.put((job_id, "done", {"result": result, "summary": profiler.summary()}))
+    except ConversionCancelled:
+        events.put((job_id, "cancelled", {}))
+    except Exception as e:
+        events.put((job_id, "failed", {"error": str(e)}))
+
+class JobQueue(object):
+    """ Runs conversions in worker processes, a few at a time, reporting their progress.
+
+    Each job runs in its own process, so a conversion never blocks the caller (e.g. the GUI main
+    loop) and jobs run in parallel up to max_workers, with the rest waiting in the queue. Progress,
+    stage and completion events are sent back through a process safe queue, and are applied to the
+    jobs by poll(), which the caller runs periodically on its own thread, e.g. with Tk's after().
+
+    Cancelled jobs stop at the next progress update. A job which doesn't stop within
+    CANCEL_TIMEOUT, e.g. while parsing a DBC, is terminated.
+    """
+    def __init__(self, max_workers=None, callback=None):
+        """
+        max_workers: Number of conversions to run at once, defaults to half the CPUs, since the
+            conversions themselves may use several processes
+        callback: Optional function called by poll() with each job that changed
+        """
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 1) // 2)
+        self.callback = callback
+        self.jobs = OrderedDict()
+
+        # Spawned rather than forked, since forking a process running Tk isn't safe
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._next_id = 1
+
+    def submit(self, **kwargs):
+        """ Queues a conversion, returning its ConversionJob. kwargs are passed to
+        generate_motec_log.
+        """
+        job = ConversionJob(self._next_id, kwargs)
+        self._next_id += 1
+        self.jobs[job.id] = job
+        self._start_jobs()
+        return job
+
+    def cancel(self, job_id):
+        """ Cancels a queued or running job. """
+        job = self.jobs[job_id]
+        if job.state == "queued":
+            job.state = "cancelled"
+            self._changed(job)
+        elif job.state == "running" and job._cancelled_at is None:
+            job._cancel_event.set()
+            job._cancelled_at = time.monotonic()
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def active(self):
+        """ Returns the number of queued or running jobs. """
+        return sum(1 for job in self.jobs.values() if not job.finished())
+
+    def poll(self):
+        """ Applies the events sent by the running jobs, and starts queued jobs when there's room.
+        Returns the list of jobs which changed.
+        """
+        # Processes which have exited are noted before reading the events, so any events they sent
+        # before exiting are read first
+        exited = [job for job in self.jobs.values() \
+            if job.state == "running" and not job._process.is_alive()]
+
+        changed = OrderedDict()
+        while True:
+            try:
+                job_id, kind, content = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            job = self.jobs.get(job_id)
+            if job is None or job.finished():
+                continue
+
+            if kind == "progress":
+                job.stage = content["stage"]
+                job.fraction = content["fraction"]
+                job.rate = content["rate"]
+            else:
+                job.state = kind
+                job.result = content.get("result")
+                job.summary = content.get("summary", "")
+                job.error = content.get("error")
+            changed[job.id] = job
+
+        for job in exited:
+            if job.finished():
+                continue
+
+            # The process exited without reporting back, e.g. it was terminated or crashed
+            if job._cancelled_at is not None:
+                job.state = "cancelled"
+            else:
+                job.state = "failed"
+                job.error = "Conversion exited with code %s" % job._process.exitcode
+            changed[job.id] = job
+
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if job.state == "running" and job._cancelled_at is not None and \
+                    now - job._cancelled_at > CANCEL_TIMEOUT:
+                job._process.terminate()
+
+        for job in changed.values():
+            self._changed(job)
+
+        changed.update((job.id, job) for job in self._start_jobs())
+        return list(changed.values())
+
+    def shutdown(self):
+        """ Cancels all jobs and waits for their processes to exit. """
+        self.cancel_all()
+        for job in self.jobs.values():
+            if job._process is not None:
+                job._process.join(CANCEL_TIMEOUT)
+                if job._process.is_alive():
+                    job._process.terminate()
+                    job._process.join()
+
+    def _start_jobs(self):
+        started = []
+        running = sum(1 for job in self.jobs.values() if job.state == "running")
+        for job in self.jobs.values():
+            if running >= self.max_workers:
+                break
+            if job.state != "queued":
+                continue
+
+            job._cancel_event = self._context.Event()
+            job._process = self._context.Process(target=_run_job, \
+                args=(job.id, job.kwargs, self._events, job._cancel_event))
+            job._process.start()
+            job.state = "running"
+            job.stage = "starting"
+            running += 1
+            started.append(job)
+            self._changed(job)
+
+        return started
+
+    def _changed(self, job):
+        if self.callback:
+            self.callback(job)
@@ -0,0 +1,147 @@
+import numpy as np
+
+class LapSplitter(object):
+    """ Splits a log into laps or stints at the crossings of the start/finish line.
+
+    Crossings are either taken from a beacon channel, which is triggered by a trackside beacon at
+    the start/finish line, or computed from GPS latitude and longitude channels crossing a line
+    between two points. Both are computed over the whole channel arrays at once.
+
+    Laps are the periods between consecutive crossings, with the out lap before the first crossing
+    and the in lap after the last one. Stints are groups of consecutive laps, split after any lap
+    which is much slower than the median lap, e.g. a lap through the pits.
+    """
+    MODES = ["lap", "stint"]
+
+    def __init__(self, mode="lap", beacon=None, start_finish=None, \
+            gps_channels=("Latitude", "Longitude"), min_lap_time=10.0, beacon_threshold=0.5, \
+            pit_lap_factor=1.5):
+        """
+        mode: Split the log into "lap" or "stint" segments
+        beacon: Name of the beacon channel, which rises above beacon_threshold at each crossing
+        start_finish: Start/finish line as (latitude 1, longitude 1, latitude 2, longitude 2)
+        gps_channels: Names of the latitude and longitude channels
+        min_lap_time: Crossings within this time of the previous crossing are ignored [s]
+        beacon_threshold: Value the beacon channel must rise above to count as a crossing
+        pit_lap_factor: Laps slower than this multiple of the median lap time end a stint
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown split mode '{mode}', must be one of {self.MODES}")
+        if beacon is None and start_finish is None:
+            raise ValueError("Splitting a log requires a beacon channel or a start/finish line")
+        if start_finish is not None and len(start_finish) != 4:
+            raise ValueError("The start/finish line must be given as lat1,lon1,lat2,lon2")
+
+        self.mode = mode
+        self.beacon = beacon
+        self.start_finish = tuple(float(x) for x in start_finish) if start_finish else None
+        self.gps_channels = tuple(gps_channels)
+        self.min_lap_time = min_lap_time
+        self.beacon_threshold = beacon_threshold
+        self.pit_lap_factor = pit_lap_factor
+
+    def crossings(self, data_log):
+        """ Returns an array of the times the start/finish line was crossed [s]. """
+        if self.beacon is not None:
+            if self.beacon not in data_log.channels:
+                raise KeyError(f"Beacon channel '{self.beacon}' does not exist in log")
+            channel = data_log.channels[self.beacon]
+            times = beacon_crossings(channel.times, channel.values, self.beacon_threshold)
+        else:
+            lat_name, lon_name = self.gps_channels
+            for name in self.gps_channels:
+                if name not in data_log.channels:
+                    raise KeyError(f"GPS channel '{name}' does not exist in log")
+
+            lat = data_log.channels[lat_name]
+            lon = data_log.channels[lon_name]
+            lon_values = lon.values
+            if len(lat.times) != len(lon.times) or np.any(lat.times != lon.times):
+                lon_values = np.interp(lat.times, lon.times, lon.values)
+
+            times = line_crossings(lat.times, lat.values, lon_values, self.start_finish)
+
+        return debounce(times, self.min_lap_time)
+
+    def segments(self, data_log):
+        """ Returns a list of (number, start, end) for each lap or stint in a log, with the times
+        relative to the start of the log [s]. The out lap is lap 0, and stints start from 1.
+        """
+        log_start = data_log.start()
+        log_end = data_log.end()
+        crossings = self.crossings(data_log)
+        crossings = crossings[(crossings > log_start) & (crossings < log_end)]
+        bounds = np.concatenate(([log_start], crossings, [log_end])) - log_start
+
+        laps = [(i, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+        if self.mode == "lap":
+            return laps
+
+        # The out lap and in lap are partial, so only full laps decide where the stints end
+        lap_times = np.diff(bounds)
+        full_laps = lap_times[1:-1]
+        if len(full_laps) == 0:
+            return [(1, bounds[0], bounds[-1])]
+
+        slow = lap_times > self.pit_lap_factor * np.median(full_laps)
+        slow[0] = slow[-1] = False
+
+        stints = []
+        stint_start = bounds[0]
+        for i in np.flatnonzero(slow):
+            stints.append((len(stints) + 1, stint_start, bounds[i + 1]))
+            stint_start = bounds[i + 1]
+        stints.append((len(stints) + 1, stint_start, bounds[-1]))
+
+        return stints
+
+def beacon_crossings(times, values, threshold=0.5):
+    """ Returns the times at which a beacon channel rises above a threshold [s]. """
+    above = values > threshold
+    return times[np.flatnonzero(above[1:] & ~above[:-1]) + 1]
+
+def line_crossings(times, latitude, longitude, line):
+    """ Returns the times at which a GPS track crosses a line [s].
+
+    The position is linearly interpolated between samples to find the time of each crossing. Only
+    crossings in the most common direction are returned, so the car turning around near the line
+    isn't counted as a lap.
+
+    line: (latitude 1, longitude 1, latitude 2, longitude 2) of the ends of the line
+    """
+    lat1, lon1, lat2, lon2 = line
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    # Which side of the line each sample is on, crossings are where this changes sign. Intersection
+    # tests aren't affected by the scaling of the axes, so the coordinates can be used directly.
+    side = dlat * (longitude - lon1) - dlon * (latitude - lat1)
+    forward = (side[:-1] < 0) & (side[1:] >= 0)
+    backward = (side[:-1] > 0) & (side[1:] <= 0)
+    indices = np.flatnonzero(forward | backward)
+
+    # Only keep crossings between the ends of the line
+    fraction = side[indices] / (side[indices] - side[indices + 1])
+    lat = latitude[indices] + fraction * (latitude[indices + 1] - latitude[indices])
+    lon = longitude[indices] + fraction * (longitude[indices + 1] - longitude[indices])
+    along = ((lat - lat1) * dlat + (lon - lon1) * dlon) / (dlat * dlat + dlon * dlon)
+    on_line = (along >= 0) & (along <= 1)
+
+    is_forward = forward[indices]
+    if np.count_nonzero(on_line & is_forward) >= np.count_nonzero(on_line & ~is_forward):
+        keep = on_line & is_forward
+    else:
+        keep = on_line & ~is_forward
+
+    indices = indices[keep]
+    fraction = fraction[keep]
+    return times[indices] + fraction * (times[indices + 1] - times[indices])
+
+def debounce(times, min_interval):
+    """ Removes the times which are within min_interval of the previous time that was kept. """
+    kept = []
+    for t in times:
+        if not kept or t - kept[-1] >= min_interval:
+            kept.append(t)
+
+    return np.array(kept, dtype=np.float64)
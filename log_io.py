@@ -0,0 +1,315 @@
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+# Magic bytes at the start of each supported compressed file format
+COMPRESSION_MAGIC = {
+    "gzip": b"\x1f\x8b",
+    "xz": b"\xfd7zXZ\x00",
+    "bz2": b"BZh",
+    "zstd": b"\x28\xb5\x2f\xfd",
+}
+
+COMPRESSION_SUFFIXES = [".gz", ".xz", ".bz2", ".zst"]
+
+# Size of the reads from the decompressor
+READ_SIZE = 1 << 20
+
+# Number of decompressed reads buffered ahead of the parser
+PREFETCH_CHUNKS = 8
+
+def is_stream(obj):
+    """ Returns True if obj is a file-like object rather than a path. """
+    return hasattr(obj, "read") or hasattr(obj, "write")
+
+def detect_compression(path):
+    """ Returns the compression format of a file from its magic bytes, or None if it is not
+    compressed.
+    """
+    with open(path, "rb") as file:
+        head = file.read(8)
+
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+def strip_compression_suffix(path):
+    """ Removes a compression extension from a path, e.g. 'log.csv.gz' becomes 'log.csv'. """
+    root, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        return root
+
+    return path
+
+def open_log(path, mode="r", prefetch=False):
+    """ Opens a log file for reading, transparently decompressing it if it is compressed.
+
+    Compressed files are decompressed as a stream, nothing is written to disc. The returned stream
+    is not seekable for compressed files, so readers must consume it sequentially.
+
+    path: Path to the log file, or a readable binary file-like object such as an upload or a pipe.
+        File-like objects are read from their current position, and aren't closed along with the
+        returned stream
+    mode: "r" for text, or "rb" for binary
+    prefetch: Read uncompressed files ahead on a background thread too, like compressed files are,
+        so waiting on slow storage overlaps with parsing. The stream is then not seekable either
+    """
+    if mode not in ["r", "rb"]:
+        raise ValueError(f"Unsupported mode '{mode}', logs can only be opened for reading")
+
+    if is_stream(path):
+        if isinstance(path, io.TextIOBase):
+            if not hasattr(path, "buffer"):
+                raise ValueError("Logs must be given as binary file objects")
+            path = path.buffer
+
+        # Buffered, so the magic bytes can be checked without consuming them
+        source = io.BufferedReader(_BorrowedStream(path), READ_SIZE)
+        head = source.peek(8)[:8]
+        compression = None
+        for name, magic in COMPRESSION_MAGIC.items():
+            if head.startswith(magic):
+                compression = name
+                break
+
+        if compression is None and not prefetch:
+            return source if mode == "rb" else io.TextIOWrapper(source)
+    else:
+        source = path
+        compression = detect_compression(path)
+        if compression is None and not prefetch:
+            return open(path, mode)
+
+    stream = io.BufferedReader(_DecompressedStream(source, compression), READ_SIZE)
+    if mode == "rb":
+        return stream
+
+    return io.TextIOWrapper(stream)
+
+def read_position(stream):
+    """ Returns a function giving the number of bytes of the file read so far by a stream returned
+    by open_log, e.g. to report the progress of reading it, or None if this can't be told.
+    """
+    raw = getattr(stream, "buffer", stream)
+    raw = getattr(raw, "raw", raw)
+    if isinstance(raw, _DecompressedStream):
+        position = raw.position
+    else:
+        position = raw.tell
+
+    try:
+        if position() is None:
+            return None
+    except (OSError, ValueError):
+        return None
+
+    return position
+
+def iter_prefetched(iterable, size=PREFETCH_CHUNKS):
+    """ Iterates over an iterable on a background thread, buffering up to size items ahead of the
+    caller, e.g. to parse the next chunk of a log while the current one is decoded.
+
+    Any error raised by the iterable is raised by the caller. Closing the returned generator stops
+    the background thread.
+    """
+    items = queue.Queue(maxsize=size)
+    stop_event = threading.Event()
+    end = object()
+
+    def put(item):
+        # Time out periodically so the thread can stop if the caller stops iterating
+        while not stop_event.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop_event.is_set():
+                    return
+                put((item, None))
+            put((end, None))
+        except Exception as e:
+            put((end, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                break
+            yield item
+    finally:
+        stop_event.set()
+        thread.join()
+
+class _BorrowedStream(io.RawIOBase):
+    """ Reads from a file-like object owned by the caller, without closing it. """
+    def __init__(self, file):
+        self._file = file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._file.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        return n
+
+class _DecompressedStream(io.RawIOBase):
+    """ Read only, non seekable stream of the decompressed contents of a file.
+
+    The decompression runs on a background thread (the decompressors release the GIL), so it
+    overlaps with the parsing of the data on the calling thread.
+
+    path: Path of the file, or a readable binary file-like object, which is closed along with this
+        stream
+    compression: Compression format of the file, or None to only read the file ahead
+    """
+    def __init__(self, path, compression):
+        self._process = None
+        self._file = path if is_stream(path) else None
+
+        # The compressed file is opened here rather than by the decompressor, so how far through it
+        # the decompression is can be told, see position()
+        if compression in [None, "gzip", "xz", "bz2"] and self._file is None:
+            self._file = open(path, "rb")
+
+        if compression is None:
+            self._reader = self._file
+        elif compression == "gzip":
+            import gzip
+            self._reader = gzip.open(self._file, "rb")
+        elif compression == "xz":
+            import lzma
+            self._reader = lzma.open(self._file, "rb")
+        elif compression == "bz2":
+            import bz2
+            self._reader = bz2.open(self._file, "rb")
+        elif compression == "zstd":
+            self._reader = self._open_zstd(path)
+        else:
+            raise ValueError(f"Unsupported compression '{compression}'")
+
+        self._chunk = b""
+        self._chunk_pos = 0
+        self._eof = False
+        self._error = None
+        self._queue = queue.Queue(maxsize=PREFETCH_CHUNKS)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _open_zstd(self, path):
+        """ zstd isn't in the standard library (before Python 3.14), so this uses whichever
+        implementation is available, falling back to piping the output of the zstd command line
+        tool.
+        """
+        try:
+            from compression import zstd
+            return zstd.open(path, "rb")
+        except ImportError:
+            pass
+
+        try:
+            import zstandard
+            if self._file is None:
+                self._file = open(path, "rb")
+            return zstandard.ZstdDecompressor().stream_reader(self._file, read_size=READ_SIZE)
+        except ImportError:
+            pass
+
+        zstd_cmd = shutil.which("zstd")
+        if zstd_cmd and self._file is None:
+            self._process = subprocess.Popen([zstd_cmd, "-d", "-c", "-q", path], \
+                stdout=subprocess.PIPE, bufsize=READ_SIZE)
+            return self._process.stdout
+
+        raise RuntimeError("Reading zstd compressed logs requires Python 3.14, the 'zstandard' " \
+            "package, or the zstd command line tool")
+
+    def _decompress(self):
+        """ Background thread which decompresses chunks of the file into the queue. An empty chunk
+        marks the end of the file, and any error is passed along to be raised by the reader.
+        """
+        try:
+            while not self._stop_event.is_set():
+                data = self._reader.read(READ_SIZE)
+                if not data and self._process and self._process.wait() != 0:
+                    raise RuntimeError(f"zstd failed with exit code {self._process.returncode}")
+
+                self._put(data)
+                if not data:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # Time out periodically so the thread can stop if the stream is closed while it's blocked
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def position(self):
+        """ Returns the number of bytes of the (compressed) file read so far, or None if unknown. """
+        try:
+            return self._file.tell() if self._file is not None else None
+        except (OSError, ValueError):
+            return None
+
+    def readinto(self, buffer):
+        if self._chunk_pos >= len(self._chunk):
+            # The background thread has stopped after an error, so later reads raise it again
+            # rather than waiting for more data
+            if self._error is not None:
+                raise self._error
+            if self._eof:
+                return 0
+
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._error = item
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+
+            self._chunk = item
+            self._chunk_pos = 0
+
+        n = min(len(buffer), len(self._chunk) - self._chunk_pos)
+        buffer[:n] = self._chunk[self._chunk_pos:self._chunk_pos + n]
+        self._chunk_pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop_event.set()
+            self._thread.join()
+            self._reader.close()
+            if self._file:
+                self._file.close()
+            if self._process:
+                # Stop the decompression if the log wasn't read to the end
+                if self._process.poll() is None:
+                    self._process.terminate()
+                self._process.wait()
+        super().close()
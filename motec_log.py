@@ -1,8 +1,14 @@
+import concurrent.futures
 import datetime
+import io
+import mmap
 import numpy as np
+import os
 import struct
+from typing import Dict
 from data_log import DataLog, Message, Channel
-from ldparser import ldVehicle, ldVenue, ldEvent, ldHead, ldChan, ldData
+from log_io import is_stream
+from ldparser import ldVehicle, ldVenue, ldEvent, ldHead, ldChan
 
 class MotecLog(object):
     """ Handles generating a MoTeC .ld file from log data.
@@ -22,6 +28,9 @@ class MotecLog(object):
 
     CHANNEL_HEADER_SIZE = struct.calcsize(ldChan.fmt)
 
+    # Number of samples converted and written at a time
+    WRITE_BLOCK = 1 << 20
+
     def __init__(self):
         self.driver = ""
         self.vehicle_id = ""
@@ -39,6 +48,11 @@ class MotecLog(object):
         self.ld_header = None
         self.ld_channels = []
 
+    @staticmethod
+    def read(filename):
+        """ Opens an existing .ld file for reading, see LdFile. """
+        return LdFile(filename)
+
     def initialize(self):
         """ Initializes all the meta data for the motec log.
 
@@ -53,10 +67,18 @@ class MotecLog(object):
         self.ld_header = ldHead(meta_ptr=self.HEADER_PTR, data_ptr=self.HEADER_PTR, event_ptr=self.EVENT_PTR, event=ld_event, \
             driver=self.driver, vehicleid=self.vehicle_id, venue=self.venue_name, datetime=self.datetime, short_comment=self.short_comment)
 
-    def add_channel(self, log_channel):
+    def add_channel(self, log_channel, data_len=None, frequency=None, data=None):
         """ Adds a single channel of data to the motec log.
 
+        The data of the channel can also be produced while the file is being written, e.g. by
+        DataLog.iter_resampled, by giving its length and frequency up front, and a function which
+        returns the data when the channel is written. The channels are written in the order
+        they were added.
+
         log_channel: data_log.Channel
+        data_len: Number of samples of the channel, defaults to the length of log_channel
+        frequency: Sample rate of the channel, defaults to the average frequency of log_channel
+        data: Optional function returning the data of the channel, called when it's written
         """
         # Advance the header data pointer
         self.ld_header.data_ptr += self.CHANNEL_HEADER_SIZE
@@ -69,18 +91,25 @@ class MotecLog(object):
         if self.ld_channels:
             meta_ptr = self.ld_channels[-1].next_meta_ptr
             prev_meta_ptr = self.ld_channels[-1].meta_ptr
-            data_ptr = self.ld_channels[-1].data_ptr + self.ld_channels[-1]._data.nbytes
         else:
             # First channel needs the previous pointer zero'd out
             meta_ptr = self.HEADER_PTR
             prev_meta_ptr = 0
-            data_ptr = self.ld_header.data_ptr
         next_meta_ptr = meta_ptr + self.CHANNEL_HEADER_SIZE
 
+        # Data follows the data of the last channel which has its own, skipping aliases
+        prev_channel = next((ld_channel for ld_channel in reversed(self.ld_channels) \
+            if ld_channel._alias_of is None), None)
+        if prev_channel is not None:
+            data_ptr = prev_channel.data_ptr + \
+                prev_channel.data_len * np.dtype(prev_channel.dtype).itemsize
+        else:
+            data_ptr = self.ld_header.data_ptr
+
         # Channel specs
-        data_len = len(log_channel.messages)
+        data_len = len(log_channel) if data_len is None else data_len
         data_type = np.float32 if log_channel.data_type is float else np.int32
-        freq = int(log_channel.avg_frequency())
+        freq = int(log_channel.avg_frequency() if frequency is None else frequency)
         shift = 0
         multiplier = 1
         scale = 1
@@ -94,14 +123,37 @@ class MotecLog(object):
             data_type, freq, shift, multiplier, scale, decimals, log_channel.name, "", \
             log_channel.units)
 
-        # Add in the channel data
-        ld_channel._data = np.array([], data_type)
-        for msg in log_channel.messages:
-            ld_channel._data = np.append(ld_channel._data, data_type(msg.value))
+        # Add in the channel data, this is converted to the channel data type as it's written, so
+        # channels spilled to disc are streamed into the file rather than loaded into memory
+        ld_channel._data = log_channel.values if data is None else data
+        ld_channel._alias_of = None
 
         # Add the ld channel and advance the file pointers
         self.ld_channels.append(ld_channel)
 
+    def add_alias(self, log_channel, name):
+        """ Adds a channel which shares the data of an earlier channel of the motec log, e.g. the
+        same signal under a different name. Only the channel header is written, pointing at the
+        data of the other channel, so the alias takes no space in the file.
+
+        log_channel: data_log.Channel, the name, units and decimals of which are used
+        name: Name of the earlier channel, which must have the same data type
+        """
+        original = next((ld_channel for ld_channel in self.ld_channels \
+            if ld_channel.name == name and ld_channel._alias_of is None), None)
+        if original is None:
+            raise KeyError(f"Channel '{name}' must be added before its alias {log_channel.name}")
+
+        self.add_channel(log_channel, original.data_len, original.freq, original._data)
+
+        # Point the header at the data of the original, it's moved along with the other channels
+        # as further headers are added
+        ld_channel = self.ld_channels[-1]
+        ld_channel.data_ptr = original.data_ptr
+        ld_channel.dtype = original.dtype
+        ld_channel._data = None
+        ld_channel._alias_of = original
+
     def add_all_channels(self, data_log):
         """ Adds all channels from a DataLog to the motec log.
 
@@ -110,17 +162,354 @@ class MotecLog(object):
         for channel_name, channel in data_log.channels.items():
             self.add_channel(channel)
 
-    def write(self, filename):
-        """ Writes the motec log data to disc. """
-        # Check for the presence of any channels, since the ldData write() method doesn't
-        # gracefully handle zero channels
-        if self.ld_channels:
-            ld_data = ldData(self.ld_header, self.ld_channels)
+    def write(self, target, progress=None):
+        """ Writes the motec log data to a file.
+
+        target: Path of the file, or a writable binary file-like object, e.g. io.BytesIO, a pipe or
+            a socket. The file is written sequentially, so it doesn't need to be seekable
+        progress: Optional progress.Progress, updated with the number of bytes of channel data
+            written
+
+        Returns the size of the file [bytes]
+        """
+        if not is_stream(target):
+            with open(target, "wb") as f:
+                return self.write(f, progress)
+
+        head = self._pack_head()
+        target.write(head)
+        position = len(head)
+        data_size = self._check_layout(position)
+        data_written = 0
+        for ld_channel in self._data_channels():
+            target.write(bytes(ld_channel.data_ptr - position))
+            written = self.write_channel_data(target, ld_channel, progress, data_written, \
+                data_size)
+            position = ld_channel.data_ptr + written
+            data_written += written
+
+        return position
+
+    def write_parallel(self, target, workers, progress=None):
+        """ Writes the motec log data to a file, converting and writing the data of several
+        channels at once.
+
+        The file offset of each channel's data is known from the headers, so each channel is
+        written straight to its place in the file with os.pwrite, on a pool of threads. Channels
+        added with a data function (see add_channel), e.g. resampling the channel, are produced
+        on the threads too. NumPy and the writes release the GIL while they work on a block, so
+        this scales with the number of cores for logs with many channels.
+
+        Falls back to write() for streams, and where os.pwrite isn't available (Windows).
+
+        target: Path of the file, or a writable binary file-like object
+        workers: Number of threads converting and writing channels
+        progress: Optional progress.Progress, updated with the number of bytes of channel data
+            written. It's updated from the calling thread, as each channel is finished
 
+        Returns the size of the file [bytes]
+        """
+        if is_stream(target) or workers <= 1 or not hasattr(os, "pwrite"):
+            return self.write(target, progress)
+
+        head = self._pack_head()
+        data_size = self._check_layout(len(head))
+        size = len(head)
+        channels = self._data_channels()
+        if channels:
+            last = channels[-1]
+            size = max(size, last.data_ptr + last.data_len * np.dtype(last.dtype).itemsize)
+
+        with open(target, "wb") as f:
+            f.write(head)
+            # Extending the file up front leaves zeros in any gaps between the channels, and lets
+            # the channels be written in any order
+            f.flush()
+            os.ftruncate(f.fileno(), size)
+
+            def write_channel(ld_channel):
+                return self.write_channel_data(_PositionalWriter(f.fileno(), ld_channel.data_ptr), \
+                    ld_channel)
+
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [executor.submit(write_channel, ld_channel) for ld_channel in channels]
+                data_written = 0
+                for future in concurrent.futures.as_completed(futures):
+                    data_written += future.result()
+                    if progress:
+                        progress.update(data_written, data_size)
+            finally:
+                # Channels which haven't started yet are dropped on errors or cancellation
+                executor.shutdown(cancel_futures=True)
+
+        return size
+
+    def _pack_head(self):
+        """ Returns the file and channel headers, which come before the channel data. """
+        # The headers are small and ldparser seeks around while writing them, so they're put
+        # together in memory first
+        head = io.BytesIO()
+        self.ld_header.write(head, len(self.ld_channels))
+        if self.ld_channels:
             # Need to zero out the final channel pointer
-            ld_data.channs[-1].next_meta_ptr = 0
+            self.ld_channels[-1].next_meta_ptr = 0
+
+            head.seek(self.ld_channels[0].meta_ptr)
+            for i, ld_channel in enumerate(self.ld_channels):
+                ld_channel.write(head, i)
+
+        return head.getvalue()
+
+    def _check_layout(self, head_size):
+        """ Checks the channel data doesn't overlap the headers or each other, returning the total
+        size of the channel data [bytes].
+        """
+        position = head_size
+        data_size = 0
+        for ld_channel in self._data_channels():
+            if ld_channel.data_ptr < position:
+                raise ValueError(f"Data of channel {ld_channel.name} overlaps the previous channel")
+            channel_size = ld_channel.data_len * np.dtype(ld_channel.dtype).itemsize
+            position = ld_channel.data_ptr + channel_size
+            data_size += channel_size
+
+        return data_size
+
+    def _data_channels(self):
+        """ Returns the channels which have their own data in the file, i.e. aren't aliases. """
+        return [ld_channel for ld_channel in self.ld_channels if ld_channel._alias_of is None]
+
+    def write_channel_data(self, f, ld_channel, progress=None, progress_offset=0, \
+            progress_total=None):
+        """ Writes the data of a channel to a file, converting it to the raw channel data type in
+        blocks. Returns the number of bytes written.
+
+        progress: Optional progress.Progress, updated after each block with progress_offset plus
+            the number of bytes written, out of progress_total
+        """
+        data = ld_channel._data
+        if callable(data):
+            data = data()
+            if len(data) != ld_channel.data_len:
+                raise ValueError(f"Channel {ld_channel.name} has {len(data)} samples, not the " \
+                    f"{ld_channel.data_len} given when it was added")
+
+        written = 0
+        for begin in range(0, ld_channel.data_len, self.WRITE_BLOCK):
+            block = np.asarray(data[begin:begin + self.WRITE_BLOCK])
+            raw = (block / ld_channel.mul - ld_channel.shift) * ld_channel.scale / \
+                pow(10., -ld_channel.dec)
+            raw = raw.astype(ld_channel.dtype).tobytes()
+            f.write(raw)
+            written += len(raw)
+            if progress:
+                progress.update(progress_offset + written, progress_total)
+
+        return written
+
+class _PositionalWriter(object):
+    """ File-like object writing to a fixed position of a file descriptor with os.pwrite, so
+    several threads can write different parts of the same file at once.
+    """
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
 
-            ld_data.write(filename)
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        return len(data)
+
+class LdFile(object):
+    """ Reads a MoTeC .ld file.
+
+    The file is memory mapped rather than read, so only the parts of the file which are accessed
+    are loaded, and the data of each channel is a NumPy view of the file. This allows quickly
+    inspecting or extracting a few channels of very large files.
+
+    The data arrays are views of the file, so they must not be used after the file is closed.
+    """
+    def __init__(self, filename):
+        """
+        filename: Path of the file, a readable binary file-like object, or the contents of a file
+            as bytes. File-like objects are read into memory, since they can't be memory mapped
+        """
+        self._file = None
+        if isinstance(filename, (bytes, bytearray, memoryview)):
+            self.filename = "<memory>"
+            self._buffer = filename
+        elif is_stream(filename):
+            self.filename = getattr(filename, "name", "<stream>")
+            self._buffer = filename.read()
         else:
-            with open(filename, "wb") as f:
-                self.ld_header.write(f, 0)
+            self.filename = filename
+            self._file = open(filename, "rb")
+            try:
+                self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be memory mapped
+                self._file.close()
+                raise ValueError(f"{filename} is not a valid .ld file")
+
+        self.channels: Dict[str, LdChannel] = {}
+        self._read_header()
+        self._read_channels()
+
+    def _unpack(self, fmt, offset):
+        if offset + struct.calcsize(fmt) > len(self._buffer):
+            raise ValueError(f"{self.filename} is truncated or not a valid .ld file")
+
+        return struct.unpack_from(fmt, self._buffer, offset)
+
+    def _read_header(self):
+        (_, self.meta_ptr, self.data_ptr, self.event_ptr, _, _, _, _, _, _, _, self.num_channels, \
+            date, time, driver, vehicle_id, venue, _, short_comment) = self._unpack(ldHead.fmt, 0)
+
+        self.driver = decode_string(driver)
+        self.vehicle_id = decode_string(vehicle_id)
+        self.venue_name = decode_string(venue)
+        self.short_comment = decode_string(short_comment)
+
+        self.datetime = None
+        date_time = "%s %s" % (decode_string(date), decode_string(time))
+        for fmt in ["%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M"]:
+            try:
+                self.datetime = datetime.datetime.strptime(date_time, fmt)
+                break
+            except ValueError:
+                pass
+
+        self.event_name = ""
+        self.event_session = ""
+        self.long_comment = ""
+        if self.event_ptr:
+            name, session, comment, _ = self._unpack(ldEvent.fmt, self.event_ptr)
+            self.event_name = decode_string(name)
+            self.event_session = decode_string(session)
+            self.long_comment = decode_string(comment)
+
+    def _read_channels(self):
+        # Channel headers form a linked list, starting from the pointer in the file header
+        meta_ptr = self.meta_ptr
+        visited = set()
+        while meta_ptr:
+            if meta_ptr in visited:
+                raise ValueError(f"{self.filename} has a loop in its channel headers")
+            visited.add(meta_ptr)
+
+            (prev_meta_ptr, next_meta_ptr, data_ptr, data_len, _, dtype_a, dtype_len, freq, shift, \
+                mul, scale, dec, name, short_name, unit) = self._unpack(ldChan.fmt, meta_ptr)
+
+            if dtype_a == 0x07:
+                dtype = {2: np.float16, 4: np.float32}.get(dtype_len)
+            else:
+                dtype = {2: np.int16, 4: np.int32}.get(dtype_len)
+            if dtype is None:
+                raise ValueError(f"Unsupported data type {dtype_a:#x}/{dtype_len} in " \
+                    f"{self.filename}")
+
+            if data_ptr + data_len * dtype_len > len(self._buffer):
+                raise ValueError(f"{self.filename} is truncated or not a valid .ld file")
+
+            channel = LdChannel(decode_string(name), decode_string(short_name), \
+                decode_string(unit), freq, shift, mul, scale, dec, \
+                np.frombuffer(self._buffer, dtype=np.dtype(dtype).newbyteorder("<"), \
+                count=data_len, offset=data_ptr))
+            channel.meta_ptr = meta_ptr
+            channel.data_ptr = data_ptr
+            self.channels[channel.name] = channel
+
+            meta_ptr = next_meta_ptr
+
+    def to_data_log(self, start_time=0.0):
+        """ Returns a DataLog containing the channels of the file. The channel data is converted
+        into the file's units, which for unscaled channels is a view of the file.
+
+        start_time: Timestamp of the first sample of each channel [s]
+        """
+        data_log = DataLog(self.filename)
+        for name, ld_channel in self.channels.items():
+            channel = Channel(name, ld_channel.units, \
+                float if ld_channel.raw.dtype.kind == "f" else int, ld_channel.dec)
+            channel.data.assign(ld_channel.times(start_time), \
+                ld_channel.data.astype(np.float64, copy=False))
+            data_log.channels[name] = channel
+
+        return data_log
+
+    def close(self):
+        self.channels = {}
+        if self._file is None:
+            return
+
+        try:
+            self._buffer.close()
+        except BufferError:
+            # Views of the data are still in use, the mapping is closed once they're released
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __str__(self):
+        output = "LD file: %s, Driver: %s, Vehicle: %s, Venue: %s, Channels: %d" % \
+            (self.filename, self.driver, self.vehicle_id, self.venue_name, len(self.channels))
+        for name, channel in self.channels.items():
+            output += "\n\t%s" % channel
+        return output
+
+class LdChannel(object):
+    """ A single channel of a .ld file read by LdFile. """
+    def __init__(self, name, short_name, units, freq, shift, mul, scale, dec, raw):
+        self.name = name
+        self.short_name = short_name
+        self.units = units
+        self.freq = freq
+        self.shift = shift
+        self.mul = mul
+        self.scale = scale
+        self.dec = dec
+
+        # The raw values stored in the file, as a view of the file
+        self.raw = raw
+        self.meta_ptr = 0
+        self.data_ptr = 0
+
+    def __len__(self):
+        return len(self.raw)
+
+    def is_scaled(self):
+        return self.shift != 0 or self.mul != 1 or self.scale != 1 or self.dec != 0
+
+    @property
+    def data(self):
+        """ The channel values in the channel units. This is computed each time it's accessed,
+        except for unscaled channels where it's the raw view of the file.
+        """
+        if not self.is_scaled():
+            return self.raw
+
+        return (self.raw / self.scale * pow(10., -self.dec) + self.shift) * self.mul
+
+    def times(self, start_time=0.0):
+        """ Returns the timestamps of the samples, based on the channel frequency [s]. """
+        if self.freq <= 0:
+            return np.full(len(self.raw), start_time)
+
+        return start_time + np.arange(len(self.raw)) / self.freq
+
+    def __str__(self):
+        return "Channel: %s, Units: %s, Samples: %d, Frequency: %d Hz" % \
+            (self.name, self.units, len(self.raw), self.freq)
+
+def decode_string(data):
+    """ Decodes a null terminated string field of a .ld file. """
+    return data.split(b"\0", 1)[0].decode("ascii", "ignore").strip()
@@ -1,19 +1,36 @@
 #!/usr/bin/env python3
 
 import argparse
-import cantools
+import concurrent.futures
+import fnmatch
+import io
+import json
 import os
+import tracemalloc
 
-from data_log import DataLog
+from compaction import CONSTANT_POLICIES, DUPLICATE_POLICIES, LOW_RATE, plan_compaction, \
+    validate_policies
+from data_log import RESAMPLE_MODES, DataLog, channel_resample_mode, resample_count, \
+    resample_times
+from dbc_cache import get_dbc_cache
+from laps import LapSplitter
+from log_io import is_stream, open_log, read_position, strip_compression_suffix
 from motec_log import MotecLog
+from preview import BASE_BINS, PreviewCache
+from profiling import PipelineProfiler, NullProfiler
+from progress import ProgressProfiler
+
+LOG_TYPES = ["CAN", "CSV", "ACCESSPORT", "MCAP", "LD", "PARQUET"]
 
 DESCRIPTION = """Generates MoTeC .ld files from external log files generated by: CAN bus dumps, CSV
  files, or COBB Accessport CSV files"""
 
-EPILOG = """The CAN bus log must be the same format as what is generated by 'candump' with the '-l'
-option from the linux package can-utils. A MoTeC channel will be created for every signal in the
-DBC file that has messages in the CAN log. The signal name and units will be directly copied from
-the DBC file.
+EPILOG = """The CAN bus log can be recorded by 'candump' from the linux package can-utils with
+either the '-l' or '-ta' options, or be a KSU CSV CAN log, the format is detected automatically. A
+MoTeC channel will be created for every signal in the DBC file that has messages in the CAN log. The
+signal name and units will be directly copied from the DBC file.
+
+All log types can be gzip, xz, bz2 or zstd compressed, they will be decompressed on the fly.
 
 CSV files must have time as their first column. A MoTeC channel will be generated for all remaining
 columns. All channels will not have any units assigned.
@@ -21,6 +38,12 @@ columns. All channels will not have any units assigned.
 COBB Accessport CSV logs are simply generated by starting a logging session on the accessport. A
 MoTeC channel will be created for every channel logged, the name and units will be directly copied
 over.
+
+LD inputs are existing MoTeC .ld files, e.g. to resample them or join them with other segments.
+PARQUET inputs are Parquet or Arrow IPC (Feather) files, with time as their first column [s] and a
+channel for every other numeric column.
+Several logs can be given, which are joined in order into one continuous log, e.g. the files of a
+logger which rotates its log every few minutes. Any .ld files among them are read as LD logs.
 """
 
 def generate_motec_log(
@@ -38,46 +61,608 @@ def generate_motec_log(
     event_name="",
     event_session="",
     long_comment="",
-    short_comment=""
+    short_comment="",
+    profiler=None,
+    metrics_json=None,
+    sources=None,
+    collisions="prefix",
+    j1939=None,
+    source_address_suffix=False,
+    memory_budget=None,
+    scratch_dir=None,
+    outputs=None,
+    splitter=None,
+    segments=None,
+    return_bytes=False,
+    progress=None,
+    pipeline=False,
+    parquet=None,
+    write_threads=1,
+    constant_channels="keep",
+    duplicate_channels="keep",
+    resample_mode="hold"
 ):
-    log = os.path.expanduser(log)
-    if dbc:
-        dbc = os.path.expanduser(dbc)
-    if output:
-        output = os.path.expanduser(output)
+    """ Converts a log file to a MoTeC .ld file, returning the path of the generated file.
 
-    # Make sure our input files are valid
-    if not os.path.isfile(log):
-        raise FileNotFoundError(f"log file {log} does not exist")
-    if log_type == "CAN":
-        if not dbc:
-            raise ValueError("DBC file must be provided for CAN log type")
-        if not os.path.isfile(dbc):
-            raise FileNotFoundError(f"DBC file {dbc} does not exist")
-
-    data_log = DataLog()
-    if log_type == "MCAP":
+    The log can also be a readable binary file-like object, e.g. an upload, and the output a
+    writable binary file-like object, e.g. a socket, so nothing has to go through temporary files.
+
+    When a list of outputs is given, the log is only read and decoded once, and each output is
+    generated from it in parallel. A list of the paths of the generated files is returned instead,
+    and the output, frequency and metadata arguments become the defaults for the outputs.
+
+    profiler: Optional profiling.PipelineProfiler, which records the timings and resource usage
+        of each conversion stage
+    metrics_json: Optional path to write the stage metrics to, creates a profiler if none is given
+    sources: Optional list of additional LogSource to merge with the main log, e.g. other CAN buses
+    collisions: How to handle channels with the same name in several logs, "prefix" to prefix them
+        with the name of their source or "merge" to combine them into one channel
+    j1939: Match extended CAN messages by their J1939 PGN, ignoring the priority and addresses in
+        the frame id. None only does so for messages the DBC marks as J1939
+    source_address_suffix: Append the source address of J1939 frames to the channel names
+    memory_budget: Maximum number of bytes of channel data to keep in memory, channels beyond this
+        are spilled to memory mapped files. None for no limit
+    scratch_dir: Directory for the files of spilled channels, defaults to the system temp directory
+    outputs: Optional list of OutputSpec, each of which generates a separate .ld file
+    splitter: Optional laps.LapSplitter, to write a separate .ld file for each lap or stint of
+        each output. A list of the paths of the generated files is returned
+    segments: Optional list of paths of further segments of the main log, which are joined onto
+        the end of it, see DataLog.concatenate
+    return_bytes: Return the contents of the generated .ld files as bytes rather than writing them
+        to the outputs
+    progress: Optional progress.Progress, which is told about each stage of the conversion and how
+        far through it is, and can cancel the conversion by raising progress.ConversionCancelled
+    pipeline: Overlap the stages of the conversion rather than running them one after another. The
+        log is read ahead and CAN logs are parsed ahead on background threads while they're
+        decoded, and the channels are resampled on a pool of threads while the previous channels
+        are written. Speeds up conversions from and to slow storage, e.g. network drives
+    parquet: Optional path to also write the resampled channels to as a Parquet file, e.g. for
+        analysis with pandas, see DataLog.to_parquet. Ignored when a list of outputs is given,
+        each of which can set its own
+    write_threads: Number of threads resampling, converting and writing the channels of each
+        output at once, each straight to its place in the .ld file. Speeds up logs with many
+        channels on machines with several cores. Outputs written to file objects are written one
+        channel at a time
+    constant_channels: How to write channels which never change, one of "keep", "drop" or
+        "low_rate" to write them at 1 Hz, see compaction.plan_compaction
+    duplicate_channels: How to write channels which are identical to an earlier channel, one of
+        "keep", "drop" or "alias" to point them at the data of the earlier channel
+    resample_mode: How to resample the channels, one of "hold", "linear", "average" or "fir" for
+        anti-aliased downsampling, see data_log.Channel.resample. Either a mode for every channel,
+        or a dict of channel name patterns to modes, see parse_resample_modes
+    """
+    # Metadata fields which get copied directly onto the MotecLog
+    metadata = {
+        "driver": driver,
+        "vehicle_id": vehicle_id,
+        "vehicle_weight": vehicle_weight,
+        "vehicle_type": vehicle_type,
+        "vehicle_comment": vehicle_comment,
+        "venue_name": venue_name,
+        "event_name": event_name,
+        "event_session": event_session,
+        "long_comment": long_comment,
+        "short_comment": short_comment,
+    }
+
+    if profiler is None:
+        profiler = PipelineProfiler(track_memory=False) if metrics_json else NullProfiler()
+
+    # Every stage of the conversion is reported to the progress as it starts
+    stage_profiler = ProgressProfiler(profiler, progress) if progress else profiler
+
+    profiler.start()
+    try:
+        ld_filename = _generate_motec_log(log, log_type, output, frequency, dbc, metadata, \
+            stage_profiler, sources=sources, collisions=collisions, j1939=j1939, \
+            source_address_suffix=source_address_suffix, memory_budget=memory_budget, \
+            scratch_dir=scratch_dir, outputs=outputs, splitter=splitter, segments=segments, \
+            return_bytes=return_bytes, progress=progress, pipeline=pipeline, parquet=parquet, \
+            write_threads=write_threads, constant_channels=constant_channels, \
+            duplicate_channels=duplicate_channels, resample_mode=resample_mode)
+    finally:
+        profiler.stop()
+
+    if isinstance(profiler, PipelineProfiler):
+        print(profiler)
+        if metrics_json:
+            profiler.write_json(os.path.expanduser(metrics_json))
+
+    return ld_filename
+
+class LogSource(object):
+    """ A single input log for a conversion, several of which can be merged into one MoTeC log.
+
+    log: Path to the log file, or a readable binary file-like object
+    log_type: Type of log, one of LOG_TYPES
+    dbc: Path to the DBC file, required for CAN logs
+    offset: Time offset added to all timestamps of this log, to align its clock with the others [s]
+    prefix: Prefix for channel names which collide with channels from other logs, defaults to the
+        log filename
+    j1939: Match extended CAN messages by their J1939 PGN, see CanDecoder
+    source_address_suffix: Append the source address of J1939 frames to the channel names
+    segments: Optional list of paths of further segments of this log, joined onto the end of it in
+        order. Segments ending in .ld are read as LD logs, the others as the same type as the log
+    """
+    def __init__(self, log, log_type, dbc=None, offset=0.0, prefix=None, j1939=None, \
+            source_address_suffix=False, segments=None):
+        self.log = log if is_stream(log) else os.path.expanduser(log)
+        self.log_type = log_type
+        self.dbc = os.path.expanduser(dbc) if dbc else None
+        self.offset = float(offset)
+        if prefix:
+            self.prefix = prefix
+        else:
+            self.prefix = os.path.splitext(os.path.basename(strip_compression_suffix(self.name())))[0]
+        self.j1939 = j1939
+        self.source_address_suffix = source_address_suffix
+        self.segments = [os.path.expanduser(segment) for segment in segments or []]
+
+    @classmethod
+    def from_string(cls, spec, default_log_type=None):
+        """ Creates a LogSource from a string of comma separated key=value pairs, e.g.
+        "path=bus1.log,type=CAN,dbc=bus1.dbc,offset=0.25,prefix=bus1"
+        """
+        fields = {}
+        for item in spec.split(","):
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"Invalid source field '{item}', expected key=value")
+            fields[key.strip()] = value.strip()
+
+        if "path" not in fields:
+            raise ValueError(f"Source '{spec}' is missing a path")
+
+        return cls(fields["path"], fields.get("type", default_log_type), fields.get("dbc"), \
+            fields.get("offset", 0.0), fields.get("prefix"))
+
+    def segment_sources(self):
+        """ Returns a LogSource for the log and each of its segments. """
+        sources = [LogSource(self.log, self.log_type, self.dbc, j1939=self.j1939, \
+            source_address_suffix=self.source_address_suffix)]
+        for segment in self.segments:
+            log_type = "LD" if strip_compression_suffix(segment).lower().endswith(".ld") else \
+                self.log_type
+            sources.append(LogSource(segment, log_type, self.dbc, j1939=self.j1939, \
+                source_address_suffix=self.source_address_suffix))
+
+        return sources
+
+    def name(self):
+        """ Returns the path of the log, or the name of its file object. """
+        if is_stream(self.log):
+            name = getattr(self.log, "name", None)
+            return name if isinstance(name, str) else "<stream>"
+
+        return self.log
+
+    def paths(self):
+        """ Returns the paths of all the input logs of this source, which aren't file objects. """
+        return [path for path in [self.log] + self.segments if not is_stream(path)]
+
+    def size(self):
+        """ Returns the total size of the input log files [bytes], file objects aren't counted. """
+        return sum(os.path.getsize(path) for path in self.paths())
+
+    def validate(self):
+        """ Makes sure the input files for this source are valid. """
+        if self.segments:
+            for source in self.segment_sources():
+                source.validate()
+            return
+
+        if self.log_type not in LOG_TYPES:
+            raise ValueError(f"Unknown log type '{self.log_type}' for log {self.name()}")
+        if not is_stream(self.log) and not os.path.isfile(self.log):
+            raise FileNotFoundError(f"log file {self.log} does not exist")
+        if self.log_type == "CAN":
+            if not self.dbc:
+                raise ValueError("DBC file must be provided for CAN log type")
+            if not os.path.isfile(self.dbc):
+                raise FileNotFoundError(f"DBC file {self.dbc} does not exist")
+
+class OutputSpec(object):
+    """ A single output of a conversion, several of which can be generated from one decoded log.
+
+    output: Path of the .ld file, defaults to the filename of the log, or a writable binary
+        file-like object
+    frequency: Frequency to resample the channels at [Hz], defaults to the conversion frequency
+    channels: Optional list of the channels to include, which may contain wildcards, e.g. "Wheel*"
+    start: Start of the time range to include, relative to the start of the log [s]
+    end: End of the time range to include, relative to the start of the log [s]
+    metadata: Optional dictionary of MoTeC metadata fields which override those of the conversion,
+        e.g. {"event_session": "Stint 1"}
+    parquet: Optional path to also write the resampled channels of this output to as a Parquet
+        file, or a writable binary file-like object
+    """
+    FIELDS = ["output", "frequency", "channels", "start", "end", "metadata", "parquet"]
+
+    def __init__(self, output=None, frequency=None, channels=None, start=None, end=None, \
+            metadata=None, parquet=None):
+        if output and not is_stream(output):
+            output = os.path.expanduser(output)
+        if parquet and not is_stream(parquet):
+            parquet = os.path.expanduser(parquet)
+        self.output = output
+        self.parquet = parquet
+        self.frequency = float(frequency) if frequency is not None else None
+        self.channels = [channels] if isinstance(channels, str) else channels
+        self.start = float(start) if start is not None else None
+        self.end = float(end) if end is not None else None
+        self.metadata = dict(metadata or {})
+
+    @classmethod
+    def from_dict(cls, fields):
+        unknown = set(fields) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown output fields {sorted(unknown)}, must be one of {cls.FIELDS}")
+
+        return cls(**fields)
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a list of OutputSpec from a JSON file, containing either a list of outputs or an
+        object with an "outputs" list, e.g.:
+            [{"output": "overview.ld", "frequency": 20},
+             {"output": "chassis.ld", "frequency": 500, "channels": ["Damper*", "Accel*"]},
+             {"output": "stint1.ld", "start": 0, "end": 1800,
+              "metadata": {"event_session": "Stint 1"}}]
+        """
+        with open(os.path.expanduser(filename), "r") as f:
+            config = json.load(f)
+
+        if isinstance(config, dict):
+            config = config.get("outputs", [])
+
+        return [cls.from_dict(fields) for fields in config]
+
+    def select_all(self):
+        """ Returns True if this output includes every channel over the whole log. """
+        return self.channels is None and self.start is None and self.end is None
+
+    def select_channels(self, names):
+        """ Returns the channel names matching the channel filter of this output. """
+        if self.channels is None:
+            return list(names)
+
+        return [name for name in names \
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.channels)]
+
+    def split(self, name, comment, start, end):
+        """ Returns a copy of this output limited to a time range, e.g. a single lap, or None if
+        the time range of this output doesn't overlap it.
+
+        name: Suffix added to the output filename
+        comment: Short comment for the MoTeC log, unless this output sets its own
+        start: Start of the time range, relative to the start of the log [s]
+        end: End of the time range, relative to the start of the log [s]
+        """
+        if self.start is not None:
+            start = max(start, self.start)
+        if self.end is not None:
+            end = min(end, self.end)
+        if end <= start:
+            return None
+
+        output = None
+        if self.output:
+            output = os.path.splitext(self.output)[0] + "_" + name + ".ld"
+        parquet = None
+        if self.parquet:
+            if is_stream(self.parquet):
+                raise ValueError("Parquet outputs which are split into laps must be given as paths")
+            parquet = os.path.splitext(self.parquet)[0] + "_" + name + ".parquet"
+
+        return OutputSpec(output, self.frequency, self.channels, start, end, \
+            {"short_comment": comment, **self.metadata}, parquet)
+
+    def validate(self, metadata):
+        unknown = set(self.metadata) - set(metadata)
+        if unknown:
+            raise ValueError(f"Unknown metadata fields {sorted(unknown)}")
+        if self.frequency is not None and self.frequency <= 0:
+            raise ValueError(f"Output frequency must be positive, not {self.frequency}")
+        if self.start is not None and self.end is not None and self.end <= self.start:
+            raise ValueError(f"Output time range {self.start} - {self.end} s is empty")
+
+def load_data_log(source, profiler=None, memory_budget=None, scratch_dir=None, progress=None, \
+        pipeline=False):
+    """ Loads the channels of a single log into a DataLog.
+
+    source: LogSource
+    profiler: Optional profiling.PipelineProfiler
+    memory_budget: Maximum number of bytes of channel data to keep in memory, see DataLog
+    scratch_dir: Directory for the files of spilled channels
+    progress: Optional progress.Progress, the stages are started by the profiler
+    pipeline: Read the log ahead, and parse CAN logs ahead, on background threads
+    """
+    if profiler is None:
+        profiler = NullProfiler()
+
+    if source.segments:
+        print("Extracting data from %d segments..." % (len(source.segments) + 1))
+        with profiler.stage("extract (segments)") as stage:
+            data_log = load_segmented_data_log(source, memory_budget, scratch_dir, progress, \
+                pipeline)
+            stage.bytes_read = source.size()
+            stage.rows = data_log.num_messages()
+        return data_log
+
+    log = source.log
+    log_type = source.log_type
+
+    data_log = DataLog(memory_budget=memory_budget, scratch_dir=scratch_dir)
+    if log_type == "LD":
+        # Existing .ld files already hold the channel data, so they only need to be read
+        print("Reading MoTeC log...")
+        with profiler.stage("read (LD)") as stage:
+            data_log.from_ld_file(log, progress)
+            stage.bytes_read = source.size()
+            stage.rows = data_log.num_messages()
+    elif log_type == "PARQUET":
+        # The columns are used as they are, without any parsing
+        print("Reading Parquet log...")
+        with profiler.stage("read (Parquet)") as stage:
+            data_log.from_parquet(log, progress)
+            stage.bytes_read = source.size()
+            stage.rows = data_log.num_messages()
+    elif log_type == "MCAP":
         print("Extracting data from MCAP log...")
-        data_log.from_mcap_log(log)
+        with profiler.stage("extract (MCAP)") as stage:
+            data_log.from_mcap_log(log, progress)
+            stage.bytes_read = source.size()
+            stage.rows = data_log.num_messages()
+    elif log_type == "CAN":
+        print("Loading DBC...")
+        dbc_cache = get_dbc_cache()
+        with profiler.stage("load DBC") as stage:
+            can_db = dbc_cache.load(source.dbc)
+            stage.bytes_read = os.path.getsize(source.dbc)
+            stage.rows = len(can_db.messages)
+            stage.extra["dbc_source"] = dbc_cache.last_source
+
+        # CAN logs are streamed straight from the file into the decoder
+        print("Extracting data...")
+        with profiler.stage("extract (CAN)") as stage:
+            with open_log(log, "r", prefetch=pipeline) as file:
+                if progress:
+                    progress.track(read_position(file), source.size())
+                decoder = data_log.from_can_log(file, can_db, j1939=source.j1939, \
+                    source_address_suffix=source.source_address_suffix, progress=progress, \
+                    prefetch=pipeline)
+            stage.bytes_read = source.size()
+            stage.rows = data_log.num_messages()
+            stage.extra["decode_cache"] = decoder.stats()
+        print(decoder)
     else:
         print("Loading log...")
-        with open(log, "r") as file:
-            lines = file.readlines()
-        if log_type == "CAN":
-            if not dbc:
-                raise ValueError("DBC file must be provided for CAN log type")
-            if not os.path.isfile(dbc):
-                raise FileNotFoundError(f"DBC file {dbc} does not exist")
-            print("Loading DBC...")
-            can_db = cantools.db.load_file(dbc)
-            print("Extracting data...")
-            data_log.from_can_log(lines, can_db)
-        elif log_type == "CSV":
-            print("Extracting data...")
-            data_log.from_csv_log(lines)
-        elif log_type == "ACCESSPORT":
-            print("Extracting data...")
-            data_log.from_accessport_log(lines)
+        with profiler.stage("read") as stage:
+            with open_log(log, "r", prefetch=pipeline) as file:
+                lines = file.readlines()
+            stage.bytes_read = source.size()
+            stage.rows = len(lines)
+        print("Extracting data...")
+        with profiler.stage(f"extract ({log_type})") as stage:
+            if log_type == "CSV":
+                data_log.from_csv_log(lines, progress)
+            elif log_type == "ACCESSPORT":
+                data_log.from_accessport_log(lines, progress)
+            stage.rows = len(lines)
+
+    return data_log
+
+def _init_worker():
+    # Forked workers inherit memory tracing from a profiled parent, which would slow them down
+    tracemalloc.stop()
+
+def load_data_logs(sources, memory_budget=None, scratch_dir=None, progress=None, pipeline=False):
+    """ Loads several logs in parallel, one process per log, returning a list of DataLog.
+
+    sources: List of LogSource
+    memory_budget: Maximum number of bytes of channel data to keep in memory, split evenly between
+        the logs while they're loaded
+    scratch_dir: Directory for the files of spilled channels
+    progress: Optional progress.Progress, updated with the number of logs loaded
+    pipeline: Read and parse each log ahead on background threads, see load_data_log
+    """
+    worker_budget = memory_budget / len(sources) if memory_budget is not None else None
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(len(sources), \
+        os.cpu_count() or 1), initializer=_init_worker)
+    try:
+        futures = [executor.submit(load_data_log, source, memory_budget=worker_budget, \
+            scratch_dir=scratch_dir, pipeline=pipeline) for source in sources]
+
+        # Wake up regularly while waiting, so a cancelled conversion stops promptly
+        pending = futures
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=0.1)
+            if progress:
+                progress.update(len(futures) - len(pending), len(futures))
+
+        logs = [future.result() for future in futures]
+    except BaseException:
+        # Don't wait for the remaining logs, they're dropped anyway
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+    return logs
+
+def load_merged_data_log(sources, collisions="prefix", memory_budget=None, scratch_dir=None, \
+        progress=None, pipeline=False):
+    """ Loads several logs in parallel, one process per log, and merges them into one DataLog.
+
+    sources: List of LogSource
+    collisions: How to handle channels with the same name in several logs, see DataLog.merge
+    memory_budget: Maximum number of bytes of channel data to keep in memory, split evenly between
+        the logs while they're loaded
+    scratch_dir: Directory for the files of spilled channels
+    progress: Optional progress.Progress, updated with the number of logs loaded
+    pipeline: Read and parse each log ahead on background threads, see load_data_log
+    """
+    logs = load_data_logs(sources, memory_budget, scratch_dir, progress, pipeline)
+
+    for source, log in zip(sources, logs):
+        print("Loaded %d channels from %s" % (len(log.channels), source.name()))
+
+    data_log = DataLog(memory_budget=memory_budget, scratch_dir=scratch_dir)
+    data_log.merge(logs, [source.prefix for source in sources], \
+        [source.offset for source in sources], collisions)
+    return data_log
+
+def load_segmented_data_log(source, memory_budget=None, scratch_dir=None, progress=None, \
+        pipeline=False):
+    """ Loads the segments of a log in parallel, one process per segment, and joins them into one
+    DataLog, see DataLog.concatenate.
+
+    source: LogSource with segments
+    memory_budget: Maximum number of bytes of channel data to keep in memory, split evenly between
+        the segments while they're loaded
+    scratch_dir: Directory for the files of spilled channels
+    progress: Optional progress.Progress, updated with the number of segments loaded
+    pipeline: Read and parse each segment ahead on background threads, see load_data_log
+    """
+    sources = source.segment_sources()
+    logs = load_data_logs(sources, memory_budget, scratch_dir, progress, pipeline)
+
+    for segment, log in zip(sources, logs):
+        print("Loaded %.1fs segment with %d channels from %s" % \
+            (log.duration(), len(log.channels), segment.log))
+
+    # .ld files don't store when they were recorded, so they're placed after the previous segment
+    data_log = DataLog(memory_budget=memory_budget, scratch_dir=scratch_dir)
+    data_log.concatenate(logs, [segment.log_type == "LD" for segment in sources])
+    if source.offset:
+        for channel in data_log.channels.values():
+            channel.shift(source.offset)
+
+    return data_log
+
+def preview_log(log, log_type, dbc=None, segments=None, j1939=None, \
+        source_address_suffix=False, bins=BASE_BINS, cache=True, progress=None):
+    """ Returns a preview.LogPreview of a log, to see what's in it before converting it.
+
+    The log is decoded once and its preview cached on disc (see preview.PreviewCache), so previewing
+    it again is instant, whatever the length of the log.
+
+    log: Path to the log file, or a readable binary file-like object, which isn't cached
+    log_type: Type of log, one of LOG_TYPES
+    dbc: Path to the DBC file, required for CAN logs
+    segments: Optional list of paths of further segments of the log, see generate_motec_log
+    j1939, source_address_suffix: See generate_motec_log
+    bins: Number of bins of the finest level of the previews
+    cache: Use the preview cache
+    progress: Optional progress.Progress
+    """
+    source = LogSource(log, log_type, dbc, j1939=j1939, \
+        source_address_suffix=source_address_suffix, segments=segments)
+    source.validate()
+
+    preview_cache = None
+    if cache and not is_stream(source.log):
+        preview_cache = PreviewCache()
+        key = preview_cache.cache_key(source.paths(), log_type, source.dbc, bins, \
+            {"j1939": j1939, "source_address_suffix": source_address_suffix})
+        preview = preview_cache.load(key)
+        if preview is not None:
+            print("Loaded preview of %s from cache" % source.name())
+            return preview
+
+    profiler = ProgressProfiler(NullProfiler(), progress) if progress else NullProfiler()
+    data_log = load_data_log(source, profiler, progress=progress, pipeline=True)
+    try:
+        data_log.name = os.path.basename(source.name())
+        with profiler.stage("preview"):
+            preview = data_log.preview(bins)
+    finally:
+        data_log.close()
+
+    if preview_cache:
+        preview_cache.save(key, preview)
+
+    return preview
+
+def _generate_motec_log(log, log_type, output, frequency, dbc, metadata, profiler, *, \
+        sources=None, collisions="prefix", j1939=None, source_address_suffix=False, \
+        memory_budget=None, scratch_dir=None, outputs=None, splitter=None, segments=None, \
+        return_bytes=False, progress=None, pipeline=False, parquet=None, write_threads=1, \
+        constant_channels="keep", duplicate_channels="keep", resample_mode="hold"):
+    if output and not is_stream(output):
+        output = os.path.expanduser(output)
+    validate_policies(constant_channels, duplicate_channels)
+    for mode in [resample_mode] if isinstance(resample_mode, str) else resample_mode.values():
+        if mode not in RESAMPLE_MODES:
+            raise ValueError(f"Unknown resample mode '{mode}', must be one of {RESAMPLE_MODES}")
+
+    # Make sure our input files are valid
+    sources = [LogSource(log, log_type, dbc, segments=segments)] + list(sources or [])
+    for source in sources:
+        source.j1939 = j1939
+        source.source_address_suffix = source_address_suffix
+        source.validate()
+    log = sources[0].log
+
+    # Several logs are loaded in separate processes, which file objects can't be passed to
+    if len(sources) > 1 or segments:
+        for source in sources:
+            if is_stream(source.log) or any(is_stream(segment) for segment in source.segments):
+                raise ValueError("Logs which are merged or joined must be given as paths")
+
+    specs = outputs if outputs else [OutputSpec(output, parquet=parquet)]
+    for spec in specs:
+        spec.validate(metadata)
+
+    if output:
+        default_filename = output if is_stream(output) else os.path.splitext(output)[0] + ".ld"
+    elif not is_stream(log) or return_bytes:
+        candump_dir, candump_filename = os.path.split(strip_compression_suffix(sources[0].name()))
+        candump_filename = os.path.splitext(candump_filename)[0]
+        default_filename = os.path.join(candump_dir, candump_filename + ".ld")
+    else:
+        raise ValueError("An output must be given when the log is a file object")
+
+    # Outputs without a filename are numbered when there are several of them. When returning bytes
+    # the filenames are only used to name the outputs.
+    ld_filenames = []
+    for i, spec in enumerate(specs):
+        if is_stream(spec.output) or (spec.output is None and is_stream(default_filename)):
+            if splitter:
+                raise ValueError("Outputs which are split into laps must be given as paths")
+            if len(specs) > 1 and spec.output is None:
+                raise ValueError("Each output must be given its own file object")
+            ld_filename = spec.output or default_filename
+        elif spec.output:
+            ld_filename = os.path.splitext(spec.output)[0] + ".ld"
+        elif len(specs) > 1:
+            ld_filename = os.path.splitext(default_filename)[0] + "_%d.ld" % (i + 1)
+        else:
+            ld_filename = default_filename
+
+        if ld_filename in ld_filenames:
+            raise ValueError(f"More than one output is written to {ld_filename}")
+        ld_filenames.append(ld_filename)
+
+    # An .ld input would be overwritten while it's being read
+    input_paths = {os.path.realpath(path) for source in sources for path in source.paths()}
+    for ld_filename in ld_filenames:
+        if not return_bytes and not is_stream(ld_filename) and \
+                os.path.realpath(ld_filename) in input_paths:
+            raise ValueError(f"Output {ld_filename} would overwrite one of the input logs")
+    for spec in specs:
+        if spec.parquet and not is_stream(spec.parquet) and \
+                os.path.realpath(spec.parquet) in input_paths:
+            raise ValueError(f"Output {spec.parquet} would overwrite one of the input logs")
+
+    if len(sources) == 1:
+        data_log = load_data_log(sources[0], profiler, memory_budget, scratch_dir, progress, \
+            pipeline)
+    else:
+        print("Extracting data from %d logs..." % len(sources))
+        with profiler.stage("extract (merge)") as stage:
+            data_log = load_merged_data_log(sources, collisions, memory_budget, scratch_dir, \
+                progress, pipeline)
+            stage.bytes_read = sum(source.size() for source in sources)
+            stage.rows = data_log.num_messages()
 
     if not data_log.channels:
         raise RuntimeError("Failed to find any channels in log data")
@@ -86,46 +671,256 @@ def generate_motec_log(
     for channel_name, channel in data_log.channels.items():
         print("\t%s" % channel)
 
-    data_log.resample(frequency)
-    print("Converting to MoTeC log...")
+    if splitter:
+        with profiler.stage("split") as stage:
+            laps = splitter.segments(data_log)
+            stage.rows = len(laps)
+        print("Splitting log into %d %ss" % (len(laps), splitter.mode))
 
-    motec_log = MotecLog()
-    motec_log.driver = driver
-    motec_log.vehicle_id = vehicle_id
-    motec_log.vehicle_weight = vehicle_weight
-    motec_log.vehicle_type = vehicle_type
-    motec_log.vehicle_comment = vehicle_comment
-    motec_log.venue_name = venue_name
-    motec_log.event_name = event_name
-    motec_log.event_session = event_session
-    motec_log.long_comment = long_comment
-    motec_log.short_comment = short_comment
-
-    motec_log.initialize()
-    motec_log.add_all_channels(data_log)
-
-    print("Saving MoTeC log...")
-    if output:
-        ld_filename = os.path.splitext(output)[0] + ".ld"
+        split_specs = []
+        split_filenames = []
+        for spec, ld_filename in zip(specs, ld_filenames):
+            for number, start, end in laps:
+                name = "%s%02d" % (splitter.mode, number)
+                split_spec = spec.split(name, "%s %d" % (splitter.mode.capitalize(), number), \
+                    start, end)
+                if split_spec:
+                    split_specs.append(split_spec)
+                    split_filenames.append(os.path.splitext(ld_filename)[0] + "_" + name + ".ld")
+        specs = split_specs
+        ld_filenames = split_filenames
+
+    targets = ld_filenames
+    if return_bytes:
+        targets = [io.BytesIO() for ld_filename in ld_filenames]
+
+    # Options shared by every output
+    write_options = {
+        "progress": progress,
+        "pipeline": pipeline,
+        "write_threads": write_threads,
+        "constant_channels": constant_channels,
+        "duplicate_channels": duplicate_channels,
+        "resample_mode": resample_mode,
+    }
+    if len(specs) == 1:
+        _write_output(data_log, specs[0], ld_filenames[0], frequency, metadata, profiler, False, \
+            target=targets[0], **write_options)
     else:
-        candump_dir, candump_filename = os.path.split(log)
-        candump_filename = os.path.splitext(candump_filename)[0]
-        ld_filename = os.path.join(candump_dir, candump_filename + ".ld")
+        # Each output works on its own views of the decoded channels, and the heavy lifting is done
+        # by NumPy and file writes which release the GIL, so the outputs are generated in threads
+        print("Generating %d MoTeC logs..." % len(specs))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(specs), \
+                os.cpu_count() or 1)) as executor:
+            futures = [executor.submit(_write_output, data_log, spec, ld_filename, frequency, \
+                metadata, profiler, True, target=target, **write_options) \
+                for spec, ld_filename, target in zip(specs, ld_filenames, targets)]
+            for future in futures:
+                future.result()
 
-    output_dir = os.path.dirname(ld_filename)
-    if output_dir and not os.path.isdir(output_dir):
-        print(f"Directory '{output_dir}' does not exist, will create it")
-        os.makedirs(output_dir)
+    # Remove any channels spilled to disc, otherwise they're removed when the log is garbage
+    # collected
+    data_log.close()
 
-    motec_log.write(ld_filename)
     print("Done!")
+    if return_bytes:
+        results = [target.getvalue() for target in targets]
+    else:
+        results = ld_filenames
+
+    return results if outputs or splitter else results[0]
+
+def _output_name(ld_filename):
+    """ Returns the name of an output for messages, which may be a path or a file object. """
+    if is_stream(ld_filename):
+        name = getattr(ld_filename, "name", None)
+        return name if isinstance(name, str) else "<stream>"
+
     return ld_filename
 
+def _write_output(data_log, spec, ld_filename, frequency, metadata, profiler, shared, *, \
+        target=None, progress=None, pipeline=False, write_threads=1, constant_channels="keep", \
+        duplicate_channels="keep", resample_mode="hold"):
+    """ Resamples, packs and writes a single output of a conversion.
+
+    ld_filename: Path of the output, or a writable binary file-like object
+    shared: True if the decoded log is used by other outputs, so it must not be modified
+    target: Optional file-like object to write to instead of ld_filename
+    progress: Optional progress.Progress
+    pipeline: Resample the channels on a pool of threads while the previous channels are written
+    write_threads: Number of threads resampling and writing channels at once, see
+        MotecLog.write_parallel. Only used when writing to a path
+    constant_channels: How to write channels which never change, see compaction.plan_compaction
+    duplicate_channels: How to write channels identical to an earlier channel
+    resample_mode: How to resample the channels, see data_log.channel_resample_mode
+    """
+    frequency = spec.frequency or frequency
+    if target is None:
+        target = ld_filename
+    ld_filename = _output_name(ld_filename)
+
+    # Stage names are suffixed with the output when there are several of them
+    suffix = " (%s)" % os.path.basename(ld_filename) if shared else ""
+
+    if spec.select_all() and not shared:
+        # Resample the decoded log in place, so its original data can be freed as it goes
+        output_log = data_log
+        start = end = None
+    else:
+        log_start = data_log.start()
+        start = log_start + spec.start if spec.start is not None else log_start
+        end = min(log_start + spec.end, data_log.end()) if spec.end is not None else \
+            data_log.end()
+        if end <= start:
+            raise ValueError(f"Output {ld_filename} time range is outside of the log")
+
+        names = spec.select_channels(data_log.channels)
+        if not names:
+            raise ValueError(f"No channels match the channels of output {ld_filename}")
+        output_log = data_log.select(names, start, end)
+
+    channels = dict(output_log.channels)
+    compaction = None
+    if constant_channels != "keep" or duplicate_channels != "keep":
+        # Fixed before any channels are taken out of the log, which could change its time range
+        start = output_log.start() if start is None else start
+        end = output_log.end() if end is None else end
+        with profiler.stage("compact" + suffix) as stage:
+            # Duplicates resampled in different ways don't stay identical, so aren't aliased
+            compaction = plan_compaction(output_log, constant_channels, duplicate_channels, \
+                resample_count(start, end, frequency), resample_count(start, end, LOW_RATE), \
+                lambda name: channel_resample_mode(resample_mode, name), start)
+            stage.rows = len(compaction)
+
+            # Compacted channels are taken out of the log, so they aren't resampled at the full rate
+            for name in channels:
+                if compaction.action(name):
+                    del output_log.channels[name]
+            for name in compaction.low_rate:
+                channels[name].resample(start, end, LOW_RATE)
+        print(compaction)
+
+    parallel = write_threads > 1 and not is_stream(target)
+    resampled = None
+    if pipeline or parallel:
+        # Every channel is resampled onto the same time points, so the layout of the file is known
+        # up front, and each channel can be written as soon as it has been resampled
+        start = output_log.start() if start is None else start
+        end = output_log.end() if end is None else end
+        times = resample_times(start, end, frequency)
+        num_msgs = len(times)
+        resampled_frequency = num_msgs / (times[-1] - times[0]) if num_msgs >= 2 else 0
+        if parallel:
+            # Channels are written in any order, so each one is resampled by the thread writing it
+            def resample(channel_name):
+                return lambda: output_log.resample_channel(channel_name, frequency, start, end, \
+                    channel_resample_mode(resample_mode, channel_name)).values
+        else:
+            resampled = output_log.iter_resampled(frequency, start, end, modes=resample_mode)
+
+            def resample(channel_name):
+                return lambda: next(resampled).values
+    else:
+        with profiler.stage("resample" + suffix) as stage:
+            output_log.resample(frequency, start, end, progress, resample_mode)
+            stage.rows = output_log.num_messages()
+    print("Converting to MoTeC log...")
+
+    with profiler.stage("pack" + suffix) as stage:
+        motec_log = MotecLog()
+        for field, value in {**metadata, **spec.metadata}.items():
+            setattr(motec_log, field, value)
+
+        motec_log.initialize()
+        for channel_name, channel in channels.items():
+            action = compaction.action(channel_name) if compaction else None
+            if action == "drop":
+                continue
+            elif action == "alias":
+                motec_log.add_alias(channel, compaction.aliases[channel_name])
+            elif action == "low_rate":
+                motec_log.add_channel(channel, frequency=LOW_RATE)
+            elif not (pipeline or parallel):
+                motec_log.add_channel(channel)
+            else:
+                # Empty channels are left empty by resampling
+                has_data = len(channel) > 0
+                motec_log.add_channel(channel, num_msgs if has_data else 0, \
+                    resampled_frequency if has_data else 0, resample(channel_name))
+        stage.rows = len(motec_log.ld_channels)
+
+    print("Saving MoTeC log %s..." % ld_filename)
+    if not is_stream(target):
+        output_dir = os.path.dirname(target)
+        if output_dir and not os.path.isdir(output_dir):
+            print(f"Directory '{output_dir}' does not exist, will create it")
+            os.makedirs(output_dir, exist_ok=True)
+
+    stage_name = "resample + write" if pipeline or parallel else "write"
+    with profiler.stage(stage_name + suffix) as stage:
+        try:
+            if parallel:
+                stage.bytes_written = motec_log.write_parallel(target, write_threads, progress)
+            else:
+                stage.bytes_written = motec_log.write(target, progress)
+        except BaseException:
+            # Don't leave a partially written file behind, e.g. when the conversion is cancelled
+            if not is_stream(target) and os.path.isfile(target):
+                os.remove(target)
+            raise
+        finally:
+            # Stops the resampling threads if the write failed
+            if resampled is not None:
+                resampled.close()
+        stage.rows = len(motec_log.ld_channels)
+
+    if spec.parquet:
+        # The resampled channels share their timestamps, so they form a single table
+        print("Saving Parquet log %s..." % _output_name(spec.parquet))
+        if not is_stream(spec.parquet):
+            output_dir = os.path.dirname(spec.parquet)
+            if output_dir and not os.path.isdir(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+
+        with profiler.stage("export (Parquet)" + suffix) as stage:
+            output_log.to_parquet(spec.parquet)
+            stage.rows = output_log.num_messages()
+            if not is_stream(spec.parquet):
+                stage.bytes_written = os.path.getsize(spec.parquet)
+
+def parse_resample_modes(text):
+    """ Parses the resample modes of the channels from a comma separated list. Each item is either
+    a mode for all other channels, or a channel name pattern, which may contain wildcards, and a
+    mode as name=mode, e.g. "linear,Accel*=fir".
+
+    Returns the mode when only one is given for every channel, otherwise a dict of channel name
+    patterns to modes, with the default last, see data_log.channel_resample_mode
+    """
+    default = "hold"
+    modes = {}
+    for item in text.split(","):
+        pattern, _, mode = item.strip().rpartition("=")
+        if not mode:
+            continue
+        if mode not in RESAMPLE_MODES:
+            raise ValueError(f"Unknown resample mode '{mode}', must be one of {RESAMPLE_MODES}")
+        if pattern:
+            modes[pattern] = mode
+        else:
+            default = mode
+
+    if not modes:
+        return default
+
+    modes["*"] = default
+    return modes
+
 def main():
     parser = argparse.ArgumentParser(description=DESCRIPTION, epilog=EPILOG)
-    parser.add_argument("log", type=str, help="Path to logfile")
+    parser.add_argument("log", type=str, nargs="+", \
+        help="Path to logfile, or several consecutive segments of a log to join into one")
     parser.add_argument("log_type", type=str, help="Type of log to process", \
-        choices=["CAN", "CSV", "ACCESSPORT", "MCAP"])
+        choices=LOG_TYPES)
     parser.add_argument("--output", type=str, help="Name of output file, defaults to the same filename as 'log'")
     parser.add_argument("--frequency", type=float, default=20.0, help="Fixed frequency to resample all channels at")
     parser.add_argument("--dbc", type=str, help="Path to DBC file, required if log type CAN")
@@ -139,9 +934,85 @@ def main():
     parser.add_argument("--event_session", type=str, default="", help="Motec log metadata field")
     parser.add_argument("--long_comment", type=str, default="", help="Motec log metadata field")
     parser.add_argument("--short_comment", type=str, default="", help="Motec log metadata field")
+    parser.add_argument("--source", type=str, action="append", default=[], \
+        help="Additional log to merge, as comma separated key=value pairs: " \
+        "path=<log>,type=<log type>,dbc=<dbc>,offset=<s>,prefix=<name>. Can be repeated")
+    parser.add_argument("--collisions", type=str, default="prefix", choices=["prefix", "merge"], \
+        help="How to handle channels with the same name in merged logs")
+    parser.add_argument("--j1939", action="store_true", default=None, \
+        help="Match all extended CAN messages by their J1939 PGN, not just the ones the DBC marks " \
+        "as J1939")
+    parser.add_argument("--source_address_suffix", action="store_true", \
+        help="Append the source address of J1939 frames to the channel names, e.g. EngSpeed_SA00")
+    parser.add_argument("--memory_budget", type=float, \
+        help="Maximum memory to use for channel data [MB], channels beyond this are spilled to " \
+        "disc")
+    parser.add_argument("--scratch_dir", type=str, \
+        help="Directory for channels spilled to disc, defaults to the system temp directory")
+    parser.add_argument("--outputs", type=str, \
+        help="JSON file listing several outputs to generate from one pass over the log, each with " \
+        "its own output, frequency, channels, start, end and metadata")
+    parser.add_argument("--split", type=str, choices=LapSplitter.MODES, \
+        help="Write a separate .ld file for each lap or stint, detected from --beacon or " \
+        "--start_finish")
+    parser.add_argument("--beacon", type=str, \
+        help="Name of the lap beacon channel, which rises above 0.5 at the start/finish line")
+    parser.add_argument("--start_finish", type=str, \
+        help="Start/finish line for GPS lap detection, as lat1,lon1,lat2,lon2")
+    parser.add_argument("--gps_channels", type=str, default="Latitude,Longitude", \
+        help="Names of the GPS latitude and longitude channels, as lat,lon")
+    parser.add_argument("--min_lap_time", type=float, default=10.0, \
+        help="Minimum time between start/finish line crossings [s]")
+    parser.add_argument("--parquet", type=str, \
+        help="Path to also write the resampled channels to as a Parquet file, e.g. for analysis " \
+        "with pandas. Requires pyarrow")
+    parser.add_argument("--preview", action="store_true", \
+        help="Print a preview of the channels in the log instead of converting it")
+    parser.add_argument("--pipeline", action="store_true", \
+        help="Overlap reading, decoding, resampling and writing on background threads, which " \
+        "speeds up conversions from and to slow storage, e.g. network drives")
+    parser.add_argument("--constant_channels", type=str, default="keep", \
+        choices=CONSTANT_POLICIES, help="How to write channels which never change: keep them, " \
+        "drop them, or write them at the lowest MoTeC rate of %d Hz (low_rate)" % LOW_RATE)
+    parser.add_argument("--duplicate_channels", type=str, default="keep", \
+        choices=DUPLICATE_POLICIES, help="How to write channels identical to an earlier channel: " \
+        "keep them, drop them, or alias them to the data of the earlier channel")
+    parser.add_argument("--resample_mode", "--resample-mode", type=str, default="hold", \
+        help="How to resample the channels: hold, linear, average or fir (anti-aliased " \
+        "downsampling). Modes of particular channels can follow the default as name=mode, e.g. " \
+        "'hold,Accel*=fir'")
+    parser.add_argument("--write_threads", type=int, default=1, \
+        help="Number of threads resampling, converting and writing channels at once, each " \
+        "straight to its place in the .ld file. Speeds up logs with many channels")
+    parser.add_argument("--profile", action="store_true", \
+        help="Print the timings, throughput and peak memory of each conversion stage")
+    parser.add_argument("--profile_dump", type=str, \
+        help="Path to write a profiler dump of the whole conversion to, implies --profile")
+    parser.add_argument("--profiler", type=str, default="cprofile", \
+        choices=PipelineProfiler.PROFILERS, help="Profiler to use for --profile_dump")
+    parser.add_argument("--metrics_json", "--metrics-json", type=str, \
+        help="Path to write the stage metrics to as JSON")
     args = parser.parse_args()
+
+    if args.preview:
+        print(preview_log(args.log[0], args.log_type, args.dbc, args.log[1:], args.j1939, \
+            args.source_address_suffix))
+        return
+
+    sources = [LogSource.from_string(spec, args.log_type) for spec in args.source]
+
+    splitter = None
+    if args.split:
+        splitter = LapSplitter(args.split, args.beacon, \
+            args.start_finish.split(",") if args.start_finish else None, \
+            args.gps_channels.split(","), args.min_lap_time)
+
+    profiler = None
+    if args.profile or args.profile_dump:
+        profiler = PipelineProfiler(dump_path=args.profile_dump, profiler=args.profiler)
+
     generate_motec_log(
-        log=args.log,
+        log=args.log[0],
         log_type=args.log_type,
         output=args.output,
         frequency=args.frequency,
@@ -155,7 +1026,24 @@ def main():
         event_name=args.event_name,
         event_session=args.event_session,
         long_comment=args.long_comment,
-        short_comment=args.short_comment
+        short_comment=args.short_comment,
+        profiler=profiler,
+        metrics_json=args.metrics_json,
+        sources=sources,
+        collisions=args.collisions,
+        j1939=args.j1939,
+        source_address_suffix=args.source_address_suffix,
+        memory_budget=args.memory_budget * 1e6 if args.memory_budget is not None else None,
+        scratch_dir=args.scratch_dir,
+        outputs=OutputSpec.load(args.outputs) if args.outputs else None,
+        splitter=splitter,
+        segments=args.log[1:],
+        pipeline=args.pipeline,
+        parquet=args.parquet,
+        write_threads=args.write_threads,
+        constant_channels=args.constant_channels,
+        duplicate_channels=args.duplicate_channels,
+        resample_mode=parse_resample_modes(args.resample_mode)
     )
 
 if __name__ == '__main__':
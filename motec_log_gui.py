@@ -1,14 +1,16 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import os
 import json
 import sys
 import subprocess
-import threading
-import requests
+import multiprocessing
+import concurrent.futures
 import logging
+import math
 from pathlib import Path
-from motec_log_generator import generate_motec_log
+from job_queue import JobQueue
+from log_io import strip_compression_suffix
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -22,6 +24,13 @@ LAST_DIR_FILE = HOME / ".motec_log_gui_lastdir.json"
 ICON_DL_PATH = Path(__file__).resolve().parent / "icons" / "squirrel.png"
 LOG_TYPES = ["MCAP", "CSV", "ACCESSPORT", "CAN"]
 
+# How often the job queue is checked for progress [ms]
+POLL_INTERVAL = 100
+
+# Size of the sparklines in the preview window [pixels]
+SPARKLINE_WIDTH = 400
+SPARKLINE_HEIGHT = 28
+
 # Metadata fields: (label, variable name, default, type)
 METADATA_FIELDS = [
     ("Driver", "driver", "", str),
@@ -64,13 +73,164 @@ def get_default_output(log_path):
     if not log_path:
         logger.debug("No log path provided for default output")
         return ""
-    log_path = Path(log_path).expanduser().resolve()
+    log_path = Path(strip_compression_suffix(str(Path(log_path).expanduser().resolve())))
     candump_dir = log_path.parent
     candump_filename = log_path.stem
     output_path = candump_dir / f"{candump_filename}.ld"
     logger.debug("Default output path computed: %s", output_path)
     return str(output_path)
 
+def build_preview(log, log_type, dbc):
+    """ Builds the preview of a log in a worker process, so the window stays responsive. """
+    from motec_log_generator import preview_log
+    return preview_log(log, log_type, dbc or None)
+
+class PreviewWindow(tk.Toplevel):
+    """ Shows a sparkline of every channel of a log, from a preview.LogPreview, so the channels and
+    time range to convert can be picked before converting it.
+
+    Click a channel to select it, and drag across the sparklines to zoom into a time range. The
+    selected channels and time range are used by the next conversions.
+    """
+    NAME_WIDTH = 200
+    ROW_HEIGHT = SPARKLINE_HEIGHT + 8
+
+    def __init__(self, master, preview, selection=None):
+        super().__init__(master)
+        self.preview = preview
+        self.title("Preview: " + preview.name)
+        self.names = list(preview.channels)
+        self.selected = set(selection["channels"] if selection and selection["channels"] else [])
+        duration = preview.end - preview.start
+        self.start_var = tk.StringVar(value="%.1f" % (selection["start"] if selection else 0.0))
+        self.end_var = tk.StringVar(value="%.1f" % (selection["end"] if selection else duration))
+        self.drag_start = None
+
+        controls = tk.Frame(self)
+        controls.pack(fill="x", padx=10, pady=6)
+        tk.Label(controls, text="Start (s):", font=master.base_font).pack(side=tk.LEFT)
+        start_entry = tk.Entry(controls, textvariable=self.start_var, width=8, font=master.entry_font)
+        start_entry.pack(side=tk.LEFT, padx=4)
+        tk.Label(controls, text="End (s):", font=master.base_font).pack(side=tk.LEFT)
+        end_entry = tk.Entry(controls, textvariable=self.end_var, width=8, font=master.entry_font)
+        end_entry.pack(side=tk.LEFT, padx=4)
+        start_entry.bind("<Return>", lambda event: self.draw())
+        end_entry.bind("<Return>", lambda event: self.draw())
+        tk.Button(controls, text="Whole Log", command=self.reset_range, font=master.button_font).pack(side=tk.LEFT, padx=4)
+        tk.Label(controls, text="%.1fs, %d channels" % (duration, len(self.names)), font=master.base_font).pack(side=tk.RIGHT)
+
+        frame = tk.Frame(self)
+        frame.pack(fill="both", expand=True, padx=10)
+        height = min(len(self.names), 16) * self.ROW_HEIGHT
+        self.canvas = tk.Canvas(frame, width=self.NAME_WIDTH + SPARKLINE_WIDTH + 10, height=height, background="white", highlightthickness=0)
+        scrollbar = tk.Scrollbar(frame, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set, scrollregion=(0, 0, 0, len(self.names) * self.ROW_HEIGHT))
+        self.canvas.pack(side=tk.LEFT, fill="both", expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.canvas.bind("<ButtonPress-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_release)
+
+        buttons = tk.Frame(self)
+        buttons.pack(pady=8)
+        tk.Button(buttons, text="Use Selection", command=self.apply, font=master.button_font).pack(side=tk.LEFT, padx=10)
+        tk.Button(buttons, text="Clear Selection", command=self.clear, font=master.button_font).pack(side=tk.LEFT, padx=10)
+        tk.Button(buttons, text="Close", command=self.destroy, font=master.button_font).pack(side=tk.LEFT, padx=10)
+        self.draw()
+
+    def time_range(self):
+        """ Returns the time range shown, relative to the start of the log [s]. """
+        duration = self.preview.end - self.preview.start
+        try:
+            start = min(max(float(self.start_var.get()), 0.0), duration)
+            end = min(max(float(self.end_var.get()), 0.0), duration)
+        except ValueError:
+            start, end = 0.0, duration
+        if end <= start:
+            start, end = 0.0, duration
+        return start, end
+
+    def draw(self):
+        """ Draws the sparklines of all channels over the time range, each is a band between the
+        minimum and maximum values with a line through the means.
+        """
+        self.canvas.delete("all")
+        start, end = self.time_range()
+        x0 = self.NAME_WIDTH
+        for row, name in enumerate(self.names):
+            y0 = row * self.ROW_HEIGHT
+            if name in self.selected:
+                self.canvas.create_rectangle(0, y0, x0 + SPARKLINE_WIDTH + 10, y0 + self.ROW_HEIGHT, fill="#dce8fa", outline="")
+            self.canvas.create_text(5, y0 + self.ROW_HEIGHT / 2, text=name, anchor="w", font=("PMingLiU-ExtB", 11))
+
+            pyramid = self.preview.channels[name]
+            times, mins, maxs, means = pyramid.query(self.preview.start + start, self.preview.start + end, SPARKLINE_WIDTH)
+            points = [i for i in range(len(times)) if math.isfinite(mins[i]) and math.isfinite(maxs[i])]
+            if not points:
+                continue
+            low = min(mins[i] for i in points)
+            high = max(maxs[i] for i in points)
+            scale = (SPARKLINE_HEIGHT - 2) / (high - low) if high > low else 0.0
+            def x(i):
+                return x0 + (times[i] - self.preview.start - start) / (end - start) * SPARKLINE_WIDTH
+            def y(value):
+                return y0 + 4 + SPARKLINE_HEIGHT - 1 - (value - low) * scale if scale else y0 + 4 + SPARKLINE_HEIGHT / 2
+
+            band = [(x(i), y(maxs[i])) for i in points] + [(x(i), y(mins[i])) for i in reversed(points)]
+            if len(points) > 1:
+                self.canvas.create_polygon(band, fill="#b7c9e2", outline="")
+                self.canvas.create_line([(x(i), y(means[i])) for i in points], fill="#1f4e8c")
+            else:
+                self.canvas.create_line(band, fill="#1f4e8c", width=2)
+
+    def on_press(self, event):
+        x = self.canvas.canvasx(event.x)
+        if x < self.NAME_WIDTH:
+            # Clicking the name of a channel selects it
+            row = int(self.canvas.canvasy(event.y) // self.ROW_HEIGHT)
+            if 0 <= row < len(self.names):
+                self.selected ^= {self.names[row]}
+                self.draw()
+        else:
+            self.drag_start = x
+
+    def on_drag(self, event):
+        if self.drag_start is None:
+            return
+        self.canvas.delete("drag")
+        top = self.canvas.canvasy(0)
+        self.canvas.create_rectangle(self.drag_start, top, self.canvas.canvasx(event.x), top + self.canvas.winfo_height(), outline="#1f4e8c", tags="drag")
+
+    def on_release(self, event):
+        if self.drag_start is None:
+            return
+        # Zoom into the dragged time range
+        start, end = self.time_range()
+        xs = sorted([self.drag_start, self.canvas.canvasx(event.x)])
+        self.drag_start = None
+        if xs[1] - xs[0] < 3:
+            self.canvas.delete("drag")
+            return
+        to_time = lambda x: start + min(max(x - self.NAME_WIDTH, 0), SPARKLINE_WIDTH) / SPARKLINE_WIDTH * (end - start)
+        self.start_var.set("%.1f" % to_time(xs[0]))
+        self.end_var.set("%.1f" % to_time(xs[1]))
+        self.draw()
+
+    def reset_range(self):
+        self.start_var.set("%.1f" % 0.0)
+        self.end_var.set("%.1f" % (self.preview.end - self.preview.start))
+        self.draw()
+
+    def apply(self):
+        start, end = self.time_range()
+        channels = [name for name in self.names if name in self.selected]
+        self.master.set_selection({"channels": channels or None, "start": start, "end": end})
+        self.destroy()
+
+    def clear(self):
+        self.master.set_selection(None)
+        self.destroy()
+
 class MotecLogGUI(tk.Tk):
     def __init__(self):
         logger.info("Initializing MotecLogGUI")
@@ -85,6 +245,7 @@ class MotecLogGUI(tk.Tk):
             # Try to download the icon from github
             try:
                 logger.info("Attempting to download icon from GitHub...")
+                import requests
                 response = requests.get("https://raw.githubusercontent.com/mathbrook/MotecLogGenerator/refs/heads/master/icons/squirrel.png", timeout=3)
                 if response.status_code == 200:
                     with ICON_DL_PATH.open("wb") as f:
@@ -106,10 +267,20 @@ class MotecLogGUI(tk.Tk):
         self.entry_font = ("PMingLiU-ExtB", 14)
         self.button_font = ("PMingLiU-ExtB", 14, "bold")
         self.pad = 20
+        # Conversions run in worker processes, their progress is picked up by poll_jobs() on the
+        # Tk main loop
+        self.jobs = JobQueue()
+        # Previews are built in a worker process too, see open_preview()
+        self.previews = None
+        self.preview_future = None
+        # Channels and time range picked in the preview window, used by the conversions
+        self.selection = None
         self.create_widgets()
         self.update_idletasks()
         self.minsize(self.winfo_reqwidth(), self.winfo_reqheight())
         self.geometry("")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(POLL_INTERVAL, self.poll_jobs)
         logger.info("GUI initialized")
 
     def create_widgets(self):
@@ -216,16 +387,35 @@ class MotecLogGUI(tk.Tk):
         self.status.grid(row=row, column=0, columnspan=3, sticky="ew", pady=8)
         row += 1
 
+        # Queue of conversions, with the progress of the selected (or latest) job below it
+        self.job_list = ttk.Treeview(container, columns=("log", "state", "stage", "progress"), show="headings", height=5, selectmode="extended")
+        for column, heading, width in [("log", "Log", 220), ("state", "State", 80), ("stage", "Stage", 160), ("progress", "Progress", 140)]:
+            self.job_list.heading(column, text=heading)
+            self.job_list.column(column, width=width, stretch=column == "log")
+        self.job_list.grid(row=row, column=0, columnspan=3, sticky="nsew", pady=6)
+        self.job_list.bind("<<TreeviewSelect>>", lambda event: self.show_job_progress())
+        row += 1
+
+        self.progress_bar = ttk.Progressbar(container, orient="horizontal", mode="determinate", maximum=1.0)
+        self.progress_bar.grid(row=row, column=0, columnspan=3, sticky="ew", pady=6)
+        row += 1
+
         button_frame = tk.Frame(container)
         button_frame.grid(row=row, column=0, columnspan=3, pady=10)
         self.convert_btn = tk.Button(button_frame, text="Convert", command=self.run_conversion, font=self.button_font)
         self.convert_btn.pack(side=tk.LEFT, padx=10)
+        self.cancel_btn = tk.Button(button_frame, text="Cancel", command=self.cancel_jobs, font=self.button_font)
+        self.cancel_btn.pack(side=tk.LEFT, padx=10)
         self.open_btn = tk.Button(button_frame, text="Open", command=self.open_output_folder, state=tk.DISABLED, font=self.button_font)
         self.open_btn.pack(side=tk.LEFT, padx=10)
+        self.preview_btn = tk.Button(button_frame, text="Preview...", command=self.open_preview, font=self.button_font)
+        self.preview_btn.pack(side=tk.LEFT, padx=10)
         metadata_btn = tk.Button(button_frame, text="Metadata...", command=self.open_metadata_dialog, font=self.button_font)
         metadata_btn.pack(side=tk.LEFT, padx=10)
-        add_tooltip(self.convert_btn, "Convert the log file to MoTeC format.")
+        add_tooltip(self.convert_btn, "Add the log file to the queue of conversions to MoTeC format.")
+        add_tooltip(self.cancel_btn, "Cancel the selected conversions, or all of them if none are selected.")
         add_tooltip(self.open_btn, "Open the output folder.")
+        add_tooltip(self.preview_btn, "Preview the channels of the log file, and pick the channels and time range to convert.")
         add_tooltip(metadata_btn, "Edit metadata fields for the log file.")
 
         for i in range(3):
@@ -254,6 +444,9 @@ class MotecLogGUI(tk.Tk):
         log_path = self.vars["log"].get()
         if log_path:
             self.vars["output"].set(get_default_output(log_path))
+        # A selection from the preview of another log doesn't apply to this one
+        if getattr(self, "selection", None):
+            self.set_selection(None)
         self.update_convert_button_state()
 
     def update_convert_button_state(self):
@@ -271,10 +464,11 @@ class MotecLogGUI(tk.Tk):
             initialdir=self.last_dir,
             title="Select Log File",
             filetypes=[
-                ("Supported Logs", "*.mcap *.log *.csv"),
+                ("Supported Logs", "*.mcap *.log *.csv *.gz *.xz *.bz2 *.zst"),
                 ("MCAP Files", "*.mcap"),
                 ("Log Files", "*.log"),
                 ("CSV Files", "*.csv"),
+                ("Compressed Logs", "*.gz *.xz *.bz2 *.zst"),
                 ("All Files", "*.*")
             ]
         )
@@ -320,62 +514,148 @@ class MotecLogGUI(tk.Tk):
                 subprocess.Popen(['xdg-open', folder])
 
     def run_conversion(self):
-        logger.info("Starting non-blocking conversion")
-        def do_conversion():
-            self.status.config(text="Running conversion...")
-            self.lock_buttons()
-            try:
-                # Build kwargs for generate_motec_log from self.vars
-                kwargs = {k: v.get() for k, v in self.vars.items()}
-                # Convert types for known int/float fields
-                for label, varname, default, typ in METADATA_FIELDS:
-                    if typ == int:
-                        try:
-                            kwargs[varname] = int(kwargs[varname]) if kwargs[varname] not in (None, "") else 0
-                        except Exception:
-                            logger.warning("Could not convert %s to int, defaulting to 0", varname)
-                            kwargs[varname] = 0
-                    elif typ == float:
-                        try:
-                            kwargs[varname] = float(kwargs[varname]) if kwargs[varname] not in (None, "") else 0.0
-                        except Exception:
-                            logger.warning("Could not convert %s to float, defaulting to 0.0", varname)
-                            kwargs[varname] = 0.0
-                # Handle frequency (always float)
+        logger.info("Queueing conversion")
+        # Build kwargs for generate_motec_log from self.vars
+        kwargs = {k: v.get() for k, v in self.vars.items()}
+        # Convert types for known int/float fields
+        for label, varname, default, typ in METADATA_FIELDS:
+            if typ == int:
                 try:
-                    kwargs["frequency"] = float(self.vars["frequency"].get()) if self.vars["frequency"].get() not in (None, "") else 20.0
+                    kwargs[varname] = int(kwargs[varname]) if kwargs[varname] not in (None, "") else 0
                 except Exception:
-                    kwargs["frequency"] = 20.0
-                # Ensure required args are present
-                kwargs["log"] = self.vars["log"].get()
-                kwargs["log_type"] = self.vars["log_type"].get()
-                kwargs["output"] = self.vars["output"].get()
-                kwargs["dbc"] = self.vars["dbc"].get()
-                logger.info(f"Calling motec_log_generator.generate_motec_log with kwargs: {kwargs}")
-                result = generate_motec_log(**kwargs)
-                self.status.config(text="Done! Output: " + self.vars["output"].get(), fg="green")
-                messagebox.showinfo("Success", "Conversion complete!\nOutput: " + self.vars["output"].get())
-                self.open_btn.config(state=tk.NORMAL)
-            except Exception as e:
-                logger.error("Exception running conversion: %s", e)
-                self.status.config(text="Error: " + str(e), fg="red")
-                messagebox.showerror("Error", str(e))
-            self.unlock_buttons()
-        threading.Thread(target=do_conversion, daemon=True).start()
-
-    def lock_buttons(self):
-        logger.debug("Locking buttons")
-        self.convert_btn.config(state=tk.DISABLED)
-        self.open_btn.config(state=tk.DISABLED)
-        self.widget_refs['dbc_browse_btn'].config(state=tk.DISABLED)
-
-    def unlock_buttons(self):
-        logger.debug("Unlocking buttons")
-        self.convert_btn.config(state=tk.NORMAL)
-        if self.vars["log_type"].get() == "CAN":
-            self.widget_refs['dbc_browse_btn'].config(state=tk.NORMAL)
+                    logger.warning("Could not convert %s to int, defaulting to 0", varname)
+                    kwargs[varname] = 0
+            elif typ == float:
+                try:
+                    kwargs[varname] = float(kwargs[varname]) if kwargs[varname] not in (None, "") else 0.0
+                except Exception:
+                    logger.warning("Could not convert %s to float, defaulting to 0.0", varname)
+                    kwargs[varname] = 0.0
+        # Handle frequency (always float)
+        try:
+            kwargs["frequency"] = float(self.vars["frequency"].get()) if self.vars["frequency"].get() not in (None, "") else 20.0
+        except Exception:
+            kwargs["frequency"] = 20.0
+        # Ensure required args are present
+        kwargs["log"] = self.vars["log"].get()
+        kwargs["log_type"] = self.vars["log_type"].get()
+        kwargs["output"] = self.vars["output"].get()
+        kwargs["dbc"] = self.vars["dbc"].get()
+        if self.selection:
+            # Imported here so the window can be shown before numpy is loaded
+            from motec_log_generator import OutputSpec
+            kwargs["outputs"] = [OutputSpec(kwargs["output"] or None, channels=self.selection["channels"], start=self.selection["start"], end=self.selection["end"])]
+        logger.info(f"Queueing motec_log_generator.generate_motec_log with kwargs: {kwargs}")
+        job = self.jobs.submit(**kwargs)
+        self.job_list.insert("", tk.END, iid=str(job.id), values=(os.path.basename(kwargs["log"]), job.state, job.stage, ""))
+        self.update_job_row(job)
+        self.status.config(text="Queued " + kwargs["log"], fg="black")
+
+    def poll_jobs(self):
+        """ Applies the progress of the running conversions to the widgets, runs on the Tk main loop. """
+        try:
+            for job in self.jobs.poll():
+                self.update_job_row(job)
+                if job.state == "done":
+                    logger.info("Conversion of %s done", job.kwargs["log"])
+                    self.status.config(text="Done! Output: " + str(job.result) + "\n" + job.summary, fg="green")
+                    self.open_btn.config(state=tk.NORMAL)
+                elif job.state == "failed":
+                    logger.error("Conversion of %s failed: %s", job.kwargs["log"], job.error)
+                    self.status.config(text="Error: " + str(job.error), fg="red")
+                elif job.state == "cancelled":
+                    self.status.config(text="Cancelled " + job.kwargs["log"], fg="black")
+            self.show_job_progress()
+        except Exception as e:
+            logger.error("Exception polling conversions: %s", e)
+        self.after(POLL_INTERVAL, self.poll_jobs)
+
+    def update_job_row(self, job):
+        if not self.job_list.exists(str(job.id)):
+            return
+        if job.state == "running":
+            if job.fraction is not None:
+                progress = "%.0f%% (%.0f/s)" % (100 * job.fraction, job.rate)
+            else:
+                progress = "%.0f/s" % job.rate
+        elif job.state == "done":
+            progress = "100%"
+        else:
+            progress = ""
+        self.job_list.item(str(job.id), values=(os.path.basename(job.kwargs["log"]), job.state, job.stage, progress))
+
+    def show_job_progress(self):
+        """ Shows the progress of the selected job, or the latest running one, in the progress bar. """
+        selected = [self.jobs.jobs[int(iid)] for iid in self.job_list.selection()]
+        running = [job for job in self.jobs.jobs.values() if job.state == "running"]
+        job = selected[0] if selected else (running[-1] if running else None)
+        if job is None:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode="determinate", value=0)
+        elif job.state == "running" and job.fraction is None:
+            # The size of the stage isn't known, so just show that it's busy
+            if str(self.progress_bar.cget("mode")) != "indeterminate":
+                self.progress_bar.config(mode="indeterminate")
+                self.progress_bar.start()
         else:
-            self.widget_refs['dbc_browse_btn'].config(state=tk.DISABLED)
+            self.progress_bar.stop()
+            value = 1.0 if job.state == "done" else (job.fraction or 0.0)
+            self.progress_bar.config(mode="determinate", value=value)
+
+    def cancel_jobs(self):
+        job_ids = [int(iid) for iid in self.job_list.selection()] or list(self.jobs.jobs)
+        logger.info("Cancelling jobs: %s", job_ids)
+        for job_id in job_ids:
+            self.jobs.cancel(job_id)
+            self.update_job_row(self.jobs.jobs[job_id])
+
+    def open_preview(self):
+        log_path = self.vars["log"].get()
+        if not log_path:
+            return
+        if self.preview_future is not None:
+            self.status.config(text="Already building a preview...", fg="black")
+            return
+        if self.previews is None:
+            # Spawned rather than forked, since forking a process running Tk isn't safe
+            self.previews = concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        logger.info("Building preview of %s", log_path)
+        self.status.config(text="Building preview of " + log_path + "...", fg="black")
+        self.preview_future = self.previews.submit(build_preview, log_path, self.vars["log_type"].get(), self.vars["dbc"].get())
+        self.after(POLL_INTERVAL, self.poll_preview)
+
+    def poll_preview(self):
+        if not self.preview_future.done():
+            self.after(POLL_INTERVAL, self.poll_preview)
+            return
+        future = self.preview_future
+        self.preview_future = None
+        try:
+            preview = future.result()
+        except Exception as e:
+            logger.error("Exception building preview: %s", e)
+            self.status.config(text="Error: " + str(e), fg="red")
+            return
+        self.status.config(text="", fg="black")
+        PreviewWindow(self, preview, self.selection)
+
+    def set_selection(self, selection):
+        """ Sets the channels and time range to convert, picked in the preview window. """
+        self.selection = selection
+        if selection is None:
+            self.status.config(text="Converting all channels of the whole log", fg="black")
+            return
+        channels = "%d channels" % len(selection["channels"]) if selection["channels"] else "all channels"
+        self.status.config(text="Converting %s from %.1fs to %.1fs" % (channels, selection["start"], selection["end"]), fg="black")
+
+    def on_close(self):
+        if self.jobs.active() and not messagebox.askyesno("Quit", "Conversions are still running, cancel them and quit?"):
+            return
+        logger.info("Shutting down job queue")
+        self.jobs.shutdown()
+        if self.previews is not None:
+            self.previews.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
     def open_metadata_dialog(self):
         logger.info("Opening metadata dialog")
@@ -404,5 +684,7 @@ class MotecLogGUI(tk.Tk):
         close_btn.grid(row=row, column=0, columnspan=2, pady=10)
 
 if __name__ == "__main__":
+    # Needed for the conversion processes of frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     logger.info("Starting mainloop")
     MotecLogGUI().mainloop()
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+import numpy as np
+from dbc_cache import user_cache_dir
+
+# Bump this if the format of the preview files changes
+PREVIEW_VERSION = 1
+
+# Environment variable to override the preview cache directory, set it to an empty string to
+# disable the cache
+CACHE_DIR_ENV = "MOTEC_PREVIEW_CACHE_DIR"
+
+# Number of bins of the finest level of the pyramids
+BASE_BINS = 2048
+
+# Number of bins of a level combined into each bin of the next level
+LEVEL_FACTOR = 4
+
+# Levels are added until they have no more than this many bins
+MIN_BINS = 16
+
+# Characters used to draw sparklines as text, from low to high
+SPARK_CHARS = " ▁▂▃▄▅▆▇█"
+
+def default_cache_dir():
+    """ Returns the directory the previews are cached in, or None if the cache is disabled. """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir is not None:
+        return os.path.expanduser(cache_dir) if cache_dir else None
+
+    return user_cache_dir("preview")
+
+class ChannelPyramid(object):
+    """ Summary of a channel at several resolutions, for drawing previews of it quickly.
+
+    The time range of the log is split into bins of equal duration, and the finest level holds the
+    minimum, maximum and mean value of the messages in each bin, along with their number. Each
+    following level combines LEVEL_FACTOR bins of the level below it, so a preview of any time
+    range only has to look at a few hundred bins, however long the log is. Bins without any messages
+    have NaN values.
+
+    name: Name of the channel
+    units: Units of the channel
+    start: Start of the first bin [s]
+    end: End of the last bin of the finest level [s]
+    levels: List of (mins, maxs, means, counts) arrays, from the finest level to the coarsest
+    """
+    def __init__(self, name, units, start, end, levels):
+        self.name = name
+        self.units = units
+        self.start = start
+        self.end = end
+        self.levels = levels
+
+    @classmethod
+    def build(cls, channel, start, end, bins=BASE_BINS):
+        """ Builds the pyramid of a data_log.Channel in a single pass over its messages.
+
+        start: Start of the time range to summarize, e.g. the start of the log [s]
+        end: End of the time range to summarize [s]
+        bins: Number of bins of the finest level
+        """
+        times, values = channel.times, channel.values
+        end = max(end, start + 1e-9)
+
+        # The messages are sorted by time, so each bin is a contiguous run of them
+        edges = start + (end - start) * np.arange(1, bins) / bins
+        firsts = np.concatenate(([0], np.searchsorted(times, edges, side="left")))
+        counts = np.diff(np.append(firsts, len(times)))
+
+        mins = np.full(bins, np.nan)
+        maxs = np.full(bins, np.nan)
+        means = np.full(bins, np.nan)
+        filled = counts > 0
+        if np.any(filled):
+            indices = firsts[filled]
+            mins[filled] = np.minimum.reduceat(values, indices)
+            maxs[filled] = np.maximum.reduceat(values, indices)
+            means[filled] = np.add.reduceat(values, indices) / counts[filled]
+
+        levels = [cls._level(mins, maxs, means, counts)]
+        while len(counts) > MIN_BINS:
+            mins, maxs, means, counts = cls._combine(mins, maxs, means, counts)
+            levels.append(cls._level(mins, maxs, means, counts))
+
+        return cls(channel.name, channel.units, start, end, levels)
+
+    @staticmethod
+    def _level(mins, maxs, means, counts):
+        # Single precision is plenty for drawing, and halves the size of the cache
+        return mins.astype(np.float32), maxs.astype(np.float32), means.astype(np.float32), \
+            counts.astype(np.uint32)
+
+    @staticmethod
+    def _combine(mins, maxs, means, counts):
+        """ Combines every LEVEL_FACTOR bins of a level into one bin of the next level. """
+        n = math.ceil(len(counts) / LEVEL_FACTOR)
+        pad = n * LEVEL_FACTOR - len(counts)
+        mins = np.pad(mins, (0, pad), constant_values=np.nan).reshape(n, LEVEL_FACTOR)
+        maxs = np.pad(maxs, (0, pad), constant_values=np.nan).reshape(n, LEVEL_FACTOR)
+        means = np.pad(means, (0, pad), constant_values=np.nan).reshape(n, LEVEL_FACTOR)
+        counts = np.pad(counts, (0, pad)).reshape(n, LEVEL_FACTOR)
+
+        total = counts.sum(axis=1)
+        sums = np.where(counts > 0, means.astype(np.float64) * counts, 0.0).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            new_means = np.where(total > 0, sums / total, np.nan)
+
+        # fmin and fmax ignore the NaN of empty bins
+        return np.fmin.reduce(mins, axis=1), np.fmax.reduce(maxs, axis=1), new_means, total
+
+    def bin_width(self, level):
+        """ Returns the duration of the bins of a level [s]. """
+        return (self.end - self.start) / len(self.levels[0][3]) * LEVEL_FACTOR ** level
+
+    def query(self, start=None, end=None, width=200):
+        """ Returns the minimum, maximum and mean values of a time range, at no more than width
+        points, e.g. one per pixel of a sparkline. Uses the coarsest level with enough bins, so this
+        takes the same time for any time range.
+
+        start: Start of the time range, defaults to the start of the pyramid [s]
+        end: End of the time range, defaults to the end of the pyramid [s]
+        width: Maximum number of points to return
+
+        Returns the times of the middle of the points, and the minimums, maximums and means, with
+        NaN values where there are no messages
+        """
+        start = self.start if start is None else max(start, self.start)
+        end = self.end if end is None else min(end, self.end)
+        if end <= start:
+            empty = np.zeros(0)
+            return empty, empty, empty, empty
+
+        level = 0
+        for candidate in reversed(range(len(self.levels))):
+            if (end - start) / self.bin_width(candidate) >= width:
+                level = candidate
+                break
+
+        mins, maxs, means, counts = self.levels[level]
+        bin_width = self.bin_width(level)
+        first = max(int(math.floor((start - self.start) / bin_width)), 0)
+        last = min(int(math.ceil((end - self.start) / bin_width)), len(counts))
+        mins = mins[first:last].astype(np.float64)
+        maxs = maxs[first:last].astype(np.float64)
+        means = means[first:last].astype(np.float64)
+        counts = counts[first:last].astype(np.float64)
+        bin_starts = self.start + bin_width * np.arange(first, last)
+        bin_ends = bin_starts + bin_width
+
+        if len(counts) > width:
+            # Combine groups of neighbouring bins, so there's one per point
+            groups = np.linspace(0, len(counts), width + 1).astype(int)[:-1]
+            sums = np.add.reduceat(np.where(counts > 0, means * counts, 0.0), groups)
+            mins = np.fmin.reduceat(mins, groups)
+            maxs = np.fmax.reduceat(maxs, groups)
+            counts = np.add.reduceat(counts, groups)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = np.where(counts > 0, sums / counts, np.nan)
+            bin_ends = bin_ends[np.append(groups[1:], len(bin_ends)) - 1]
+            bin_starts = bin_starts[groups]
+
+        return (bin_starts + bin_ends) / 2, mins, maxs, means
+
+    def sparkline(self, width=40, start=None, end=None):
+        """ Returns a text sparkline of the mean values of a time range, e.g. for terminals. """
+        times, mins, maxs, means = self.query(start, end, width)
+        if not np.any(np.isfinite(means)):
+            return ""
+
+        low = np.nanmin(means)
+        high = np.nanmax(means)
+        scale = (len(SPARK_CHARS) - 2) / (high - low) if high > low else 0.0
+        return "".join(" " if not np.isfinite(mean) else \
+            SPARK_CHARS[1 + int(round((mean - low) * scale))] for mean in means)
+
+    def __str__(self):
+        mins, maxs, means, counts = self.levels[-1]
+        if np.any(counts):
+            return "%s: min %g, max %g %s" % (self.name, np.nanmin(mins), np.nanmax(maxs), \
+                self.units)
+        return "%s: no messages" % self.name
+
+class LogPreview(object):
+    """ Pyramids of all the channels of a log, see ChannelPyramid.
+
+    name: Name of the log
+    start: Start of the log [s]
+    end: End of the log [s]
+    channels: Dictionary of ChannelPyramid by channel name
+    """
+    def __init__(self, name, start, end, channels):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.channels = channels
+
+    @classmethod
+    def build(cls, data_log, bins=BASE_BINS):
+        """ Builds the pyramids of all the channels of a data_log.DataLog. """
+        start = data_log.start()
+        end = data_log.end()
+        channels = {name: ChannelPyramid.build(channel, start, end, bins) \
+            for name, channel in data_log.channels.items()}
+        return cls(data_log.name, start, end, channels)
+
+    def save(self, path):
+        """ Saves the preview to a file, written to a temporary file first so other processes never
+        see a partially written file.
+        """
+        arrays = {}
+        meta = {"version": PREVIEW_VERSION, "name": self.name, "start": self.start, \
+            "end": self.end, "channels": []}
+        for i, pyramid in enumerate(self.channels.values()):
+            meta["channels"].append({"name": pyramid.name, "units": pyramid.units, \
+                "start": pyramid.start, "end": pyramid.end, \
+                "levels": [len(level[3]) for level in pyramid.levels]})
+            for j, field in enumerate(["min", "max", "mean", "count"]):
+                arrays["c%d_%s" % (i, field)] = np.concatenate([level[j] for level in \
+                    pyramid.levels])
+        arrays["meta"] = np.array(json.dumps(meta))
+
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a preview saved by save(). """
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays["meta"]))
+            if meta["version"] != PREVIEW_VERSION:
+                raise ValueError(f"Preview version {meta['version']} is not {PREVIEW_VERSION}")
+
+            channels = {}
+            for i, info in enumerate(meta["channels"]):
+                fields = [arrays["c%d_%s" % (i, field)] for field in ["min", "max", "mean", \
+                    "count"]]
+                bounds = np.cumsum([0] + info["levels"])
+                levels = [tuple(field[begin:end] for field in fields) \
+                    for begin, end in zip(bounds[:-1], bounds[1:])]
+                channels[info["name"]] = ChannelPyramid(info["name"], info["units"], \
+                    info["start"], info["end"], levels)
+
+        return cls(meta["name"], meta["start"], meta["end"], channels)
+
+    def __str__(self):
+        output = "Preview of %s, %.1fs with %d channels:" % (self.name, self.end - self.start, \
+            len(self.channels))
+        for pyramid in self.channels.values():
+            output += "\n\t%-24s %s" % (pyramid.name, pyramid.sparkline())
+        return output
+
+class PreviewCache(object):
+    """ Stores the previews of logs on disc, next to the DBC cache, so a log only has to be decoded
+    once to preview it.
+
+    The previews are keyed by the path, size and modification time of the log files, the contents of
+    the DBC and the number of bins, so a changed log or DBC is decoded again.
+    """
+    def __init__(self, cache_dir=None):
+        """
+        cache_dir: Directory to store the previews in, defaults to default_cache_dir()
+        """
+        self.cache_dir = cache_dir if cache_dir is not None else default_cache_dir()
+
+    def cache_key(self, paths, log_type, dbc=None, bins=BASE_BINS, options=None):
+        """ Returns the key of the preview of a log.
+
+        paths: Paths of the log files, e.g. the log and its segments
+        log_type: Type of the log
+        dbc: Optional path of the DBC file
+        options: Optional dictionary of other options which change the decoded channels
+        """
+        key = {"version": PREVIEW_VERSION, "log_type": log_type, "bins": bins, \
+            "options": options or {}, "logs": []}
+        for path in paths:
+            stat = os.stat(path)
+            key["logs"].append([os.path.realpath(path), stat.st_size, stat.st_mtime_ns])
+
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode())
+        if dbc:
+            with open(dbc, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+
+        return digest.hexdigest()
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key):
+        """ Returns the cached preview, or None if there isn't one. """
+        if not self.cache_dir:
+            return None
+
+        try:
+            return LogPreview.load(self.cache_path(key))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # A corrupted or outdated cache file just means the log gets decoded again
+            print(f"Warning: Ignoring invalid preview cache file {self.cache_path(key)}: {e}")
+            return None
+
+    def save(self, key, preview):
+        if not self.cache_dir:
+            return
+
+        try:
+            preview.save(self.cache_path(key))
+        except OSError as e:
+            print(f"Warning: Failed to cache preview in {self.cache_dir}: {e}")
@@ -0,0 +1,219 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+
+class StageMetrics(object):
+    """ Resource usage recorded for a single stage of the conversion pipeline. """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        # Peak traced memory, or None when memory isn't being tracked
+        self.peak_memory = None
+
+        # Any additional stage specific statistics, e.g. cache hit rates
+        self.extra = {}
+
+    def throughput(self):
+        """ Returns the number of rows processed per second of wall time. """
+        if self.wall_time > 0:
+            return self.rows / self.wall_time
+        else:
+            return 0.0
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "rows": self.rows,
+            "rows_per_second": self.throughput(),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_memory": self.peak_memory,
+            **self.extra,
+        }
+
+    def __str__(self):
+        return "%-20s wall: %8.3f s, cpu: %8.3f s, rows: %10d (%10.0f/s), read: %10s, written: %10s, peak mem: %10s" % \
+            (self.name, self.wall_time, self.cpu_time, self.rows, self.throughput(), \
+            format_bytes(self.bytes_read), format_bytes(self.bytes_written), \
+            format_bytes(self.peak_memory) if self.peak_memory is not None else "n/a")
+
+class PipelineProfiler(object):
+    """ Records wall time, CPU time, throughput and memory usage of each stage of a conversion.
+
+    Stages are recorded with the stage() context manager, which yields a StageMetrics object the
+    caller can fill in with the number of rows and bytes processed. Peak memory is only tracked
+    when track_memory is enabled, since tracemalloc noticeably slows down the conversion, otherwise
+    it's written to the JSON metrics as null.
+
+    Optionally a profiler dump can be written for the whole run:
+        "cprofile": A cProfile stats file, which can be inspected with pstats or snakeviz
+        "sampling": Collapsed stacks from a periodic stack sampler, for use with flamegraph tools
+    """
+    PROFILERS = ["cprofile", "sampling"]
+
+    def __init__(self, track_memory=True, dump_path=None, profiler="cprofile", \
+            sample_interval=0.005):
+        if profiler not in self.PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', must be one of {self.PROFILERS}")
+
+        self.track_memory = track_memory
+        self.dump_path = dump_path
+        self.profiler = profiler
+        self.sample_interval = sample_interval
+        self.stages: List[StageMetrics] = []
+
+        self._cprofile = None
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        """ Starts memory tracking and the optional profiler for the whole run. """
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        if self.dump_path:
+            if self.profiler == "cprofile":
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            else:
+                self._sampler = StackSampler(threading.get_ident(), self.sample_interval)
+                self._sampler.start()
+
+    def stop(self):
+        """ Stops all tracking, and writes out the profiler dump if one was requested. """
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.dump_path)
+            self._cprofile = None
+        if self._sampler:
+            self._sampler.stop()
+            self._sampler.dump(self.dump_path)
+            self._sampler = None
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name):
+        """ Context manager which records the resource usage of the code within it.
+
+        name: Name of the stage
+        """
+        metrics = StageMetrics(name)
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_time = time.perf_counter() - wall_start
+            metrics.cpu_time = time.process_time() - cpu_start
+            if tracemalloc.is_tracing():
+                metrics.peak_memory = tracemalloc.get_traced_memory()[1]
+            self.stages.append(metrics)
+
+    def total_wall_time(self):
+        return sum(stage.wall_time for stage in self.stages)
+
+    def to_dict(self):
+        return {
+            "total_wall_time": self.total_wall_time(),
+            "total_cpu_time": sum(stage.cpu_time for stage in self.stages),
+            "stages": [stage.to_dict() for stage in self.stages],
+        }
+
+    def write_json(self, filename):
+        """ Writes all the recorded stage metrics to a JSON file. """
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self):
+        """ Returns a short single line per stage summary of the wall times. """
+        lines = ["%s: %.2f s" % (stage.name, stage.wall_time) for stage in self.stages]
+        lines.append("Total: %.2f s" % self.total_wall_time())
+        return "\n".join(lines)
+
+    def __str__(self):
+        output = "Stage timings:"
+        for stage in self.stages:
+            output += "\n\t%s" % stage
+        output += "\n\tTotal wall time: %.3f s" % self.total_wall_time()
+        return output
+
+class StackSampler(object):
+    """ Low overhead sampling profiler which periodically records the call stack of a thread.
+
+    Samples are stored as collapsed stacks ("outer;inner;innermost count"), which is the input
+    format of most flamegraph tools.
+    """
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Dict[str, int] = Counter()
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write("%s %d\n" % (stack, count))
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), \
+                    code.co_firstlineno))
+                frame = frame.f_back
+
+            self.samples[";".join(reversed(stack))] += 1
+
+class NullProfiler(object):
+    """ Drop in replacement for PipelineProfiler which records nothing. """
+    @contextmanager
+    def stage(self, name):
+        yield StageMetrics(name)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+def format_bytes(num_bytes):
+    """ Formats a number of bytes in a human readable form, e.g. 1.5 MB. """
+    for unit in ["B", "kB", "MB", "GB"]:
+        if abs(num_bytes) < 1024.0 or unit == "GB":
+            return "%.1f %s" % (num_bytes, unit) if unit != "B" else "%d B" % num_bytes
+        num_bytes /= 1024.0
@@ -0,0 +1,158 @@
+import threading
+import time
+from contextlib import contextmanager
+
+class ConversionCancelled(Exception):
+    """ Raised within a conversion once it has been cancelled. """
+    pass
+
+class ProgressEvent(object):
+    """ Progress of the current stage of a conversion.
+
+    stage: Name of the stage
+    done: Amount of work done so far, e.g. rows read or bytes written
+    total: Total amount of work in the stage, or None if it isn't known
+    fraction: Fraction of the stage completed, or None if it isn't known
+    rate: Amount of work done per second of the stage
+    elapsed: Time since the start of the stage [s]
+    """
+    def __init__(self, stage, done, total, fraction, rate, elapsed):
+        self.stage = stage
+        self.done = done
+        self.total = total
+        self.fraction = fraction
+        self.rate = rate
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        return {
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "fraction": self.fraction,
+            "rate": self.rate,
+            "elapsed": self.elapsed,
+        }
+
+    def __str__(self):
+        if self.fraction is not None:
+            return "%s: %.0f%% (%.0f/s)" % (self.stage, 100 * self.fraction, self.rate)
+        else:
+            return "%s: %d (%.0f/s)" % (self.stage, self.done, self.rate)
+
+class Progress(object):
+    """ Reports the progress of a conversion, and allows it to be cancelled.
+
+    The long running loops of the conversion (reading, resampling and writing) call update() as they
+    go. This passes a ProgressEvent to the callback, at most once per interval so reporting doesn't
+    slow the conversion down, and raises ConversionCancelled once the cancelled function returns
+    True. The stages themselves are started by ProgressProfiler.
+    """
+    def __init__(self, callback=None, cancelled=None, interval=0.1):
+        """
+        callback: Function called with a ProgressEvent, from the thread running the conversion
+        cancelled: Function which returns True once the conversion should be cancelled, e.g. the
+            is_set method of a threading.Event
+        interval: Minimum time between calls of the callback [s]
+        """
+        self.callback = callback
+        self.cancelled = cancelled
+        self.interval = interval
+
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self._position = None
+        self._started = time.perf_counter()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """ Raises ConversionCancelled if the conversion has been cancelled. """
+        if self.cancelled is not None and self.cancelled():
+            raise ConversionCancelled("Conversion cancelled")
+
+    def begin(self, stage, total=None):
+        """ Starts a new stage of the conversion. """
+        self.check()
+        with self._lock:
+            self.stage = stage
+            self.done = 0
+            self.total = total
+            self._position = None
+            self._started = time.perf_counter()
+        self._report(force=True)
+
+    def track(self, position, total):
+        """ Measures the progress of the current stage by how far through a file it is, rather than
+        the amount of work done, e.g. when the number of rows in a log isn't known up front.
+
+        position: Function returning the number of bytes of the file read so far, see
+            log_io.read_position. Ignored if None
+        total: Size of the file [bytes], ignored if None
+        """
+        if position is not None and total:
+            with self._lock:
+                self._position = position
+                self.total = total
+
+    def update(self, done, total=None):
+        """ Records the amount of work done in the current stage.
+
+        done: Amount of work done so far in the stage, e.g. rows read or bytes written
+        total: Total amount of work in the stage, if it is known
+        """
+        self.check()
+        with self._lock:
+            self.done = done
+            if total is not None and self._position is None:
+                self.total = total
+        self._report()
+
+    def end(self):
+        """ Finishes the current stage. """
+        self._report(force=True, finished=True)
+
+    def event(self, finished=False):
+        """ Returns a ProgressEvent of the current stage. """
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            fraction = None
+            if finished:
+                fraction = 1.0
+            elif self.total:
+                done = self._position() if self._position is not None else self.done
+                fraction = min(max(done / self.total, 0.0), 1.0)
+
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            return ProgressEvent(self.stage, self.done, self.total, fraction, rate, elapsed)
+
+    def _report(self, force=False, finished=False):
+        if self.callback is None:
+            return
+
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.interval:
+            return
+
+        self._last_report = now
+        self.callback(self.event(finished))
+
+class ProgressProfiler(object):
+    """ Wraps a profiler, so each stage it records is also started as a stage of a Progress. """
+    def __init__(self, profiler, progress):
+        self.profiler = profiler
+        self.progress = progress
+
+    @contextmanager
+    def stage(self, name):
+        self.progress.begin(name)
+        with self.profiler.stage(name) as metrics:
+            yield metrics
+        self.progress.end()
+
+    def start(self):
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
@@ -0,0 +1,56 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_log import DataLog
+
+def write_parquet(path, times, channels):
+    columns = {"time": pa.array(times)}
+    columns.update({name: pa.array(values) for name, values in channels.items()})
+    pq.write_table(pa.table(columns), path)
+
+def test_merge_offset_shifts_each_channel_once(tmp_path):
+    # Timestamps, and unsorted rows, both give the channels a writable time array they share
+    times = np.array([2.0, 0.0, 1.0])
+    for time_column in [times, (times * 1e9).astype("datetime64[ns]")]:
+        path = tmp_path / "log.parquet"
+        write_parquet(path, time_column, {"A": [1.0, 2.0, 3.0], "B": [4, 5, 6], \
+            "C": [7.0, 8.0, 9.0]})
+
+        log = DataLog()
+        log.from_parquet(str(path))
+        merged = DataLog()
+        merged.merge([log], ["log"], offsets=[10.0])
+        for channel in merged.channels.values():
+            assert channel.times.tolist() == [10.0, 11.0, 12.0]
+
+def test_select_shift_leaves_log_unchanged():
+    log = DataLog()
+    log.add_channel("A", "", float, 0)
+    for t in range(3):
+        log.add_message("A", float(t), 1.0)
+
+    part = log.select(start=1.0)
+    part.channels["A"].shift(5.0)
+    assert log.channels["A"].times.tolist() == [0.0, 1.0, 2.0]
+    assert part.channels["A"].times.tolist() == [5.0, 6.0, 7.0]
+
+def test_parquet_round_trip_keeps_samples(tmp_path):
+    # Timestamps since the epoch, which are only accurate to a few hundred nanoseconds
+    log = DataLog()
+    log.add_channel("Speed", "km/h", float, 1)
+    for i in range(1805):
+        log.add_message("Speed", 1631416510.123 + i / 20, float(i))
+    log.end_time = 1631416510.123 + 1805 / 20
+
+    for _ in range(3):
+        log.resample(20)
+        assert len(log.channels["Speed"]) == 1805
+        assert np.allclose(np.diff(log.channels["Speed"].times), 1 / 20, rtol=1e-5)
+
+        path = tmp_path / "log.parquet"
+        log.to_parquet(str(path))
+        log = DataLog()
+        log.from_parquet(str(path))
+        assert len(log.channels["Speed"]) == 1805
+
+    assert log.channels["Speed"].values.tolist() == list(range(1805))
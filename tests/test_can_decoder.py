@@ -0,0 +1,55 @@
+import cantools
+from can_decoder import CAN_EFF_FLAG, CanDecoder
+from can_sources import CandumpLogSource
+from data_log import DataLog
+
+def make_db():
+    db = cantools.database.Database()
+    for name, frame_id in [("EngineA", 0x18FEF100), ("EngineB", 0x18FEF117)]:
+        signal = cantools.database.Signal(name + "Speed", start=0, length=16)
+        db.messages.append(cantools.database.Message(frame_id, name, 8, [signal], \
+            is_extended_frame=True))
+    db.refresh()
+    return db
+
+def test_shared_pgn_matched_by_source_address(capsys):
+    decoder = CanDecoder(make_db(), j1939=True)
+    assert "same PGN" in capsys.readouterr().out
+
+    # Exact source addresses go to their own message, whatever the priority
+    assert decoder.lookup(0x18FEF100) == (0x18FEF100, "")
+    assert decoder.lookup(0x0CFEF117) == (0x18FEF117, "")
+
+    # Other source addresses fall back to the first message with the PGN
+    assert decoder.lookup(0x18FEF125) == (0x18FEF100, "")
+    assert decoder.lookup(0x18FEF200) is None
+
+def test_decodes_with_matching_message():
+    decoder = CanDecoder(make_db(), j1939=True)
+    decoded = decoder.decode(0x0CFEF117, b"\x01\x00" + b"\x00" * 6)
+    assert [(name, value) for name, signal, value in decoded] == [("EngineBSpeed", 1)]
+
+def test_standard_ids_not_matched_by_pgn():
+    # TSC1 has PGN 0, which every standard id from 0x000 to 0x0FF would have as an extended id
+    db = cantools.database.Database()
+    signal = cantools.database.Signal("RequestedSpeed", start=8, length=16)
+    db.messages.append(cantools.database.Message(0x0C000003, "TSC1", 8, [signal], \
+        is_extended_frame=True))
+    db.refresh()
+    decoder = CanDecoder(db, j1939=True)
+
+    assert decoder.lookup(0x003) is None
+    assert decoder.lookup(0x0D4) is None
+    assert decoder.lookup(CAN_EFF_FLAG | 0x0C000003) == (0x0C000003, "")
+    assert decoder.lookup(CAN_EFF_FLAG | 0x00000017) == (0x0C000003, "")
+
+    log = DataLog()
+    log.from_can_log(["(1.0) can0 003#0001020304050607", "(1.1) can0 0D4#0001020304050607", \
+        "(1.2) can0 00000003#0001000000000000"], db, j1939=True)
+    assert list(log.channels) == ["RequestedSpeed"]
+    assert log.channels["RequestedSpeed"].times.tolist() == [1.2]
+
+def test_sources_flag_extended_ids():
+    frames = CandumpLogSource().parse_chunk(["(1.0) can0 003#00", "(1.1) can0 00000003#00", \
+        "(1.2) can0 18FEF100#00"])
+    assert frames.ids.tolist() == [0x003, CAN_EFF_FLAG | 0x003, CAN_EFF_FLAG | 0x18FEF100]
@@ -0,0 +1,46 @@
+import numpy as np
+from can_sources import CAN_EFF_FLAG, CandumpLogSource, KsuCsvSource
+
+CANDUMP_LINES = [
+    "(1631416514.717133) can0 0D2#0000FFFF10000000\n",
+    "(1631416514.717134) can0 18FEF100#0011\n",
+    "(1631416514.717135) can0 123##1AABB\n",
+    "(1631416514.717136) can0 7FF#\n",
+]
+
+KSU_LINES = [
+    "timestamp,id,dlc,data\n",
+    "1698184253123,0D4,8,0000000000000000\n",
+    "1698184253124,18FEF100,2,0011\r\n",
+    "1698184253125,0D5,0,\n",
+]
+
+def assert_frames(frames, stamps, ids, data):
+    assert np.array_equal(frames.stamps, stamps)
+    assert frames.ids.tolist() == ids
+    assert frames.data == data
+
+def test_candump_chunk():
+    source = CandumpLogSource()
+    assert source.split_chunk(CANDUMP_LINES) is not None
+    assert_frames(source.parse_chunk(CANDUMP_LINES), \
+        [1631416514.717133, 1631416514.717134, 1631416514.717135, 1631416514.717136], \
+        [0x0D2, CAN_EFF_FLAG | 0x18FEF100, 0x123, 0x7FF], \
+        ["0000FFFF10000000", "0011", "AABB", ""])
+
+def test_ksu_chunk():
+    source = KsuCsvSource()
+    assert source.split_chunk(KSU_LINES) is not None
+    assert_frames(source.parse_chunk(KSU_LINES), \
+        np.array([1698184253123, 1698184253124, 1698184253125]) * 1e-3, \
+        [0x0D4, CAN_EFF_FLAG | 0x18FEF100, 0x0D5], ["0000000000000000", "0011", ""])
+
+def test_irregular_chunks_parsed_line_by_line():
+    for source, lines in [(CandumpLogSource(), CANDUMP_LINES), (KsuCsvSource(), KSU_LINES)]:
+        irregular = lines + ["\n", "garbage line\n", "1,2\n"] + lines[1:]
+        assert source.split_chunk(irregular) is None
+
+        frames = source.parse_chunk(irregular)
+        expected = source.parse_chunk(lines[1:])
+        assert len(frames) == len(source.parse_chunk(lines)) + len(expected)
+        assert frames.data[-len(expected):] == expected.data
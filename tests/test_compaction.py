@@ -0,0 +1,48 @@
+import numpy as np
+from compaction import find_redundant_channels, plan_compaction
+from data_log import Channel, DataLog
+
+def make_log(**channels):
+    """ Returns a DataLog of float channels, each given as (times, values). """
+    log = DataLog("test")
+    for name, (times, values) in channels.items():
+        channel = Channel(name, "", float, 0)
+        channel.data.assign(np.asarray(times, dtype=np.float64), \
+            np.asarray(values, dtype=np.float64))
+        log.channels[name] = channel
+    return log
+
+def test_constant_from_start():
+    log = make_log(a=(np.arange(10.0), np.arange(10.0)), c=(np.arange(10.0), np.full(10, 5.0)))
+    assert find_redundant_channels(log).constants == {"c": 5.0}
+
+def test_late_channel_isnt_constant():
+    # Resampling fills in zeros before the first message, so the channel goes from 0 to 5
+    log = make_log(a=(np.arange(10.0), np.arange(10.0)), \
+        c=(np.arange(5.0, 10.0), np.full(5, 5.0)))
+    assert find_redundant_channels(log).constants == {}
+
+    log.resample(1.0)
+    assert log.channels["c"].values[0] == 0 and log.channels["c"].values[-1] == 5
+
+def test_late_zero_channel_is_constant():
+    log = make_log(a=(np.arange(10.0), np.arange(10.0)), \
+        c=(np.arange(5.0, 10.0), np.zeros(5)))
+    assert find_redundant_channels(log).constants == {"c": 0.0}
+
+def test_late_channel_within_output_window_is_constant():
+    log = make_log(a=(np.arange(10.0), np.arange(10.0)), \
+        c=(np.arange(5.0, 10.0), np.full(5, 5.0)))
+    assert find_redundant_channels(log, start=6.0).constants == {"c": 5.0}
+
+def test_duplicates_and_policies():
+    times = np.arange(10.0)
+    log = make_log(a=(times, np.sin(times)), b=(times, np.sin(times)), \
+        c=(times, np.cos(times)), d=(times, np.full(10, 2.0)))
+    redundant = find_redundant_channels(log)
+    assert redundant.duplicates == {"b": "a"}
+
+    report = plan_compaction(log, "low_rate", "alias", 100, 10)
+    assert report.action("b") == "alias" and report.action("d") == "low_rate"
+    assert report.action("a") is None and report.action("c") is None
+    assert report.bytes_saved == 4 * (100 + 90)
@@ -0,0 +1,75 @@
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from conversion_server import ConversionServer
+from data_log import DataLog
+
+@pytest.fixture
+def server():
+    # The workers aren't started, requests with bad parameters must be rejected before needing one
+    server = ConversionServer(port=0)
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.close()
+
+@pytest.mark.parametrize("frequency", ["0", "-5", "nan", "inf", "fast"])
+def test_bad_frequency_is_rejected(server, frequency):
+    url = server.address + "/convert?log_type=CSV&frequency=" + frequency
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(urllib.request.Request(url, data=b"Time,A\n0,1\n"))
+    assert error.value.code == 400
+
+    # Requests are counted once their response has been sent
+    for i in range(50):
+        with urllib.request.urlopen(server.address + "/metrics") as response:
+            metrics = json.load(response)
+        if metrics["bad_requests"]:
+            break
+        time.sleep(0.02)
+    assert metrics["bad_requests"] == 1 and metrics["failed"] == 0
+
+@pytest.fixture
+def running_server():
+    server = ConversionServer(port=0, workers=1)
+    server.start_workers()
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.close()
+
+def convert_csv(server):
+    csv = "Time,RPM,Speed\n" + "".join("%.2f,%d,%d\n" % (i / 10, 1000 + i, i) for i in range(21))
+    url = server.address + "/convert?log_type=CSV&frequency=10&driver=Test"
+    with urllib.request.urlopen(urllib.request.Request(url, data=csv.encode())) as response:
+        return response.read()
+
+def test_convert_csv(running_server):
+    log = DataLog()
+    log.from_ld_file(io.BytesIO(convert_csv(running_server)))
+    assert sorted(log.channels) == ["RPM", "Speed"]
+    assert log.channels["RPM"].values.tolist() == [1000 + i for i in range(20)]
+    assert log.channels["Speed"].values.tolist() == list(range(20))
+
+def test_broken_workers_are_restarted(running_server):
+    # Kill the only worker, which breaks the pool
+    with pytest.raises(BrokenProcessPool):
+        running_server._executor.submit(os._exit, 1).result()
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        convert_csv(running_server)
+    assert error.value.code == 500
+
+    # The next request gets a new worker
+    assert len(convert_csv(running_server)) > 0
+    with urllib.request.urlopen(running_server.address + "/metrics") as response:
+        metrics = json.load(response)
+    assert metrics["failed"] == 1 and metrics["bad_requests"] == 0
@@ -0,0 +1,32 @@
+import threading
+import pytest
+from dbc_cache import DbcCache
+
+DBC = """VERSION ""
+
+BU_: ECU
+
+BO_ 212 Engine: 8 ECU
+ SG_ RPM : 0|16@1+ (1,0) [0|8000] "rpm" ECU
+"""
+
+@pytest.mark.parametrize("database", [lambda: None, threading.Lock(), {"local": type("Local", \
+    (object,), {})}])
+def test_unpicklable_database_isnt_cached(tmp_path, capsys, database):
+    cache = DbcCache(str(tmp_path))
+    cache._save("key", database)
+    assert "Failed to cache DBC" in capsys.readouterr().out
+    assert list(tmp_path.iterdir()) == []
+
+def test_load_without_cache_file(tmp_path, monkeypatch):
+    dbc_path = tmp_path / "test.dbc"
+    dbc_path.write_text(DBC)
+    cache_dir = tmp_path / "cache"
+
+    def fail(*args, **kwargs):
+        raise TypeError("cannot pickle")
+    monkeypatch.setattr("pickle.dump", fail)
+
+    can_db = DbcCache(str(cache_dir)).load(str(dbc_path))
+    assert can_db.get_message_by_name("Engine").frame_id == 212
+    assert list(cache_dir.iterdir()) == []
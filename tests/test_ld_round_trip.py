@@ -0,0 +1,48 @@
+import numpy as np
+from data_log import Channel, DataLog, resample_count
+from motec_log import MotecLog
+
+def write_ld(path, num_samples, frequency):
+    log = DataLog("test")
+    channel = Channel("Speed", "km/h", float, 0)
+    times = np.arange(num_samples) / frequency
+    channel.data.assign(times, np.round(times * 10))
+    log.channels["Speed"] = channel
+
+    motec_log = MotecLog()
+    motec_log.initialize()
+    motec_log.add_channel(channel, frequency=frequency)
+    motec_log.write(str(path))
+
+def test_resample_count_tolerates_rounding():
+    # 61 / 7 * 7 is just short of 61 in floating point
+    assert 7 * (61 / 7) < 61
+    assert resample_count(0.0, 61 / 7, 7) == 61
+    assert resample_count(0.0, 0.5, 20) == 10
+
+def test_ld_round_trip_keeps_samples(tmp_path):
+    path = tmp_path / "log.ld"
+    write_ld(path, 1805, 20)
+
+    log = DataLog()
+    log.from_ld_file(str(path))
+    assert log.end() == 1805 / 20
+
+    log.resample(20)
+    assert len(log.channels["Speed"]) == 1805
+
+def test_joined_ld_segments_keep_samples(tmp_path):
+    segments = []
+    for i in range(3):
+        path = tmp_path / ("log%d.ld" % i)
+        write_ld(path, 61, 7)
+        segment = DataLog()
+        segment.from_ld_file(str(path))
+        segments.append(segment)
+
+    log = DataLog()
+    log.concatenate(segments, relative=[True] * 3)
+    assert np.allclose(np.diff(log.channels["Speed"].times), 1 / 7)
+
+    log.resample(7)
+    assert len(log.channels["Speed"]) == 3 * 61
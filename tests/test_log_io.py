@@ -0,0 +1,22 @@
+import gzip
+import io
+import pytest
+from log_io import open_log
+
+def test_corrupt_gzip_raises_on_every_read(tmp_path):
+    path = tmp_path / "corrupt.log.gz"
+    data = gzip.compress(b"(0.0) can0 123#00\n" * 100000)
+    path.write_bytes(data[:len(data) // 2] + b"\0" * 64)
+
+    with open_log(str(path), "rb") as f:
+        with pytest.raises(Exception):
+            while f.read(1 << 16):
+                pass
+        # The decompression thread has stopped, reading again must not block
+        with pytest.raises(Exception):
+            f.read(1 << 16)
+
+def test_prefetched_stream_reads_everything():
+    data = b"0123456789" * 100000
+    with open_log(io.BytesIO(data), "rb", prefetch=True) as f:
+        assert f.read() == data
@@ -0,0 +1,35 @@
+import numpy as np
+from data_log import DataLog
+
+def make_log(name, messages):
+    log = DataLog(name)
+    log.add_channel("Speed", "km/h", float, 0)
+    for timestamp, value in messages:
+        log.add_message("Speed", timestamp, value)
+    return log
+
+def test_merge_interleaves_messages_in_order():
+    first = make_log("a", [(0.0, 1), (1.0, 2), (2.0, 3), (2.0, 4)])
+    second = make_log("b", [(0.5, 10), (1.0, 20), (2.0, 30), (3.0, 40)])
+
+    log = DataLog()
+    log.merge([first, second], ["a", "b"], collisions="merge")
+    channel = log.channels["Speed"]
+    assert channel.times.tolist() == [0.0, 0.5, 1.0, 1.0, 2.0, 2.0, 2.0, 3.0]
+    # Messages with the same timestamp keep the order of their logs
+    assert channel.values.tolist() == [1, 10, 2, 20, 3, 4, 30, 40]
+
+def test_merge_spilled_channels_on_disc():
+    logs = []
+    for i in range(3):
+        times = np.arange(1000) * 3 + i
+        logs.append(make_log(str(i), zip(times.tolist(), times.tolist())))
+        logs[-1].channels["Speed"].data.spill()
+
+    log = DataLog(memory_budget=0)
+    log.merge(logs, ["0", "1", "2"], collisions="merge")
+    channel = log.channels["Speed"]
+    assert channel.data._path is not None
+    assert channel.times.tolist() == list(range(3000))
+    assert channel.values.tolist() == list(range(3000))
+    log.close()
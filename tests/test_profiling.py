@@ -0,0 +1,22 @@
+import json
+from profiling import PipelineProfiler
+
+def run_stage(profiler):
+    profiler.start()
+    with profiler.stage("work") as stage:
+        data = [bytearray(1 << 20)]
+        stage.rows = len(data)
+    profiler.stop()
+    return profiler.to_dict()["stages"][0]
+
+def test_untracked_memory_is_null(tmp_path):
+    profiler = PipelineProfiler(track_memory=False)
+    assert run_stage(profiler)["peak_memory"] is None
+    assert "n/a" in str(profiler)
+
+    path = tmp_path / "metrics.json"
+    profiler.write_json(str(path))
+    assert json.loads(path.read_text())["stages"][0]["peak_memory"] is None
+
+def test_tracked_memory_is_measured():
+    assert run_stage(PipelineProfiler(track_memory=True))["peak_memory"] >= 1 << 20
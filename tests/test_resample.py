@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from data_log import Channel, fir_taps
+
+def make_channel(times, values, data_type=float):
+    channel = Channel("test", "", data_type, 0)
+    channel.data.assign(np.asarray(times, dtype=np.float64), np.asarray(values, dtype=np.float64))
+    return channel
+
+def test_hold_step():
+    channel = make_channel([0, 1, 2, 3], [0, 0, 10, 10])
+    channel.resample(0, 3, 2, mode="hold")
+    assert channel.values.tolist() == [0, 0, 0, 0, 10, 10]
+
+def test_linear_step():
+    channel = make_channel([0, 1, 2, 3], [0, 0, 10, 10])
+    channel.resample(0, 3, 2, mode="linear")
+    assert np.allclose(channel.times, [0, 0.5, 1, 1.5, 2, 2.5])
+    assert np.allclose(channel.values, [0, 0, 0, 5, 10, 10])
+
+def test_average_of_known_windows():
+    # Messages between the window edges, at 1 kHz, so each 10 Hz window holds exactly 100
+    times = (np.arange(1000) + 0.5) / 1000
+    channel = make_channel(times, np.arange(1000))
+    channel.resample(0, 1, 10, mode="average")
+    assert np.allclose(channel.values[1:], np.arange(100, 1000, 100) - 0.5)
+
+def test_average_holds_through_empty_windows():
+    channel = make_channel([0, 1, 2], [1, 2, 3])
+    channel.resample(0, 2, 10, mode="average")
+    assert channel.values.tolist() == [1] * 10 + [2] * 10
+
+def test_average_nan_only_affects_its_window():
+    times = (np.arange(1000) + 0.5) / 1000
+    values = np.ones(1000)
+    values[520] = np.nan
+    channel = make_channel(times, values)
+    channel.resample(0, 1, 10, mode="average")
+    assert np.isnan(channel.values[5])
+    assert np.all(np.delete(channel.values, 5) == 1)
+
+def test_fir_taps():
+    taps = fir_taps(20)
+    assert len(taps) % 2 == 1
+    assert np.allclose(taps, taps[::-1])
+    assert taps.sum() == pytest.approx(1)
+    assert fir_taps(1) is None and fir_taps(0.5) is None
+
+def test_fir_has_no_lag():
+    # A ramp goes through a symmetric filter unchanged, any lag would offset it. The ends are padded
+    # with the first and last values, so only the filter's half width (40 ms) from them is bent.
+    times = np.arange(10000) / 1000
+    channel = make_channel(times, times)
+    channel.resample(0, 10, 50, mode="fir")
+    assert np.allclose(channel.values[3:-3], channel.times[3:-3], atol=1e-9)
+    assert np.allclose(channel.values, channel.times, atol=5e-3)
+
+def test_fir_ends_are_finite():
+    times = np.arange(10000) / 1000
+    channel = make_channel(times, np.full(10000, 3.0))
+    channel.resample(0, 10, 50, mode="fir")
+    assert np.all(np.isfinite(channel.values))
+    assert np.allclose(channel.values, 3)
+
+def test_fir_removes_aliasing():
+    # 180 Hz sampled at 50 Hz would alias to 20 Hz, with hold it comes straight through
+    times = np.arange(10000) / 1000
+    values = np.sin(2 * np.pi * times) + 0.5 * np.sin(2 * np.pi * 180 * times)
+    errors = {}
+    for mode in ["hold", "fir"]:
+        channel = make_channel(times, values)
+        channel.resample(0, 10, 50, mode=mode)
+        errors[mode] = np.abs(channel.values - np.sin(2 * np.pi * channel.times))[5:-5].max()
+    assert errors["hold"] > 0.4 and errors["fir"] < 0.05
+
+def test_integer_channels_are_held():
+    channel = make_channel([0, 1, 2, 3], [0, 0, 10, 10], int)
+    channel.resample(0, 3, 2, mode="linear")
+    assert channel.values.tolist() == [0, 0, 0, 0, 10, 10]
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        make_channel([0, 1], [0, 1]).resample(0, 1, 2, mode="cubic")